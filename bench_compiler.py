@@ -0,0 +1,46 @@
+#!/usr/bin/env python3
+'''Бенчмарк второго этапа компиляции: разрешение меток в текстовой программе
+растущего размера. Время на одну инструкцию не должно расти с размером
+программы.
+'''
+import sys
+import time
+
+from rustyc.backend import process
+
+
+def generate(size: int) -> str:
+    '''Generates program of given number of instructions: a chain of blocks
+    with backward and forward jumps.
+
+    :param size: number of instructions
+    :type size: int
+
+    :return: program with textual labels
+    :rtype: str
+    '''
+    lines = ['\tcall main', '\tstop', 'main:']
+    blocks = (size - 3) // 4
+    for i in range(blocks):
+        lines.extend([f'.{i}_lbl:', '\tload 0', '\tjift .{0}_lbl'.format(i + 1),
+                      f'\tjmp .{i}_lbl', '\tnop'])
+    lines.extend([f'.{blocks}_lbl:', '\tret'])
+    return '\n'.join(lines)
+
+
+def main() -> int:
+    sizes = [ 10 ** power for power in range(3, 7) ]
+    if len(sys.argv) > 1:
+        sizes = list(map(int, sys.argv[1:]))
+    print(f'{"instructions":>12} {"seconds":>10} {"ns/instruction":>15}')
+    for size in sizes:
+        source = generate(size)
+        start = time.perf_counter()
+        process(source)
+        elapsed = time.perf_counter() - start
+        print(f'{size:>12} {elapsed:>10.3f} {elapsed / size * 1e9:>15.1f}')
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
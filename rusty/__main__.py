@@ -6,11 +6,15 @@ import os
 import errno
 import sys
 import argparse
+import json
 import pathlib
 import pprint
 
+from . import container
 from .vm import VM
-from .decenc import encode_program, parse_program, decode_program
+from .asm import AssemblyError, assemble
+from .decenc import encode_single, decode_program, iter_decode, \
+    iter_decode_compact, collect_targets, disassemble
 
 
 def run(args: argparse.Namespace) -> int:
@@ -27,20 +31,31 @@ def run(args: argparse.Namespace) -> int:
         return errno.ENOENT
 
     with open(args.bytecode, 'rb') as fp:
-        program = decode_program(fp.read())
-
-    vm = VM(args.verbose)
-    vm.load_program(program)
+        is_container = container.is_container(fp.read(len(container.MAGIC)))
+    functions = []
+    if is_container:
+        loaded = container.load(args.bytecode)
+        program, entry, functions = loaded.code, loaded.entry, loaded.functions
+    else:
+        with open(args.bytecode, 'rb') as fp:
+            program, entry = decode_program(fp.read()), 0
+
+    vm = VM(args.verbose, profile=args.profile is not None)
+    vm.load_program(program, entry)
     try:
         vm.run()
     finally:
         print(vm.info_operands())
         print(vm.info_frames())
+        if vm.profile is not None:
+            with open(args.profile, 'w', encoding='utf-8') as out:
+                json.dump(vm.profile.to_dict(program, functions), out, indent=1)
     return 0
 
 
 def encode(args: argparse.Namespace) -> int:
-    '''Encodes textual list of instructions to binary file.
+    '''Assembles textual list of instructions with labels and comments to
+    binary file.
 
     :param args: command-line arguments
     :type args: class:`argparse.Namespace`
@@ -52,20 +67,32 @@ def encode(args: argparse.Namespace) -> int:
         print('File', args.source, 'not found')
         return errno.ENOENT
 
-    instructions = []
     with open(args.source, encoding='utf-8') as fp:
-        instructions.extend(parse_program(fp.readlines()))
-    if args.print_parse:
-        pprint.pprint(instructions)
-        return 0
-
-    with open(args.destination, 'wb') as fp:
-        fp.write(encode_program(instructions))
+        try:
+            instructions = assemble(fp)
+            if args.print_parse:
+                pprint.pprint(list(instructions))
+                return 0
+            with open(args.destination, 'wb') as out:
+                if args.compact:
+                    out.write(container.pack(container.Container(list(instructions)),
+                                             compact=True))
+                    return 0
+                for instruction in instructions:
+                    out.write(encode_single(instruction))
+        except AssemblyError as e:
+            print(f'{args.source}:', e, file=sys.stderr)
+            if not args.print_parse and os.path.isfile(args.destination):
+                os.remove(args.destination) # do not leave partial output
+            return errno.EINVAL
     return 0
 
 
 def decode(args: argparse.Namespace) -> int:
-    '''Decodes binary file with VM instructions to textual list of objects.
+    '''Disassembles binary file with VM instructions to textual assembly. File
+    is read twice by fixed-size chunks: first pass collects targets of call, tcall,
+    jmp, jift and jiff instructions, the second one writes instructions with symbolic
+    labels to the output.
 
     :param args: command-line arguments
     :type args: class:`argparse.Namespace`
@@ -77,8 +104,33 @@ def decode(args: argparse.Namespace) -> int:
         print('File', args.bytecode, 'not found')
         return errno.ENOENT
 
-    with open(args.bytecode, mode='rb') as fp:
-        pprint.pprint(decode_program(fp.read()))
+    out = sys.stdout
+    if args.output is not None:
+        out = open(args.output, 'w', encoding='utf-8')
+    try:
+        with open(args.bytecode, mode='rb') as fp:
+            offset, limit, names, decoder = 0, None, None, iter_decode
+            prefix = fp.read(container.HEADER.size)
+            if container.is_container(prefix):
+                header = container.parse_header(prefix)
+                fp.seek(0)
+                functions = container.parse_functions(fp.read(header.code_offset),
+                                                      header)
+                offset = header.code_offset
+                limit = header.debug_offset - header.code_offset
+                names = { fn.address: fn.name for fn in functions }
+                if header.flags & container.FLAG_COMPACT:
+                    decoder = iter_decode_compact
+            fp.seek(offset)
+            calls, jumps, count = collect_targets(decoder(fp, limit=limit))
+            fp.seek(offset)
+            for line in disassemble(decoder(fp, limit=limit), calls, jumps,
+                                    count, names):
+                out.write(line + '\n')
+    finally:
+        if out is not sys.stdout:
+            out.close()
+    return 0
 
 
 def args_parser() -> argparse.ArgumentParser:
@@ -95,15 +147,20 @@ def args_parser() -> argparse.ArgumentParser:
                           help='path to bytecode in binary format')
     runner_p.add_argument('--verbose', '-v', action='store_true',
                           help='print ip and instruction on execution')
+    runner_p.add_argument('--profile', '-p', type=pathlib.Path, metavar='OUT',
+                          help='save execution profile in JSON: hits of every '
+                               'address and taken ratios of branches')
     runner_p.set_defaults(func=run)
 
-    encoder_p = subp.add_parser('encode', help='translates source from text to binary')
+    encoder_p = subp.add_parser('encode', help='assembles source from text to binary')
     encoder_p.add_argument('source', type=pathlib.Path, metavar='SOURCE',
                            help='path to source in text format')
     encoder_p.add_argument('destination', type=pathlib.Path, metavar='DEST',
                            help='where to save resulting binary')
     encoder_p.add_argument('--print-parse', '-p', action='store_true',
                            help='skips encoding, only prints parsed instructions')
+    encoder_p.add_argument('--compact', '-c', action='store_true',
+                           help='saves container with variable-length instructions')
     encoder_p.set_defaults(func=encode)
 
     decoder_p = subp.add_parser('decode', help='translates bytecode from binary to text')
@@ -0,0 +1,128 @@
+#!/usr/bin/env python3
+'''Ассемблер текстовых программ для стековой виртуальной машины. В отличие от
+`rusty.decenc.parse_program` понимает метки (`name:`), комментарии (от `#` или
+`;` до конца строки) и метки в аргументах инструкций call, tcall, jmp, jift
+и jiff.
+
+Ассемблер двухпроходный: на первом проходе каждая строка разбивается на токены
+ровно один раз, а адреса меток запоминаются. На втором проходе метки в
+аргументах заменяются разностью адреса метки и адреса инструкции, а инструкции
+отдаются потребителю по одной, по мере построения.
+'''
+from typing import Iterable, Iterator, NamedTuple, Optional, Union
+
+from . import isa
+from .decenc import INSTRUCTIONS_NAMES, parse_integer
+
+
+LABEL_OPERANDS = (isa.Opcode.CALL, isa.Opcode.TCALL, isa.Opcode.JMP, isa.Opcode.JIFT,
+                  isa.Opcode.JIFF)
+COMMENT_STARTS = ('#', ';')
+
+
+class AssemblyError(Exception):
+    '''Thrown if source cannot be assembled. Holds the number of line where
+    the error occurred.
+    '''
+    def __init__(self, line_no: int, message: str):
+        '''Constructor
+
+        :param line_no: number of line in source starting from 1
+        :type line_no: int
+        :param message: description of the error
+        :type message: str
+        '''
+        super().__init__(f'line {line_no}: {message}')
+        self.line_no = line_no
+
+
+class Statement(NamedTuple):
+    '''Tokenized source line: labels defined on the line, instruction class and
+    its operand (integer or label name) if any.
+    '''
+    line_no: int
+    labels: tuple[str, ...]
+    cls: Optional[type]
+    operand: Optional[Union[int, str]]
+
+
+def tokenize_line(line_no: int, line: str) -> Statement:
+    '''Splits a single source line into labels, instruction and its operand.
+
+    :param line_no: number of line in source
+    :type line_no: int
+    :param line: source line
+    :type line: str
+
+    :return: tokenized line
+    :rtype: class:`rusty.asm.Statement`
+    '''
+    for comment_start in COMMENT_STARTS:
+        line = line.split(comment_start, 1)[0]
+    tokens = line.split()
+
+    labels = []
+    while tokens and tokens[0].endswith(':'):
+        label = tokens.pop(0)[:-1]
+        if not label:
+            raise AssemblyError(line_no, 'empty label')
+        labels.append(label)
+    if not tokens:
+        return Statement(line_no, tuple(labels), None, None)
+
+    mnemonic, operands = tokens[0], tokens[1:]
+    opcode = INSTRUCTIONS_NAMES.get(mnemonic, None)
+    if opcode is None:
+        raise AssemblyError(line_no, f'unknown instruction {mnemonic!r}')
+    cls = isa.INSTRUCTIONS_MAP[opcode]
+    if len(operands) != cls.nargs():
+        raise AssemblyError(line_no, f'{mnemonic} expects {cls.nargs()} '
+                            f'argument(s), got {len(operands)}')
+    if not operands:
+        return Statement(line_no, tuple(labels), cls, None)
+
+    try:
+        operand = parse_integer(operands[0])
+    except ValueError:
+        if opcode not in LABEL_OPERANDS:
+            raise AssemblyError(line_no, f'invalid integer {operands[0]!r}')
+        operand = operands[0]
+    return Statement(line_no, tuple(labels), cls, operand)
+
+
+def assemble(lines: Iterable[str]) -> Iterator[isa.Instruction]:
+    '''Assembles textual program into VM instructions. Numerical arguments of
+    call, tcall, jmp, jift and jiff are treated as already resolved relative
+    offsets.
+
+    :param lines: source lines
+    :type lines: Iterable[str]
+
+    :return: generator of VM instructions
+    :rtype: Iterator[class:`rusty.isa.Instruction`]
+    '''
+    labels = {}
+    statements = []
+    ip = 0
+    for line_no, line in enumerate(lines, 1):
+        statement = tokenize_line(line_no, line)
+        for label in statement.labels:
+            if label in labels:
+                raise AssemblyError(line_no, f'duplicate label {label!r}')
+            labels[label] = ip
+        if statement.cls is None:
+            continue
+        statements.append(statement)
+        ip += 1
+
+    for ip, statement in enumerate(statements):
+        if statement.operand is None:
+            yield statement.cls()
+            continue
+        operand = statement.operand
+        if isinstance(operand, str):
+            if operand not in labels:
+                raise AssemblyError(statement.line_no,
+                                    f'undefined label {operand!r}')
+            operand = labels[operand] - ip
+        yield statement.cls(operand)
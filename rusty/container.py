@@ -0,0 +1,268 @@
+#!/usr/bin/env python3
+'''Модуль, описывающий версионируемый контейнер байткода. Контейнер состоит из:
+
++ заголовка - магическое число, версия, флаги, точка входа, смещения и размеры
+  секций, контрольная сумма;
++ таблицы функций - имя, адрес, число параметров, число локальных переменных и
+  максимальная глубина стека операндов;
++ секции кода - последовательность 64-битных слов, выровненная по границе слова,
+  что позволяет декодировать ее прямо из отображенного в память файла, либо
+  инструкции в компактной форме переменной длины (флаг FLAG_COMPACT);
++ необязательной отладочной секции - соответствие адресов инструкций строкам
+  исходного кода.
+
+Контрольная сумма (CRC32) считается по всему содержимому после заголовка.
+'''
+import mmap
+import struct
+import zlib
+from dataclasses import dataclass, field
+from typing import Optional
+
+from . import isa
+from . import traps
+from .decenc import WORD_SIZE, encode_program, decode_program, \
+    encode_compact, decode_compact
+
+
+MAGIC = b'RSTY'
+VERSION = 1
+CODE_ALIGNMENT = WORD_SIZE
+
+FLAG_DEBUG = 1 << 0
+FLAG_COMPACT = 1 << 1
+KNOWN_FLAGS = FLAG_DEBUG | FLAG_COMPACT
+
+# magic, version, flags, entry, functions offset, functions count,
+# code offset, code count (instructions), debug offset, debug count, checksum.
+# Code section spans till the debug section.
+HEADER = struct.Struct('<4sHHQIIIIIII')
+# address, parameters, locals, max stack, name length; followed by name
+FUNCTION = struct.Struct('<QIIIH')
+# address, source line
+LINE = struct.Struct('<QI')
+
+
+@dataclass
+class FunctionEntry:
+    '''Describes a single function of the program: its name, address of its
+    first instruction, number of parameters, number of local variables (not
+    including parameters) and maximum depth of the operands stack that the
+    function reaches without its callees.
+    '''
+    name: str
+    address: int
+    parameters: int = 0
+    locals: int = 0
+    max_stack: int = 0
+
+
+@dataclass
+class Container:
+    '''Loaded or ready to be saved program. Lines are pairs of instruction's
+    address and source line sorted by address, every pair covers instructions
+    up to the next pair.
+    '''
+    code: list[isa.Instruction]
+    entry: int = 0
+    functions: list[FunctionEntry] = field(default_factory=list)
+    lines: list[tuple[int, int]] = field(default_factory=list)
+
+    def function_at(self, address: int) -> Optional[FunctionEntry]:
+        '''Looks up for the function that contains instruction at address.
+
+        :param self: container
+        :type self: class:`rusty.container.Container`
+        :param address: address of instruction
+        :type address: int
+
+        :return: function entry or None if address is outside of any function
+        :rtype: Optional[class:`rusty.container.FunctionEntry`]
+        '''
+        found = None
+        for function in self.functions:
+            if function.address <= address \
+                    and (found is None or function.address > found.address):
+                found = function
+        return found
+
+
+def _align(offset: int, alignment: int) -> int:
+    return (offset + alignment - 1) // alignment * alignment
+
+
+def is_container(prefix: bytes) -> bool:
+    '''Checks if byte-sequence starts with container's magic number.
+
+    :param prefix: first bytes of file
+    :type prefix: bytes
+
+    :return: true if bytes belong to the container, false otherwise
+    :rtype: bool
+    '''
+    return bytes(prefix[:len(MAGIC)]) == MAGIC
+
+
+def pack(container: Container, compact: bool = False) -> bytes:
+    '''Serializes container to bytes.
+
+    :param container: program with its metadata
+    :type container: class:`rusty.container.Container`
+    :param compact: encode code section in compact variable-length form
+    :type compact: bool, default False
+
+    :return: array of bytes
+    :rtype: bytes
+    '''
+    functions = bytearray()
+    for function in container.functions:
+        name = function.name.encode('utf-8')
+        functions += FUNCTION.pack(function.address, function.parameters,
+                                   function.locals, function.max_stack,
+                                   len(name))
+        functions += name
+
+    functions_offset = HEADER.size
+    code_offset = _align(functions_offset + len(functions), CODE_ALIGNMENT)
+    code = (encode_compact if compact else encode_program)(container.code)
+    debug_offset = code_offset + len(code)
+    debug = b''.join(LINE.pack(address, line) for address, line in container.lines)
+
+    body = bytearray(functions)
+    body += bytes(code_offset - functions_offset - len(functions))
+    body += code
+    body += debug
+
+    flags = FLAG_DEBUG if container.lines else 0
+    if compact:
+        flags |= FLAG_COMPACT
+    header = HEADER.pack(MAGIC, VERSION, flags, container.entry,
+                         functions_offset, len(container.functions),
+                         code_offset, len(container.code),
+                         debug_offset, len(container.lines),
+                         zlib.crc32(body))
+    return header + bytes(body)
+
+
+@dataclass
+class Header:
+    '''Parsed container's header: offsets are counted from the beginning of the
+    container, counts are numbers of elements in sections.
+    '''
+    version: int
+    flags: int
+    entry: int
+    functions_offset: int
+    functions_count: int
+    code_offset: int
+    code_count: int
+    debug_offset: int
+    debug_count: int
+    checksum: int
+
+
+def parse_header(buffer: bytes) -> Header:
+    '''Parses and validates container's header.
+
+    :param buffer: at least first `HEADER.size` bytes of container
+    :type buffer: bytes
+
+    :return: parsed header
+    :rtype: class:`rusty.container.Header`
+    '''
+    if len(buffer) < HEADER.size or not is_container(buffer):
+        raise traps.InvalidContainerTrap('bad magic')
+    header = Header(*HEADER.unpack_from(buffer)[1:])
+    if header.version != VERSION:
+        raise traps.InvalidContainerTrap(f'unsupported version {header.version}')
+    if header.flags & ~KNOWN_FLAGS:
+        raise traps.InvalidContainerTrap(f'unknown flags {header.flags:#x}')
+    if header.code_offset % CODE_ALIGNMENT != 0:
+        raise traps.InvalidContainerTrap('code section is not aligned')
+    return header
+
+
+def parse_functions(buffer: bytes, header: Header) -> list[FunctionEntry]:
+    '''Parses function table of container.
+
+    :param buffer: at least first `header.code_offset` bytes of container
+    :type buffer: bytes
+    :param header: parsed header
+    :type header: class:`rusty.container.Header`
+
+    :return: function table
+    :rtype: list[class:`rusty.container.FunctionEntry`]
+    '''
+    functions = []
+    offset = header.functions_offset
+    try:
+        for _ in range(header.functions_count):
+            address, parameters, locals_, max_stack, name_length \
+                = FUNCTION.unpack_from(buffer, offset)
+            offset += FUNCTION.size
+            name = bytes(buffer[offset:offset + name_length]).decode('utf-8')
+            offset += name_length
+            functions.append(FunctionEntry(name, address, parameters, locals_,
+                                           max_stack))
+    except struct.error:
+        raise traps.InvalidContainerTrap('function table is out of bounds')
+    return functions
+
+
+def unpack(buffer: bytes) -> Container:
+    '''Deserializes container from any object that supports buffer protocol.
+    Code section is decoded in-place without copying.
+
+    :param buffer: serialized container
+    :type buffer: bytes
+
+    :return: program with its metadata
+    :rtype: class:`rusty.container.Container`
+    '''
+    view = memoryview(buffer)
+    header = parse_header(view)
+    if zlib.crc32(view[HEADER.size:]) != header.checksum:
+        raise traps.InvalidContainerTrap('checksum mismatch')
+    code_end = header.debug_offset
+    debug_end = header.debug_offset + header.debug_count * LINE.size
+    if code_end < header.code_offset or debug_end > len(view):
+        raise traps.InvalidContainerTrap('section is out of bounds')
+
+    functions = parse_functions(view, header)
+    lines = []
+    if header.flags & FLAG_DEBUG:
+        lines = [ LINE.unpack_from(view, header.debug_offset + i * LINE.size)
+                  for i in range(header.debug_count) ]
+
+    if header.flags & FLAG_COMPACT:
+        code = decode_compact(view[header.code_offset:code_end])
+    else:
+        code = decode_program(view[header.code_offset:code_end])
+    if len(code) != header.code_count:
+        raise traps.InvalidContainerTrap('code section size mismatch')
+    return Container(code, header.entry, functions, lines)
+
+
+def load(path: str) -> Container:
+    '''Loads container from file by mapping it into memory.
+
+    :param path: path to the file with container
+    :type path: str
+
+    :return: program with its metadata
+    :rtype: class:`rusty.container.Container`
+    '''
+    with open(path, 'rb') as fp:
+        if fp.seek(0, 2) < HEADER.size:
+            raise traps.InvalidContainerTrap('file is too short')
+        with mmap.mmap(fp.fileno(), 0, access=mmap.ACCESS_READ) as mapped:
+            view = memoryview(mapped)
+            try:
+                return unpack(view)
+            except traps.Trap as e:
+                # frames of the traceback keep views of the mapping, so the
+                # mapping could not be closed
+                trap = e.with_traceback(None)
+            finally:
+                view.release()
+        raise trap
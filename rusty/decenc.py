@@ -3,7 +3,7 @@
 текстового в бинарный формат и наоборот.
 '''
 import struct
-from typing import TypeVar
+from typing import BinaryIO, Iterable, Iterator, Optional, TypeVar
 
 from . import isa
 from . import traps
@@ -11,6 +11,8 @@ from . import traps
 
 OPCODE_MASK = (1 << 8) - 1
 PADDING_MASK = (1 << 56) - 1
+WORD_SIZE = 8
+CHUNK_SIZE = WORD_SIZE * 4096
 
 INSTRUCTIONS_NAMES = {
     'nop':   isa.Opcode.NOP,
@@ -47,6 +49,12 @@ INSTRUCTIONS_NAMES = {
     'jmp':   isa.Opcode.JMP,
     'jift':  isa.Opcode.JIFT,
     'stop':  isa.Opcode.STOP,
+    'tcall': isa.Opcode.TCALL,
+    'jiff':  isa.Opcode.JIFF,
+}
+
+INSTRUCTIONS_MNEMONICS = {
+    opcode: name for name, opcode in INSTRUCTIONS_NAMES.items()
 }
 
 
@@ -96,6 +104,27 @@ def encode_program(instructions: list[isa.Instruction]) -> bytes:
     return b''.join(map(encode_single, instructions))
 
 
+def parse_integer(literal: str) -> int:
+    '''Parses integer literal in decimal, hexadecimal (0x), octal (0o) or
+    binary (0b) notation. Underscores between digits are allowed.
+
+    :param literal: textual integer literal, possibly with sign
+    :type literal: str
+
+    :return: parsed integer
+    :rtype: int
+    '''
+    literal = literal.replace('_', '')
+    sign = 1
+    if literal.startswith('-'):
+        sign, literal = -1, literal[1:]
+    elif literal.startswith('+'):
+        literal = literal[1:]
+    if literal[:2].lower() in ('0x', '0o', '0b'):
+        return sign * int(literal, 0)
+    return sign * int(literal, 10)
+
+
 def parse_program(lines: list[str]) -> list[isa.Instruction]:
     '''Parses textual program into list of VM instructions
 
@@ -117,7 +146,7 @@ def parse_program(lines: list[str]) -> list[isa.Instruction]:
             raise Exception # unknown opcode encountered
 
         if cls.nargs() > 0:
-            args = list(map(int, parts[1:]))
+            args = list(map(parse_integer, parts[1:]))
             instructions.append(cls(*args))
             continue
         instructions.append(cls())
@@ -125,17 +154,15 @@ def parse_program(lines: list[str]) -> list[isa.Instruction]:
     return instructions
 
 
-def decode_single(bytes: bytes) -> isa.Instruction:
-    '''Decodes 8 bytes to VM instruction.
+def decode_word(raw_ins: int) -> isa.Instruction:
+    '''Decodes 64-bit word to VM instruction.
 
-    :param bytes: 8 bytes
-    :type bytes: bytes
+    :param raw_ins: encoded instruction
+    :type raw_ins: int
 
     :return: VM instruction
     :rtype: class:`rusty.isa.Instruction`
     '''
-    assert len(bytes) == 8
-    raw_ins = struct.unpack('<Q', bytes)[0]
     opcode = isa.Opcode((raw_ins >> 56) & OPCODE_MASK)
     arg = raw_ins & PADDING_MASK
     if arg & ((PADDING_MASK + 1) >> 1):
@@ -147,8 +174,312 @@ def decode_single(bytes: bytes) -> isa.Instruction:
         raise traps.IllegalInstructionTrap
 
 
+def decode_single(bytes: bytes) -> isa.Instruction:
+    '''Decodes 8 bytes to VM instruction.
+
+    :param bytes: 8 bytes
+    :type bytes: bytes
+
+    :return: VM instruction
+    :rtype: class:`rusty.isa.Instruction`
+    '''
+    assert len(bytes) == 8
+    return decode_word(struct.unpack('<Q', bytes)[0])
+
+
 def decode_program(bytes: bytes) -> list[isa.Instruction]:
-    '''Decodes bytes-sequence into list of VM instructions.
+    '''Decodes bytes-sequence into list of VM instructions. Accepts any object
+    that supports buffer protocol, so sections of memory-mapped files are
+    decoded without copying.
+
+    :param bytes: bytes-sequence
+    :type bytes: bytes
+
+    :return: list of VM instructions
+    :rtype: list[class:`rusty.isa.Instruction`]
+    '''
+    return [ decode_word(word) for (word,) in struct.iter_unpack('<Q', bytes) ]
+
+
+def iter_decode(fp: BinaryIO, chunk_size: int = CHUNK_SIZE,
+                limit: Optional[int] = None) -> Iterator[isa.Instruction]:
+    '''Lazily decodes VM instructions from binary stream. Stream is read by
+    chunks of fixed size, so only a single chunk is kept in memory at once.
+
+    :param fp: binary stream with encoded instructions
+    :type fp: class:`typing.BinaryIO`
+    :param chunk_size: number of bytes to read at once
+    :type chunk_size: int, default CHUNK_SIZE
+    :param limit: maximum number of bytes to read, till the end of stream if
+    not specified
+    :type limit: Optional[int], default None
+
+    :return: generator of VM instructions
+    :rtype: Iterator[class:`rusty.isa.Instruction`]
+    '''
+    chunk_size = max(WORD_SIZE, chunk_size - chunk_size % WORD_SIZE)
+    tail = b''
+    while limit is None or limit > 0:
+        chunk = fp.read(chunk_size if limit is None else min(chunk_size, limit))
+        if not chunk:
+            break
+        if limit is not None:
+            limit -= len(chunk)
+        if tail:
+            chunk = tail + chunk
+        end = len(chunk) - len(chunk) % WORD_SIZE
+        for (word,) in struct.iter_unpack('<Q', memoryview(chunk)[:end]):
+            yield decode_word(word)
+        tail = chunk[end:]
+    if tail:
+        raise traps.IllegalInstructionTrap # truncated instruction at the end
+
+
+def relative_target(address: int, instruction: isa.Instruction) -> int:
+    '''Calculates absolute address that jmp, jift, jiff, call or tcall
+    instruction refers to.
+
+    :param address: address of the instruction
+    :type address: int
+    :param instruction: instruction with relative address as argument
+    :type instruction: class:`rusty.isa.Instruction`
+
+    :return: absolute address of the target
+    :rtype: int
+    '''
+    offset = int(instruction.args()[0])
+    if offset >= (1 << 63):
+        offset -= (1 << 64)
+    return address + offset
+
+
+def collect_targets(instructions: Iterable[isa.Instruction]) -> tuple[set[int], set[int], int]:
+    '''Collects absolute addresses of subprograms (call and tcall targets) and
+    of jump targets (jmp, jift and jiff) in a single pass over instructions.
+
+    :param instructions: VM instructions
+    :type instructions: Iterable[class:`rusty.isa.Instruction`]
+
+    :return: call targets, jump targets and the number of instructions
+    :rtype: (set[int], set[int], int)
+    '''
+    calls, jumps = set(), set()
+    count = 0
+    for address, instruction in enumerate(instructions):
+        count = address + 1
+        opcode = instruction.opcode()
+        if opcode in (isa.Opcode.CALL, isa.Opcode.TCALL):
+            calls.add(relative_target(address, instruction))
+        elif opcode in (isa.Opcode.JMP, isa.Opcode.JIFT, isa.Opcode.JIFF):
+            jumps.add(relative_target(address, instruction))
+    return calls, jumps, count
+
+
+def call_label(address: int) -> str:
+    '''Builds label name for subprogram at address.
+
+    :param address: absolute address of subprogram
+    :type address: int
+
+    :return: label name
+    :rtype: str
+    '''
+    return f'fn_{address}'
+
+
+def jump_label(address: int) -> str:
+    '''Builds label name for jump target at address.
+
+    :param address: absolute address of jump target
+    :type address: int
+
+    :return: label name
+    :rtype: str
+    '''
+    return f'.{address}_lbl'
+
+
+def disassemble(instructions: Iterable[isa.Instruction], calls: set[int],
+                jumps: set[int], count: int,
+                names: Optional[dict[int, str]] = None) -> Iterator[str]:
+    '''Translates VM instructions back to textual assembly line by line. The
+    arguments of call, tcall, jmp, jift and jiff instructions are replaced
+    with symbolic labels, so the output has the same format as the output of
+    `rustyc -f`.
+
+    :param instructions: VM instructions
+    :type instructions: Iterable[class:`rusty.isa.Instruction`]
+    :param calls: absolute addresses of subprograms
+    :type calls: set[int]
+    :param jumps: absolute addresses of jump targets
+    :type jumps: set[int]
+    :param count: number of instructions, targets outside [0; count] are left
+    as relative numbers
+    :type count: int
+    :param names: known names of subprograms by their addresses
+    :type names: Optional[dict[int, str]], default None
+
+    :return: generator of assembly lines
+    :rtype: Iterator[str]
+    '''
+    names = names or {}
+
+    def _call_label(address: int) -> str:
+        return names.get(address) or call_label(address)
+
+    def _labels(address: int) -> Iterator[str]:
+        if address in calls or address in names:
+            yield _call_label(address) + ':'
+        if address in jumps:
+            yield jump_label(address) + ':'
+
+    for address, instruction in enumerate(instructions):
+        yield from _labels(address)
+        opcode = instruction.opcode()
+        mnemonic = INSTRUCTIONS_MNEMONICS[opcode]
+        if instruction.nargs() == 0:
+            yield '\t' + mnemonic
+            continue
+        argument = str(int(instruction.args()[0]))
+        if opcode in (isa.Opcode.CALL, isa.Opcode.TCALL, isa.Opcode.JMP, isa.Opcode.JIFT,
+                      isa.Opcode.JIFF):
+            target = relative_target(address, instruction)
+            argument = str(target - address)
+            if 0 <= target <= count:
+                argument = (jump_label if opcode in (isa.Opcode.JMP, isa.Opcode.JIFT, isa.Opcode.JIFF)
+                            else _call_label)(target)
+        yield '\t' + mnemonic + ' ' + argument
+    yield from _labels(count)
+
+
+def zigzag(number: int) -> int:
+    '''Maps signed integer to unsigned one, so that numbers with small absolute
+    values have small codes: 0 -> 0, -1 -> 1, 1 -> 2, -2 -> 3 and so on.
+
+    :param number: signed 64-bit integer
+    :type number: int
+
+    :return: unsigned 64-bit integer
+    :rtype: int
+    '''
+    return ((number << 1) ^ (number >> 63)) & ((1 << 64) - 1)
+
+
+def unzigzag(number: int) -> int:
+    '''Reverses `zigzag` mapping.
+
+    :param number: unsigned 64-bit integer
+    :type number: int
+
+    :return: signed 64-bit integer
+    :rtype: int
+    '''
+    return (number >> 1) ^ -(number & 1)
+
+
+def encode_compact_single(instruction: isa.Instruction) -> bytes:
+    '''Encodes single VM instruction in compact variable-length form: one byte
+    of opcode followed by zig-zag LEB128 varint of the argument for the
+    instructions that have one.
+
+    :param instruction: single VM instruction
+    :type instruction: class:`rusty.isa.Instruction`
+
+    :return: array of bytes
+    :rtype: bytes
+    '''
+    encoded = bytearray([instruction.opcode() & OPCODE_MASK])
+    if instruction.nargs() == 0:
+        return bytes(encoded)
+    arg = int(instruction.args()[0])
+    if arg >= (1 << 63):
+        arg -= (1 << 64)
+    arg = zigzag(arg)
+    while arg >= 0x80:
+        encoded.append((arg & 0x7f) | 0x80)
+        arg >>= 7
+    encoded.append(arg)
+    return bytes(encoded)
+
+
+def encode_compact(instructions: list[isa.Instruction]) -> bytes:
+    '''Encodes list of VM instructions to compact variable-length form.
+
+    :param instructions: list of VM instructions
+    :type instructions: list[class:`rusty.isa.Instruction`]
+
+    :return: array of bytes
+    :rtype: bytes
+    '''
+    return b''.join(map(encode_compact_single, instructions))
+
+
+def _iter_compact(chunks: Iterable[bytes]) -> Iterator[isa.Instruction]:
+    '''Decodes instructions in compact form from sequence of byte chunks.
+    Instruction may be split between adjacent chunks.
+
+    :param chunks: sequence of byte chunks
+    :type chunks: Iterable[bytes]
+
+    :return: generator of VM instructions
+    :rtype: Iterator[class:`rusty.isa.Instruction`]
+    '''
+    cls, value, shift = None, 0, 0
+    for chunk in chunks:
+        for byte in chunk:
+            if cls is None:
+                cls = isa.INSTRUCTIONS_MAP.get(byte, None)
+                if cls is None:
+                    raise traps.IllegalInstructionTrap
+                if cls.nargs() == 0:
+                    yield cls()
+                    cls = None
+                continue
+            value |= (byte & 0x7f) << shift
+            shift += 7
+            if byte & 0x80:
+                if shift >= 70:
+                    raise traps.IllegalInstructionTrap # varint is too long
+                continue
+            yield cls(unzigzag(value))
+            cls, value, shift = None, 0, 0
+    if cls is not None:
+        raise traps.IllegalInstructionTrap # truncated instruction at the end
+
+
+def iter_decode_compact(fp: BinaryIO, chunk_size: int = CHUNK_SIZE,
+                        limit: Optional[int] = None) -> Iterator[isa.Instruction]:
+    '''Lazily decodes VM instructions in compact form from binary stream by
+    chunks of fixed size.
+
+    :param fp: binary stream with encoded instructions
+    :type fp: class:`typing.BinaryIO`
+    :param chunk_size: number of bytes to read at once
+    :type chunk_size: int, default CHUNK_SIZE
+    :param limit: maximum number of bytes to read, till the end of stream if
+    not specified
+    :type limit: Optional[int], default None
+
+    :return: generator of VM instructions
+    :rtype: Iterator[class:`rusty.isa.Instruction`]
+    '''
+    def _chunks() -> Iterator[bytes]:
+        remaining = limit
+        while remaining is None or remaining > 0:
+            chunk = fp.read(chunk_size if remaining is None
+                            else min(chunk_size, remaining))
+            if not chunk:
+                break
+            if remaining is not None:
+                remaining -= len(chunk)
+            yield chunk
+
+    return _iter_compact(_chunks())
+
+
+def decode_compact(bytes: bytes) -> list[isa.Instruction]:
+    '''Expands program in compact form to the list of VM instructions, so
+    the instructions are addressed in constant time as with fixed-width form.
 
     :param bytes: bytes-sequence
     :type bytes: bytes
@@ -156,5 +487,4 @@ def decode_program(bytes: bytes) -> list[isa.Instruction]:
     :return: list of VM instructions
     :rtype: list[class:`rusty.isa.Instruction`]
     '''
-    return list(map(decode_single,
-                    [ bytes[0 + i:8 + i] for i in range(0, len(bytes), 8) ]))
+    return list(_iter_compact([bytes]))
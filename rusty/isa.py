@@ -51,6 +51,8 @@ class Opcode(IntEnum):
     JMP = auto()
     JIFT = auto()
     STOP = auto()
+    TCALL = auto()
+    JIFF = auto()
     _MAXOP = auto()
 
 
@@ -758,6 +760,48 @@ class Return(Instruction):
         return 0
 
 
+class TailCall(Instruction):
+    '''Calls a subprogram instead of the current one. Reuses the top of the
+    call frames stack: its variables are dropped, so the subprogram rebinds its
+    parameters from the operands stack into an empty frame, and its return
+    address is kept, so the subprogram returns right to the caller of the
+    current one. Jumps to the subprogram address (instruction's argument). If
+    call frames stack is empty then throws class:`rusty.traps.StackUnderflowTrap`.
+    '''
+    def __init__(self, arg: int):
+        self.arg = force_uint64(arg)
+
+    @classmethod
+    def opcode(cls) -> Opcode:
+        return Opcode.TCALL
+
+    def args(self) -> list[np.uint64]:
+        return [self.arg]
+
+    def execute(self, ctx: Context) -> bool:
+        '''Replaces the current subprogram with the called one.
+
+        :param self: instance of TailCall instruction
+        :type self: class:`rusty.isa.TailCall`
+        :param ctx: calculation context
+        :type ctx: class:`rusty.isa.Context`
+
+        :return: false - VM should not stop after execution of the tail call
+        instructions
+        :rtype: bool
+        '''
+        try:
+            ctx.frames[-1].variables = {}
+        except IndexError:
+            raise traps.StackUnderflowTrap
+        ctx.ip = ctx.ip - 1 + self.arg
+        return False
+
+    @classmethod
+    def nargs(cls) -> int:
+        return 1
+
+
 class Jump(Instruction):
     '''Jumps to the address that is relative to the current IP by the number
     that is encoded in this instruction as argument.
@@ -809,6 +853,35 @@ class JumpIfTrue(Instruction):
         return 1
 
 
+class JumpIfFalse(Instruction):
+    '''Pops boolean value from the operands stack and jumps to relative to
+    the current IP address if and only if popped value is equal to zero.
+    Throws class:`rusty.traps.StackUnderflowTrap` if stack is empty.
+    '''
+    def __init__(self, arg: int):
+        self.arg = force_uint64(arg)
+
+    @classmethod
+    def opcode(cls) -> Opcode:
+        return Opcode.JIFF
+
+    def args(self) -> list[np.uint64]:
+        return [self.arg]
+
+    def execute(self, ctx: Context) -> bool:
+        try:
+            cond = ctx.operands_stack.pop()
+            if cond == 0:
+                ctx.ip = ctx.ip - 1 + self.arg
+        except IndexError:
+            raise traps.StackUnderflowTrap
+        return False
+
+    @classmethod
+    def nargs(cls) -> int:
+        return 1
+
+
 class Stop(Instruction):
     '''Stops the subsequent instructions execution.
     '''
@@ -874,5 +947,7 @@ INSTRUCTIONS_MAP = {
         Jump,
         JumpIfTrue,
         Stop,
+        TailCall,
+        JumpIfFalse,
     ]
 }
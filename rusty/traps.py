@@ -6,7 +6,8 @@
 1. попытка получения операнда из пустого стека;
 2. попытка выполнить инструкцию по некорретному адресу - за пределами памяти;
 3. попытка декодировать неизвестную (некорректную) инструкцию;
-4. попытка деления на ноль - справедливо для инструкций div и mod.
+4. попытка деления на ноль - справедливо для инструкций div и mod;
+5. попытка загрузить поврежденный или несовместимый контейнер байткода.
 '''
 
 class Trap(Exception):
@@ -47,3 +48,10 @@ class ZeroDivisionTrap(Trap):
     executing div or mod instruction.
     '''
     pass
+
+
+class InvalidContainerTrap(Trap):
+    '''Thrown while loading bytecode container if its header is malformed,
+    version is not supported or checksum does not match the content.
+    '''
+    pass
@@ -1,7 +1,8 @@
 #!/usr/bin/env python3
 '''Стековая виртуальная машина и все, что с ней связано.
 '''
-from typing import Tuple
+from collections import Counter
+from typing import Iterable, Optional, Tuple
 import numpy as np
 
 
@@ -43,6 +44,63 @@ class StackView:
         return '\n'.join([ '#' + str(i) + '\t' + elem.__repr__() for i, elem in enumerate(self._stack) ])
 
 
+class Profile:
+    '''Execution profile of the program: number of executions of every
+    instruction and number of taken conditional branches (jift and jiff).
+    '''
+    BRANCHES = (isa.Opcode.JIFT, isa.Opcode.JIFF)
+
+    def __init__(self):
+        self.hits: Counter = Counter()
+        self.taken: Counter = Counter()
+
+    def record(self, address: int, instruction: isa.Instruction, ip: int):
+        '''Counts execution of the instruction.
+
+        :param self: profile
+        :type self: class:`rusty.vm.Profile`
+        :param address: address of the executed instruction
+        :type address: int
+        :param instruction: executed instruction
+        :type instruction: class:`rusty.isa.Instruction`
+        :param ip: value of IP after execution
+        :type ip: int
+        '''
+        self.hits[address] += 1
+        if instruction.opcode() in self.BRANCHES and ip != address + 1:
+            self.taken[address] += 1
+
+    def to_dict(self, program: list[isa.Instruction],
+                functions: Iterable = ()) -> dict:
+        '''Builds JSON-compatible form of the profile: functions with their
+        addresses and sizes, hit counts by address and for every executed
+        branch the number of times it was taken.
+
+        :param self: profile
+        :type self: class:`rusty.vm.Profile`
+        :param program: profiled program
+        :type program: list[class:`rusty.isa.Instruction`]
+        :param functions: function table of the program
+        :type functions: Iterable[class:`rusty.container.FunctionEntry`]
+
+        :return: profile
+        :rtype: dict
+        '''
+        functions = sorted(functions, key=lambda fn: fn.address)
+        ends = [ fn.address for fn in functions[1:] ] + [len(program)]
+        return {
+            'functions': [ { 'name': fn.name, 'address': fn.address,
+                             'size': end - fn.address }
+                           for fn, end in zip(functions, ends) ],
+            'hits': { str(address): count
+                      for address, count in sorted(self.hits.items()) },
+            'branches': { str(address): { 'taken': self.taken[address],
+                                          'count': count }
+                          for address, count in sorted(self.hits.items())
+                          if program[address].opcode() in self.BRANCHES },
+        }
+
+
 class VM:
     '''Stack-based virtual machine that is able to:
 
@@ -51,25 +109,29 @@ class VM:
     3. manage breakpoints
     4. control the execution of the instructions (execute single, or until stop)
     '''
-    def __init__(self, debug: bool = False):
+    def __init__(self, debug: bool = False, profile: bool = False):
         self.ctx = None
         self.program = []
         self.is_halted = True
         self.breakpoints = []
         self.breaklines = set()
         self.debug = debug
+        self.profile: Optional[Profile] = Profile() if profile else None
 
-    def load_program(self, program: list[isa.Instruction]):
+    def load_program(self, program: list[isa.Instruction], entry: int = 0):
         '''Stores list of instructions as the current program of the VM.
 
         :param self: instance of VM
         :type self: class:`rusty.vm.VM`
         :param program: list of VM instructions
         :type program: list[class:`rusty.isa.Instruction`]
+        :param entry: address of the first instruction to execute
+        :type entry: int, default 0
         '''
         self.program = program
         self.is_halted = False
         self.ctx = isa.Context()
+        self.ctx.ip = np.uint64(entry)
 
     def info_breakpoints(self) -> list[Tuple[int, isa.Instruction]]:
         '''Lists created breakpoints.
@@ -191,11 +253,14 @@ class VM:
         for _ in range(times):
             if self.ctx.ip < 0 or self.ctx.ip >= len(self.program):
                 raise traps.InvalidAddressTrap(self.ctx.ip)
+            address = int(self.ctx.ip)
             self.ctx.ip += 1
-            instruction = self.program[self.ctx.ip - 1]
+            instruction = self.program[address]
             if self.debug:
-                print(f'{(self.ctx.ip - 1):016x}:', instruction, sep='\t')
+                print(f'{address:016x}:', instruction, sep='\t')
             self.is_halted = instruction.execute(self.ctx)
+            if self.profile is not None:
+                self.profile.record(address, instruction, int(self.ctx.ip))
 
     def continue_(self):
         '''Continues program execution till the stop instruction or any
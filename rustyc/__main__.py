@@ -1,19 +1,33 @@
 #!/usr/bin/env python3
 '''Главный модуль пакета компилятора языка Rusty, транслирующего подмножество
-языка Rust в инструкции стековой виртуальной машины в виде текста.
+языка Rust в инструкции стековой виртуальной машины в виде текста. Команда
+`rustyc link` компонует объектные файлы в программу (см. `rustyc.linker`).
 '''
 import os
 import sys
 import errno
 import argparse
 import pathlib
+from collections import Counter
+from typing import Callable, Optional
+try:
+    import resource
+except ImportError: # not available on Windows, --max-rss is not supported
+    resource = None
 import antlr4
 
+from rusty import container, isa
+from rusty.asm import AssemblyError
+
 from .libs.RustyLexer import RustyLexer
 from .libs.RustyParser import RustyParser
 
-from .frontend import FERListener
-from .backend import process
+from .frontend import FERListener, FnMeta, translate
+from . import cache, cse, dce, inline, layout, licm, linker, liveness, partial, \
+    peephole, pgo, ssaopt, unroll
+from .passes import Compilation, Pass, PassManager
+from .backend import process, assemble, max_stack_depth
+from .ir import Item, serialize
 
 
 def args_parser() -> argparse.ArgumentParser:
@@ -23,7 +37,8 @@ def args_parser() -> argparse.ArgumentParser:
     :return: arguments parser
     :rtype: class:`argparse.ArgumentParser`
     '''
-    p = argparse.ArgumentParser('rustyc')
+    p = argparse.ArgumentParser('rustyc',
+        epilog='Objects built with --emit obj are linked by `rustyc link OBJECT...`')
 
     # Options:
     p.add_argument('--output', '-o', type=pathlib.Path, metavar='PATH',
@@ -32,43 +47,410 @@ def args_parser() -> argparse.ArgumentParser:
                    help='Exclude backend-stage, only frontend')
     p.add_argument('--ip', '-i', action='store_true',
                    help='Prepend instruction pointer value for current instruction at backend')
+    p.add_argument('--emit', choices=('asm', 'bin', 'obj'), default='asm',
+                   help='Output format: textual assembly, bytecode container or '
+                        'relocatable object without main, default asm')
+    p.add_argument('--compact', '-c', action='store_true',
+                   help='Use variable-length instructions in bytecode container')
+    p.add_argument('--max-rss', action='store_true',
+                   help='Report peak resident set size of compiler to stderr')
+    p.add_argument('-O', type=int, choices=range(4), default=0, metavar='LEVEL',
+                   dest='opt_level', help='Optimization level from 0 to 3, default 0')
+    p.add_argument('--max-inline-growth', type=int, default=inline.DEFAULT_MAX_GROWTH,
+                   metavar='PERCENT',
+                   help='Limit of program growth caused by inlining at -O2 and above, '
+                        f'default {inline.DEFAULT_MAX_GROWTH}%%')
+    p.add_argument('--unroll-factor', type=int, default=unroll.DEFAULT_UNROLL_FACTOR,
+                   metavar='N',
+                   help='Number of copies of counted loops\' bodies at -O3, '
+                        f'default {unroll.DEFAULT_UNROLL_FACTOR}')
+    p.add_argument('--max-unroll-size', type=int,
+                   default=unroll.DEFAULT_MAX_UNROLLED_SIZE, metavar='N',
+                   help='Limit of instructions in unrolled loop\'s bodies at -O3, '
+                        f'default {unroll.DEFAULT_MAX_UNROLLED_SIZE}')
+    p.add_argument('--eval-budget', type=int, default=partial.DEFAULT_BUDGET,
+                   metavar='N',
+                   help='Limit of instructions executed by compile-time evaluation of '
+                        f'a call at -O2 and above, default {partial.DEFAULT_BUDGET}')
+    p.add_argument('--cache-dir', type=pathlib.Path, metavar='DIR',
+                   help='Directory of incremental compilation cache: unchanged functions '
+                        'are not translated again')
+    p.add_argument('--profile-use', type=pathlib.Path, metavar='PROFILE',
+                   help='Guide inlining, block layout and loop unrolling by execution '
+                        'profile of the program built with -O0 --emit bin, see '
+                        '`rusty run --profile`')
+    p.add_argument('--opt-report', action='store_true',
+                   help='Report instructions removed by every optimization rule to stderr')
+    p.add_argument('--time-passes', action='store_true',
+                   help='Report wall time and instructions before and after every pass to stderr')
+    p.add_argument('--disable-pass', action='append', default=[], metavar='NAME',
+                   choices=sorted({ stage.name for stage in pipeline()
+                                    if stage.optimization }),
+                   help='Skip optimization pass, may be repeated: %(choices)s')
 
     # Arguments:
     p.add_argument('file', type=pathlib.Path, help='Path to source file')
     return p
 
 
+def link_args_parser() -> argparse.ArgumentParser:
+    '''Builds arguments parser of `rustyc link` command.
+
+    :return: arguments parser
+    :rtype: class:`argparse.ArgumentParser`
+    '''
+    p = argparse.ArgumentParser('rustyc link',
+                                description='Links object files into bytecode container')
+    p.add_argument('--output', '-o', type=pathlib.Path, metavar='PATH',
+                   help='Path to output file, default stdout')
+    p.add_argument('--compact', '-c', action='store_true',
+                   help='Use variable-length instructions in bytecode container')
+    p.add_argument('objects', type=pathlib.Path, nargs='+', metavar='OBJECT',
+                   help='Paths to object files built with --emit obj')
+    return p
+
+
+def build_container(program: list[Item], functions: dict[str, FnMeta],
+                    relocations: Optional[list[tuple[int, str]]] = None) -> container.Container:
+    '''Resolves labels of program and builds bytecode container with function
+    table and source lines of functions.
+
+    :param program: labels and instructions after frontend-stage
+    :type program: list[Item]
+    :param functions: functions' metadata collected by frontend
+    :type functions: dict[str, class:`rustyc.frontend.FnMeta`]
+    :param relocations: if it is given, calls of undefined functions are
+    left unresolved and appended to it
+    :type relocations: Optional[list[(int, str)]]
+
+    :return: bytecode container
+    :rtype: class:`rusty.container.Container`
+    '''
+    code, labels = assemble(program, relocations)
+
+    metas = sorted(functions.values(), key=lambda fn: labels[fn.name])
+    addresses = [ labels[fn.name] for fn in metas ] + [len(code)]
+    callees = { labels[fn.name]: len(fn.parameters) for fn in metas }
+    entries = []
+    for i, fn in enumerate(metas):
+        begin, end = addresses[i], addresses[i + 1]
+        # optimizations can share slots between variables and drop them
+        slots = { int(ins.args()[0]) for ins in code[begin:end]
+                  if ins.opcode() in (isa.Opcode.LOAD, isa.Opcode.STORE) }
+        entries.append(container.FunctionEntry(fn.name, begin,
+            len(fn.parameters), max(0, len(slots) - len(fn.parameters)),
+            max_stack_depth(code, begin, end, len(fn.parameters), callees)))
+    lines = [ (labels[fn.name], fn.line) for fn in metas ]
+    return container.Container(code, 0, entries, lines)
+
+
+def max_rss() -> Optional[int]:
+    '''Measures peak resident set size of the current process.
+
+    :return: peak resident set size in kibibytes or None if it is unknown
+    :rtype: Optional[int]
+    '''
+    if resource is None:
+        return None
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    if sys.platform == 'darwin':
+        return peak // 1024 # reported in bytes
+    return peak
+
+
+def report(args: argparse.Namespace, removed: dict[str, Counter],
+           manager: PassManager):
+    '''Prints requested compiler statistics to stderr.
+
+    :param args: parsed command line arguments
+    :type args: class:`argparse.Namespace`
+    :param removed: number of instructions removed by every rule of every
+    optimization pass
+    :type removed: dict[str, class:`collections.Counter`]
+    :param manager: pass manager that compiled the program
+    :type manager: class:`rustyc.passes.PassManager`
+    '''
+    if args.opt_report:
+        for name, rules in removed.items():
+            for rule, count in rules.items():
+                print(f'{name}: {rule}: {count} removed', file=sys.stderr)
+    if args.time_passes:
+        for line in manager.report():
+            print(line, file=sys.stderr)
+    if args.max_rss:
+        peak = max_rss()
+        if peak is None:
+            print('max rss: unknown on this platform', file=sys.stderr)
+        else:
+            print('max rss:', peak, 'KiB', file=sys.stderr)
+
+
+def parse(path: pathlib.Path, fold_constants: bool,
+          cache_dir: Optional[pathlib.Path] = None,
+          entry: Optional[str] = 'main') -> tuple[list[Item], dict[str, FnMeta]]:
+    '''Parses source file and translates it to labels and instructions.
+
+    :param path: path to source file
+    :type path: class:`pathlib.Path`
+    :param fold_constants: fold constant expressions and conditions
+    :type fold_constants: bool
+    :param cache_dir: directory of functions' cache
+    :type cache_dir: Optional[class:`pathlib.Path`]
+    :param entry: function called by prologue, None for object file
+    :type entry: Optional[str], default 'main'
+
+    :return: program and functions' metadata
+    :rtype: (list[Item], dict[str, class:`rustyc.frontend.FnMeta`])
+    '''
+    lexer = RustyLexer(antlr4.FileStream(path, encoding='utf-8'))
+    token_stream = antlr4.CommonTokenStream(lexer)
+    parser = RustyParser(token_stream)
+
+    listener = FERListener(fold_constants=fold_constants, entry=entry)
+    if cache_dir is not None:
+        function_cache = cache.FunctionCache(cache_dir, fold_constants)
+        return cache.translate(parser, listener, function_cache), listener.functions
+    return translate(parser, listener), listener.functions
+
+
+def run_frontend(compilation: Compilation):
+    '''Translates source file, binds execution profile to its labels.
+
+    :param compilation: state of compilation
+    :type compilation: class:`rustyc.passes.Compilation`
+    '''
+    args = compilation.options
+    entry = None if args.emit == 'obj' else 'main'
+    compilation.program, compilation.functions = parse(args.file,
+        args.opt_level >= 1, args.cache_dir, entry)
+    if compilation.profile is not None:
+        # profile is recorded for the program built without optimizations
+        reference = compilation.program if args.opt_level == 0 \
+            else parse(args.file, False, args.cache_dir, entry)[0]
+        compilation.profile.bind(reference, compilation.program,
+                                 compilation.functions)
+
+
+def run_evaluate(compilation: Compilation) -> Counter:
+    '''Evaluates calls with constant arguments, see `rustyc.partial`.
+    '''
+    compilation.program, evaluated = partial.evaluate(compilation.program,
+        compilation.functions, compilation.options.eval_budget)
+    return evaluated
+
+
+def run_inline(compilation: Compilation) -> Counter:
+    '''Inlines small functions, see `rustyc.inline`.
+    '''
+    compilation.program, inlined = inline.inline(compilation.program,
+        compilation.functions, compilation.options.max_inline_growth,
+        compilation.profile)
+    return inlined
+
+
+def run_dce(compilation: Compilation) -> Counter:
+    '''Removes unreachable code and unused functions, see `rustyc.dce`.
+    '''
+    # all functions of object file are exported
+    roots = list(compilation.functions) if compilation.options.emit == 'obj' \
+        else ('main',)
+    compilation.program, live, removed = dce.eliminate(compilation.program,
+        compilation.functions, roots)
+    for name in set(compilation.functions) - live:
+        del compilation.functions[name]
+    return removed
+
+
+def run_peephole(compilation: Compilation) -> Counter:
+    '''Rewrites short instruction sequences, see `rustyc.peephole`.
+    '''
+    compilation.program, removed = peephole.optimize(compilation.program,
+                                                     keep=compilation.functions)
+    return removed
+
+
+def run_unroll(compilation: Compilation) -> Counter:
+    '''Unrolls counted loops, see `rustyc.unroll`.
+    '''
+    compilation.program, unrolled = unroll.unroll(compilation.program,
+        compilation.functions, compilation.options.unroll_factor,
+        compilation.options.max_unroll_size, compilation.profile)
+    return unrolled
+
+
+def run_layout(compilation: Compilation) -> Counter:
+    '''Threads jumps and lays out basic blocks, see `rustyc.layout`.
+    '''
+    compilation.program, removed = layout.arrange(compilation.program,
+        compilation.functions, compilation.profile)
+    return removed
+
+
+def program_pass(transform) -> Callable[[Compilation], Counter]:
+    '''Adapts optimization that takes program with functions' metadata and
+    returns new program with statistics.
+
+    :param transform: optimization
+    :type transform: Callable[[list[Item], dict[str, FnMeta]], (list[Item], Counter)]
+
+    :return: function of pass
+    :rtype: Callable[[class:`rustyc.passes.Compilation`], class:`collections.Counter`]
+    '''
+    def run(compilation: Compilation) -> Counter:
+        compilation.program, removed = transform(compilation.program,
+                                                 compilation.functions)
+        return removed
+    return run
+
+
+def resolve_labels(compilation: Compilation):
+    '''Resolves labels of the program: builds bytecode container or patches
+    textual program. Only frontend's output keeps labels.
+
+    :param compilation: state of compilation
+    :type compilation: class:`rustyc.passes.Compilation`
+    '''
+    args = compilation.options
+    if args.emit == 'bin':
+        compilation.resolved = build_container(compilation.program,
+                                               compilation.functions)
+        return
+    if args.emit == 'obj':
+        relocations = []
+        compilation.resolved = linker.ObjectFile(build_container(
+            compilation.program, compilation.functions, relocations), relocations)
+        return
+    compilation.resolved = serialize(compilation.program)
+    if not args.only_frontend:
+        compilation.resolved = process(compilation.resolved, should_prepend=args.ip)
+
+
+def emit(compilation: Compilation):
+    '''Produces output of compiler: packed bytecode container or text.
+
+    :param compilation: state of compilation
+    :type compilation: class:`rustyc.passes.Compilation`
+    '''
+    if compilation.options.emit == 'bin':
+        compilation.output = container.pack(compilation.resolved,
+                                            compact=compilation.options.compact)
+    elif compilation.options.emit == 'obj':
+        compilation.output = linker.pack(compilation.resolved)
+    else:
+        compilation.output = compilation.resolved
+
+
+def pipeline() -> list[Pass]:
+    '''Passes of compiler in order of execution with their optimization
+    levels. Peephole optimization also cleans up after other passes.
+
+    :return: passes
+    :rtype: list[class:`rustyc.passes.Pass`]
+    '''
+    return [
+        Pass('frontend', run_frontend, optimization=False),
+        Pass('evaluate', run_evaluate, 2),
+        Pass('inline', run_inline, 2),
+        Pass('dce', run_dce, 1),
+        Pass('cse', program_pass(cse.eliminate), 2),
+        Pass('peephole', run_peephole, 1),
+        Pass('licm', program_pass(licm.hoist), 2),
+        Pass('unroll', run_unroll, 3),
+        Pass('ssa', program_pass(ssaopt.optimize), 2),
+        Pass('liveness', program_pass(liveness.compact), 2),
+        Pass('peephole', run_peephole, 2),
+        Pass('layout', run_layout, 1),
+        Pass('peephole', run_peephole, 1),
+        Pass('resolve', resolve_labels, optimization=False),
+        Pass('emit', emit, optimization=False),
+    ]
+
+
+def write_binary(output: Optional[pathlib.Path], data: bytes):
+    '''Writes binary output to file or stdout.
+
+    :param output: path to output file, None for stdout
+    :type output: Optional[class:`pathlib.Path`]
+    :param data: output
+    :type data: bytes
+    '''
+    if output is None:
+        sys.stdout.buffer.write(data)
+    else:
+        with open(output, 'wb') as out:
+            out.write(data)
+
+
+def link(argv: list[str]) -> int:
+    '''Links object files into runnable bytecode container.
+
+    :param argv: arguments of `rustyc link` command
+    :type argv: list[str]
+
+    :return: error code - zero on success
+    :rtype: int
+    '''
+    args = link_args_parser().parse_args(argv)
+    objects = []
+    for path in args.objects:
+        if not os.path.isfile(path):
+            print('File', path, 'not found', file=sys.stderr)
+            return errno.ENOENT
+        try:
+            objects.append(linker.load(path))
+        except linker.LinkError as e:
+            print(f'{path}:', e, file=sys.stderr)
+            return errno.EINVAL
+    try:
+        program = linker.link(objects)
+    except linker.LinkError as e:
+        print('rustyc link:', e, file=sys.stderr)
+        return errno.EINVAL
+    write_binary(args.output, container.pack(program, compact=args.compact))
+    return 0
+
+
 def main() -> int:
     '''Main routine that implements compiler that parses input subrust program
     (taken from the argument) and translates it into textual stack-based VM
-    instructions.
+    instructions. Command `rustyc link` links object files instead.
 
     :return: error code - zero on success
     :rtype: int
     '''
+    if sys.argv[1:2] == ['link']:
+        return link(sys.argv[2:])
     args = args_parser().parse_args()
     if not os.path.isfile(args.file):
         print('File', args.file, 'not found', file=sys.stderr)
         return errno.ENOENT
 
-    out = sys.stdout
-    if args.output is not None:
-        out = open(args.output, 'w', encoding='utf-8')
-
-    lexer = RustyLexer(antlr4.FileStream(args.file, encoding='utf-8'))
-    token_stream = antlr4.CommonTokenStream(lexer)
-    parser = RustyParser(token_stream)
-
-    root_crate = parser.crate()
-    listener = FERListener()
-    walker = antlr4.ParseTreeWalker()
-    walker.walk(listener, root_crate)
+    manager = PassManager(pipeline(), args.opt_level, args.disable_pass)
+    compilation = Compilation(args)
+    if args.profile_use is not None:
+        if not os.path.isfile(args.profile_use):
+            print('File', args.profile_use, 'not found', file=sys.stderr)
+            return errno.ENOENT
+        try:
+            compilation.profile = pgo.load(args.profile_use)
+        except ValueError as e:
+            print(f'{args.profile_use}:', e, file=sys.stderr)
+            return errno.EINVAL
+    try:
+        manager.run(compilation)
+    except AssemblyError as e:
+        print(f'{args.file}:', e, file=sys.stderr)
+        return errno.EINVAL
 
-    source_code = listener.tree[root_crate]
-    if not args.only_frontend:
-        source_code = process(source_code, should_prepend=args.ip)
-    print(source_code, file=out)
-    out.close()
+    if args.emit in ('bin', 'obj'):
+        write_binary(args.output, compilation.output)
+    else:
+        out = sys.stdout
+        if args.output is not None:
+            out = open(args.output, 'w', encoding='utf-8')
+        print(compilation.output, file=out)
+        out.close()
+    report(args, compilation.removed, manager)
     return 0
 
 
@@ -1,9 +1,9 @@
 #!/usr/bin/env python3
 '''Модуль, реализующий второй этап трансляции входного файла в инструкции
 виртуальной машины. В который входит, разрешение текстовых меток в конкретные
-адреса. Функции данного модуля помогают пропатчить инструкции jmp, jift и call
-выходной программы, заменяя читаемые текстовые метки разностями между адресом
-метки в аргументе данной инструкции и адресом этой инструкции.
+адреса. Функции данного модуля помогают пропатчить инструкции jmp, jift, jiff,
+call и tcall выходной программы, заменяя читаемые текстовые метки разностями
+между адресом метки в аргументе данной инструкции и адресом этой инструкции.
 
 Например:
 ```
@@ -19,37 +19,13 @@
 0x2: ret       # main:
 ```
 '''
-from typing import Tuple
-from functools import reduce
+from typing import Iterable, Optional, Tuple
 
+from rusty import isa
+from rusty.asm import AssemblyError
+from rusty.decenc import INSTRUCTIONS_NAMES, relative_target
 
-StateT = Tuple[int, dict[str, int]]
-
-
-def is_label(line: str) -> bool:
-    '''Checks if current line in program is label and not an instruction
-
-    :param line: program's line
-    :type line: str
-
-    :return: true if line is label, false otherwise
-    :rtype: bool
-    '''
-    return line.endswith(':')
-
-
-def is_changes_ip(ins: str) -> bool:
-    '''Checks if instruction changes instruction pointer. True for any kind of
-    jumps and calling subprograms. Now returns true only for jmp, jift and call.
-
-    :param ins: VM instruction
-    :type ins: str
-
-    :return: true if instruction changes IP, false - otherwise
-    :rtype: bool
-    '''
-    return reduce(lambda res, prefix: res or ins.startswith(prefix),
-                  ['call', 'jmp', 'jift'], False)
+from .ir import Item, Label, Instr, LABEL_OPERANDS
 
 
 def prepend_ip(ip: int, line: str, should_prepend: bool) -> str:
@@ -70,64 +46,35 @@ def prepend_ip(ip: int, line: str, should_prepend: bool) -> str:
     return f'{ip}:{line}'
 
 
-def fold_labels(state: StateT, line: str) -> StateT:
-    '''Matches an IP to provided line and if line represents label then
-    function accumulates it to map of labels.
-
-    :param state: current value of IP and map of labels
-    :type state: StateT alias to (int, dict[str, int])
-    :param line: program's line
-    :type line: str
-
-    :return: updated state in dependence of label or not current line is
-    :rtype: StateT
-    '''
-    ip, labels = state
-    if not is_label(line):
-        return (ip + 1, labels)
-
-    label = line.rstrip(':').strip()
-    if label in labels:
-        raise Exception # duplicate label
-    labels[label] = ip
-    return (ip, labels)
-
-
-def process_instruction(ip: int, labels: dict[str, int], line: str,
-                        should_prepend: bool) -> str:
-    '''Patches a single instruction by prepending its address if required and
-    replaces labels with the relative address to these labels for jmp, jift and
-    call instructions.
+def render_jump(ip: int, indent: str, mnemonic: str, offset: int,
+                should_prepend: bool) -> str:
+    '''Renders jmp, jift, jiff, call or tcall instruction with resolved
+    relative offset.
 
-    :param ip: current IP value
+    :param ip: address of the instruction
     :type ip: int
-    :param labels: map of labels
-    :type labels: dict[str, int]
-    :param line: current instruction to patch
-    :type line: str
+    :param indent: leading whitespace of the source line
+    :type indent: str
+    :param mnemonic: name of the instruction
+    :type mnemonic: str
+    :param offset: difference between label's address and instruction's address
+    :type offset: int
     :param should_prepend: should enumerate line with its address
     :type should_prepend: bool
 
     :return: patched line
     :rtype: str
     '''
-    ins = line.strip()
-    if not is_changes_ip(ins):
-        return prepend_ip(ip, line, should_prepend)
-    ins, label = ins.split(' ', 1)
-    if label not in labels:
-        print(ip, ins, label, labels)
-        raise Exception # undefined label used
-
-    return prepend_ip(ip, line.replace(label, str(labels[label] - ip)),
-                      should_prepend)
+    return prepend_ip(ip, f'{indent}{mnemonic} {offset}', should_prepend)
 
 
 def process(source: str, should_prepend: bool = False) -> str:
-    '''Finds all labels in the program and matches them with its possible
-    address (instruction pointer). Then patches jmp, jift and call instructions
-    by replacing labels with the substraction between label's address and this
-    instruction's address.
+    '''Matches labels in the program with their addresses (instruction
+    pointers) and patches jmp, jift, jiff, call and tcall instructions by
+    replacing labels with the substraction between label's address and this
+    instruction's address. Every line is tokenized once, in a single pass:
+    instructions that refer to labels defined below are patched as soon as the
+    label is met. Blank lines are not instructions and are dropped.
 
     :param source: program
     :type source: str
@@ -138,15 +85,164 @@ def process(source: str, should_prepend: bool = False) -> str:
     :return: patched program with resolved labels
     :rtype: str
     '''
-    lines = source.split('\n')
-    _, labels = reduce(fold_labels, lines, (0, {}))
-
-    ip = 0
+    labels = {}
+    pending = {} # label -> [(line number, ip, indent, mnemonic)]
     instructions = []
-    for line in lines:
-        if is_label(line):
+    for line_no, line in enumerate(source.split('\n'), 1):
+        tokens = line.split()
+        if not tokens:
+            continue
+        if tokens[0].endswith(':'):
+            if len(tokens) != 1:
+                raise AssemblyError(line_no, 'label must be on its own line')
+            label = tokens[0][:-1]
+            if label in labels:
+                raise AssemblyError(line_no, f'duplicate label {label!r}')
+            ip = len(instructions)
+            labels[label] = ip
+            for _, ins_ip, indent, mnemonic in pending.pop(label, ()):
+                instructions[ins_ip] = render_jump(ins_ip, indent, mnemonic,
+                                                  ip - ins_ip, should_prepend)
             continue
-        instructions.append(process_instruction(ip, labels, line,
-                                                should_prepend))
-        ip += 1
+
+        mnemonic, operands = tokens[0], tokens[1:]
+        opcode = INSTRUCTIONS_NAMES.get(mnemonic, None)
+        if opcode is None:
+            raise AssemblyError(line_no, f'unknown instruction {mnemonic!r}')
+        nargs = isa.INSTRUCTIONS_MAP[opcode].nargs()
+        if len(operands) != nargs:
+            raise AssemblyError(line_no, f'{mnemonic} expects {nargs} '
+                                f'argument(s), got {len(operands)}')
+        ip = len(instructions)
+        if mnemonic not in LABEL_OPERANDS:
+            instructions.append(prepend_ip(ip, line, should_prepend))
+            continue
+
+        label = operands[0]
+        indent = line[:len(line) - len(line.lstrip())]
+        if label in labels:
+            instructions.append(render_jump(ip, indent, mnemonic,
+                                            labels[label] - ip, should_prepend))
+            continue
+        pending.setdefault(label, []).append((line_no, ip, indent, mnemonic))
+        instructions.append(None)
+
+    for label, uses in pending.items():
+        raise AssemblyError(uses[0][0], f'undefined label {label!r}')
     return '\n'.join(instructions)
+
+
+def assemble(items: Iterable[Item], relocations: Optional[list[Tuple[int, str]]] = None
+             ) -> Tuple[list[isa.Instruction], dict[str, int]]:
+    '''Resolves labels of structured program numerically and builds VM
+    instructions without going through textual form. Arguments of jmp, jift,
+    jiff, call and tcall become differences between the label's address and the address
+    of the instruction.
+
+    :param items: labels and instructions after frontend-stage
+    :type items: Iterable[Item]
+    :param relocations: if it is given, calls of undefined functions get zero
+    offsets and are appended to it as pairs of address and function's name
+    :type relocations: Optional[list[(int, str)]]
+
+    :return: VM instructions and addresses of labels
+    :rtype: (list[class:`rusty.isa.Instruction`], dict[str, int])
+    '''
+    items = [ item for item in items if isinstance(item, (Label, Instr)) ]
+    labels = {}
+    ip = 0
+    for item in items:
+        if isinstance(item, Instr):
+            ip += 1
+            continue
+        if item.name in labels:
+            raise Exception # duplicate label
+        labels[item.name] = ip
+
+    code = []
+    for item in items:
+        if isinstance(item, Label):
+            continue
+        opcode = INSTRUCTIONS_NAMES.get(item.op, None)
+        if opcode is None:
+            raise Exception # unknown instruction encountered
+        cls = isa.INSTRUCTIONS_MAP[opcode]
+        if cls.nargs() == 0:
+            code.append(cls())
+        elif item.op in LABEL_OPERANDS:
+            if item.arg not in labels and relocations is not None \
+                    and item.op in ('call', 'tcall'):
+                relocations.append((len(code), item.arg))
+                code.append(cls(0))
+            elif item.arg not in labels:
+                raise Exception # undefined label used
+            else:
+                code.append(cls(labels[item.arg] - len(code)))
+        elif isinstance(item.arg, int):
+            code.append(cls(item.arg))
+        else:
+            raise Exception # argument is not an integer
+    return code, labels
+
+
+STACK_EFFECTS = {
+    isa.Opcode.NOP: 0, isa.Opcode.PUSH: 1, isa.Opcode.POP: -1,
+    isa.Opcode.SWAP: 0, isa.Opcode.DUP: 1, isa.Opcode.INC: 0,
+    isa.Opcode.DEC: 0, isa.Opcode.NEG: 0, isa.Opcode.NOT: 0,
+    isa.Opcode.LOAD: 1, isa.Opcode.STORE: -1, isa.Opcode.RET: 0,
+    isa.Opcode.JMP: 0, isa.Opcode.JIFT: -1, isa.Opcode.STOP: 0,
+    isa.Opcode.JIFF: -1,
+}
+
+
+def max_stack_depth(code: list[isa.Instruction], begin: int, end: int,
+                    parameters: int, callees: dict[int, int]) -> int:
+    '''Estimates maximum depth of the operands stack that function reaches
+    without its callees. Function's arguments are counted as already pushed.
+    Every call consumes callee's arguments and is supposed to push single
+    result back, so estimation is an upper bound. Every instruction is visited
+    once with the depth of the first path reaching it.
+
+    :param code: whole program
+    :type code: list[class:`rusty.isa.Instruction`]
+    :param begin: address of the function's first instruction
+    :type begin: int
+    :param end: address after the function's last instruction
+    :type end: int
+    :param parameters: number of function's parameters
+    :type parameters: int
+    :param callees: number of parameters of every function by its address
+    :type callees: dict[int, int]
+
+    :return: maximum depth of operands stack
+    :rtype: int
+    '''
+    depths = {begin: parameters}
+    worklist = [begin]
+    deepest = parameters
+    while worklist:
+        address = worklist.pop()
+        depth = depths[address]
+        instruction = code[address]
+        opcode = instruction.opcode()
+        if opcode in (isa.Opcode.CALL, isa.Opcode.TCALL):
+            callee = relative_target(address, instruction)
+            depth += 1 - callees.get(callee, 0)
+        else:
+            # binary operations pop two operands and push one
+            depth += STACK_EFFECTS.get(opcode, -1)
+        deepest = max(deepest, depth)
+
+        successors = []
+        if opcode not in (isa.Opcode.RET, isa.Opcode.STOP, isa.Opcode.JMP,
+                          isa.Opcode.TCALL):
+            successors.append(address + 1)
+        if opcode in (isa.Opcode.JMP, isa.Opcode.JIFT, isa.Opcode.JIFF):
+            successors.append(relative_target(address, instruction))
+        for successor in successors:
+            if not begin <= successor < end:
+                continue
+            if successor not in depths:
+                depths[successor] = depth
+                worklist.append(successor)
+    return deepest
@@ -0,0 +1,342 @@
+#!/usr/bin/env python3
+'''Модуль, реализующий инкрементальную компиляцию: дисковый кэш вывода
+фронтенда для каждой функции.
+
+Токены исходного файла разбиваются на функции по парным фигурным скобкам без
+синтаксического разбора. Ключ функции - хэш текста ее токенов, сигнатур
+(заголовков от `fn` до тела) вызываемых ею функций, режима свертки констант и
+исходного кода модулей, от которых зависит вывод фронтенда (`rustyc.frontend`,
+`rustyc.consteval`, `rustyc.ir` и `rusty.isa`, которым вычисляются константы),
+поэтому их изменение само делает кэш недействительным. `CACHE_VERSION`
+меняется только вместе с форматом записей.
+
+Если ключ найден в кэше, функция не разбирается и не обходится `FERListener`:
+ее метки, инструкции, параметры и локальные переменные берутся из кэша и
+вставляются в программу до разрешения меток. Иначе функция транслируется как
+обычно, и ее вывод сохраняется в кэш.
+
+Метки фронтенда нумеруются сквозным счетчиком, поэтому в кэше номера меток
+хранятся относительно значения счетчика перед функцией. При вставке номера
+сдвигаются на текущее значение счетчика, а счетчик увеличивается на число меток
+функции - программа получается такой же, как при трансляции без кэша.
+'''
+import os
+import re
+import json
+import hashlib
+import tempfile
+from typing import Iterable, NamedTuple, Optional
+
+from antlr4 import ParseTreeWalker, Token
+
+from rusty import isa
+
+from . import consteval, frontend, ir
+from .libs.RustyParser import RustyParser
+from .frontend import FERListener, FnMeta, VariableMeta
+from .ir import Item, Label, Instr, Chunk, BLANK
+
+
+# version of the format of cache entries
+CACHE_VERSION = 1
+# modules whose sources determine frontend's output, they are hashed into keys
+TRANSLATION_MODULES = (frontend, consteval, ir, isa)
+# label generated by frontend: counter and the rest of the name
+FRONTEND_LABEL = re.compile(r'\.(\d+)(_.+_utlbl)$')
+
+
+class Span(NamedTuple):
+    '''Tokens of top-level function, body is the index of its first curly
+    bracket among the tokens.
+    '''
+    name: str
+    tokens: list[Token]
+    body: int
+
+    @property
+    def start(self) -> int:
+        '''Index of the first token in token stream.
+        '''
+        return self.tokens[0].tokenIndex
+
+    @property
+    def stop(self) -> int:
+        '''Index of the last token in token stream.
+        '''
+        return self.tokens[-1].tokenIndex
+
+    @property
+    def signature(self) -> str:
+        '''Text of function's header: name, parameters and return type.
+        '''
+        return ' '.join(token.text for token in self.tokens[:self.body])
+
+    def callees(self) -> set[str]:
+        '''Names of functions called in the body.
+        '''
+        body = self.tokens[self.body:]
+        return { token.text for token, following in zip(body, body[1:])
+                 if token.type == RustyParser.IDENTIFIER
+                 and following.type == RustyParser.LPAREN }
+
+
+def function_spans(tokens: Iterable[Token]) -> list[Span]:
+    '''Finds top-level functions by matching curly brackets. Search stops at
+    the first malformed function, it is left to parser.
+
+    :param tokens: all tokens of source file
+    :type tokens: Iterable[class:`antlr4.Token`]
+
+    :return: functions in order of definition
+    :rtype: list[class:`rustyc.cache.Span`]
+    '''
+    tokens = [ token for token in tokens if token.type != Token.EOF
+               and token.channel == Token.DEFAULT_CHANNEL ]
+    spans = []
+    i = 0
+    while i + 1 < len(tokens) and tokens[i].type == RustyParser.KW_FN \
+            and tokens[i + 1].type == RustyParser.IDENTIFIER:
+        body = next((j for j in range(i, len(tokens))
+                     if tokens[j].type == RustyParser.LCURLYBR), None)
+        if body is None:
+            break
+        depth, stop = 0, None
+        for j in range(body, len(tokens)):
+            if tokens[j].type == RustyParser.LCURLYBR:
+                depth += 1
+            elif tokens[j].type == RustyParser.RCURLYBR:
+                depth -= 1
+                if depth == 0:
+                    stop = j
+                    break
+        if stop is None:
+            break
+        spans.append(Span(tokens[i + 1].text, tokens[i:stop + 1], body - i))
+        i = stop + 1
+    return spans
+
+
+def _shift(name: str, delta: int) -> str:
+    match = FRONTEND_LABEL.match(name)
+    if match is None:
+        return name
+    return f'.{int(match.group(1)) + delta}{match.group(2)}'
+
+
+def encode(items: Iterable[Item], base: int) -> list:
+    '''Converts frontend's output of function to JSON-compatible form with
+    labels numbered from base.
+
+    :param items: labels and instructions of function
+    :type items: Iterable[Item]
+    :param base: value of labels counter before the function
+    :type base: int
+
+    :return: encoded items
+    :rtype: list
+    '''
+    encoded = []
+    for item in items:
+        if isinstance(item, Label):
+            encoded.append([_shift(item.name, -base)])
+        elif isinstance(item, Instr):
+            arg = _shift(item.arg, -base) if isinstance(item.arg, str) else item.arg
+            encoded.append([item.op, arg, item.spelling])
+        else:
+            encoded.append([])
+    return encoded
+
+
+def decode(encoded: list, base: int) -> list[Item]:
+    '''Restores frontend's output of function with labels numbered from base.
+
+    :param encoded: encoded items
+    :type encoded: list
+    :param base: value of labels counter before the function
+    :type base: int
+
+    :return: labels and instructions of function
+    :rtype: list[Item]
+    '''
+    items = []
+    for entry in encoded:
+        if not entry:
+            items.append(BLANK)
+        elif len(entry) == 1:
+            items.append(Label(_shift(entry[0], base)))
+        else:
+            op, arg, spelling = entry
+            if isinstance(arg, str):
+                arg = _shift(arg, base)
+            items.append(Instr(op, arg, spelling))
+    return items
+
+
+class FunctionCache:
+    '''On-disk cache of frontend's output by functions, every entry is a JSON
+    file named after the key of function.
+    '''
+    def __init__(self, directory: str, fold_constants: bool = False):
+        '''Constructor
+
+        :param directory: directory of cache, it is created if missing
+        :type directory: str
+        :param fold_constants: mode of frontend
+        :type fold_constants: bool, default False
+        '''
+        self.directory = directory
+        os.makedirs(directory, exist_ok=True)
+        digest = hashlib.sha256(f'{CACHE_VERSION}:{fold_constants}:'.encode())
+        for module in TRANSLATION_MODULES:
+            with open(module.__file__, 'rb') as fp:
+                digest.update(fp.read())
+        self.salt = digest.hexdigest()
+        self.hits = 0
+        self.misses = 0
+
+    def keys(self, spans: list[Span]) -> dict[int, str]:
+        '''Computes keys of functions.
+
+        :param self: cache
+        :type self: class:`rustyc.cache.FunctionCache`
+        :param spans: functions of source file
+        :type spans: list[class:`rustyc.cache.Span`]
+
+        :return: keys by index of the first token of function
+        :rtype: dict[int, str]
+        '''
+        signatures = { span.name: span.signature for span in spans }
+        keys = {}
+        for span in spans:
+            digest = hashlib.sha256(self.salt.encode())
+            digest.update('\0'.join(token.text for token in span.tokens).encode())
+            for callee in sorted(span.callees()):
+                digest.update(f'\0{callee}:{signatures.get(callee, "")}'.encode())
+            keys[span.start] = digest.hexdigest()
+        return keys
+
+    def _path(self, key: str) -> str:
+        return os.path.join(self.directory, key + '.json')
+
+    def load(self, key: str) -> Optional[dict]:
+        '''Reads cached function.
+
+        :param self: cache
+        :type self: class:`rustyc.cache.FunctionCache`
+        :param key: key of function
+        :type key: str
+
+        :return: entry or None if it is missing or corrupted
+        :rtype: Optional[dict]
+        '''
+        try:
+            with open(self._path(key), encoding='utf-8') as fp:
+                return json.load(fp)
+        except (OSError, ValueError):
+            return None
+
+    def store(self, key: str, items: Iterable[Item], meta: FnMeta, labels: int,
+              base: int):
+        '''Writes function to cache. Entry is replaced atomically, so
+        concurrent compilers never read partial entries.
+
+        :param self: cache
+        :type self: class:`rustyc.cache.FunctionCache`
+        :param key: key of function
+        :type key: str
+        :param items: frontend's output of function
+        :type items: Iterable[Item]
+        :param meta: metadata of function
+        :type meta: class:`rustyc.frontend.FnMeta`
+        :param labels: number of labels generated for function
+        :type labels: int
+        :param base: value of labels counter before the function
+        :type base: int
+        '''
+        entry = {
+            'parameters': [ [name, variable.identifier, variable.mutable]
+                            for name, variable in meta.parameters.items() ],
+            'locals': [ [name, variable.identifier, variable.mutable]
+                        for name, variable in meta.locals.items() ],
+            'labels': labels,
+            'items': encode(items, base),
+        }
+        fd, temporary = tempfile.mkstemp(dir=self.directory, suffix='.tmp')
+        with os.fdopen(fd, 'w', encoding='utf-8') as fp:
+            json.dump(entry, fp)
+        os.replace(temporary, self._path(key))
+
+    def splice(self, listener: FERListener, entry: dict, span: Span) -> Chunk:
+        '''Adds cached function to the results of listener.
+
+        :param self: cache
+        :type self: class:`rustyc.cache.FunctionCache`
+        :param listener: listener that translates the rest of functions
+        :type listener: class:`rustyc.frontend.FERListener`
+        :param entry: cached function
+        :type entry: dict
+        :param span: tokens of function
+        :type span: class:`rustyc.cache.Span`
+
+        :return: labels and instructions of function
+        :rtype: class:`rustyc.ir.Chunk`
+        '''
+        if span.name in listener.functions:
+            raise Exception # function already defined
+        listener.functions[span.name] = FnMeta(span.name,
+            { name: VariableMeta(identifier, mutable)
+              for name, identifier, mutable in entry['parameters'] },
+            { name: VariableMeta(identifier, mutable)
+              for name, identifier, mutable in entry['locals'] },
+            span.tokens[0].line)
+        base = listener.counter
+        listener.counter += entry['labels']
+        return Chunk(*decode(entry['items'], base))
+
+
+def translate(parser: RustyParser, listener: FERListener,
+              cache: FunctionCache) -> Chunk:
+    '''Translates crate like `rustyc.frontend.translate`, but takes unchanged
+    functions from cache without parsing them and stores translations of the
+    other functions.
+
+    :param parser: parser over the source tokens
+    :type parser: class:`rustyc.libs.RustyParser.RustyParser`
+    :param listener: listener that collects translations and metadata
+    :type listener: class:`rustyc.frontend.FERListener`
+    :param cache: cache of functions
+    :type cache: class:`rustyc.cache.FunctionCache`
+
+    :return: translated program
+    :rtype: class:`rustyc.ir.Chunk`
+    '''
+    walker = ParseTreeWalker()
+    tokens = parser.getTokenStream()
+    tokens.fill()
+    spans = { span.start: span for span in function_spans(tokens.tokens) }
+    keys = cache.keys(list(spans.values()))
+    items = []
+    while tokens.LA(1) != Token.EOF:
+        span = spans.get(tokens.index)
+        key = keys.get(tokens.index)
+        entry = cache.load(key) if key is not None else None
+        if entry is not None:
+            cache.hits += 1
+            items.append(cache.splice(listener, entry, span))
+            tokens.seek(span.stop + 1)
+            continue
+
+        base = listener.counter
+        item = parser.item()
+        walker.walk(listener, item)
+        translation = listener.tree.pop(item)
+        if span is not None and item.stop is not None \
+                and item.stop.tokenIndex == span.stop:
+            cache.misses += 1
+            cache.store(key, translation, listener.functions[span.name],
+                        listener.counter - base, base)
+        items.append(translation)
+        del item
+    if not items:
+        return Chunk()
+    return listener.link(items)
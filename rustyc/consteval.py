@@ -0,0 +1,50 @@
+#!/usr/bin/env python3
+'''Модуль, реализующий вычисление константных выражений во время компиляции.
+Чтобы результат в точности совпадал с результатом вычисления на виртуальной
+машине (переполнения по модулю 2^64, сравнения, сдвиги), инструкции исполняются
+теми же классами `rusty.isa`, что и в виртуальной машине, над отдельным
+контекстом вычислений.
+
+Выражение не сворачивается, если его вычисление приводит к исключению виртуальной
+машины (например, делению на ноль) или дает нецелое значение (инструкция div
+виртуальной машины возвращает число с плавающей точкой) - такое выражение
+остается вычисляться во время исполнения.
+'''
+from typing import Optional
+
+import numpy as np
+
+from rusty import isa, traps
+from rusty.decenc import INSTRUCTIONS_NAMES
+
+
+def evaluate(op: str, *operands: int) -> Optional[int]:
+    '''Executes single VM instruction without arguments over constant operands.
+
+    :param op: name of the instruction, e.g. add or neg
+    :type op: str
+    :param operands: values that are on the top of operands stack, the last one
+    is the top
+    :type operands: int
+
+    :return: value that instruction leaves on the stack or None if it cannot be
+    computed at compile time
+    :rtype: Optional[int]
+    '''
+    opcode = INSTRUCTIONS_NAMES.get(op, None)
+    if opcode is None:
+        return None
+    instruction = isa.INSTRUCTIONS_MAP[opcode]()
+    ctx = isa.Context()
+    ctx.operands_stack = [ isa.force_uint64(operand) for operand in operands ]
+    try:
+        with np.errstate(all='ignore'):
+            instruction.execute(ctx)
+    except (traps.Trap, TypeError):
+        return None
+    if len(ctx.operands_stack) != 1:
+        return None
+    result = ctx.operands_stack[0]
+    if not isinstance(result, (int, np.integer)):
+        return None
+    return int(isa.force_uint64(int(result)))
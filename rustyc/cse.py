@@ -0,0 +1,184 @@
+#!/usr/bin/env python3
+'''Модуль, реализующий удаление общих подвыражений (common subexpression
+elimination) внутри базовых блоков методом нумерации значений (value numbering).
+
+Код базового блока символически исполняется над стеком выражений: каждое
+значение на стеке получает номер - ключ, составленный из операции и ключей ее
+операндов. Загрузка переменной получает ключ значения, которое было в нее
+сохранено в этом же блоке, а если оно неизвестно - ключ с номером версии
+переменной, который увеличивается при каждом ее сохранении. Поэтому одинаковые
+ключи означают одинаковые значения. Операнды коммутативных операций
+упорядочиваются.
+
+Повторное вычисление выражения заменяется:
++ инструкцией `dup`, если оно следует сразу за первым вычислением, например в
+  `(a + b) * (a + b)`;
++ загрузкой временной переменной, в которую первое вычисление сохраняется
+  инструкциями `dup; store`, если это уменьшает число инструкций.
+
+Вызовы функций, `swap` и прочие инструкции, которые не моделируются, очищают
+символический стек, но не сбрасывают версии переменных.
+'''
+from collections import Counter
+from typing import Iterable, NamedTuple, Optional
+
+from .ir import Item, Label, Instr
+from .frontend import FnMeta, VariableMeta
+from .dce import split_functions, basic_blocks
+from .licm import fresh_variable
+
+
+# operations that compute value of their operands only
+BINARY = ('add', 'sub', 'mul', 'div', 'mod', 'shl', 'shr', 'max', 'min', 'and',
+          'or', 'xor', 'lt', 'le', 'eq', 'neq', 'ge', 'gt')
+UNARY = ('inc', 'dec', 'neg', 'not')
+COMMUTATIVE = ('add', 'mul', 'max', 'min', 'and', 'or', 'xor', 'eq', 'neq')
+
+
+class Value(NamedTuple):
+    '''Value on the stack: its key and range of instructions that computes it.
+    '''
+    key: Optional[tuple]
+    begin: int
+    end: int
+
+
+def value_numbers(block: list[Item]) -> dict[tuple, list[tuple[int, int]]]:
+    '''Finds ranges of instructions of basic block that compute the same
+    values.
+
+    :param block: labels and instructions of basic block
+    :type block: list[Item]
+
+    :return: ranges of instructions in order of appearance by key of value
+    :rtype: dict[tuple, list[(int, int)]]
+    '''
+    versions = Counter()
+    variables = {}
+    occurrences = {}
+    stack = []
+
+    def push(key: Optional[tuple], begin: int, end: int):
+        stack.append(Value(key, begin, end))
+        if key is not None and end - begin >= 2:
+            occurrences.setdefault(key, []).append((begin, end))
+
+    for i, item in enumerate(block):
+        if isinstance(item, Label):
+            continue
+        if item.op == 'push':
+            push(('push', item.arg) if isinstance(item.arg, int) else None, i, i + 1)
+        elif item.op == 'load':
+            key = variables.get(item.arg, ('load', item.arg, versions[item.arg]))
+            push(key, i, i + 1)
+        elif item.op == 'dup' and stack:
+            push(stack[-1].key, i, i + 1)
+        elif item.op in ('store', 'pop') and stack:
+            value = stack.pop()
+            if item.op == 'store':
+                versions[item.arg] += 1
+                variables[item.arg] = value.key
+                if value.key is None:
+                    del variables[item.arg]
+        elif item.op in BINARY + UNARY \
+                and len(stack) >= (2 if item.op in BINARY else 1):
+            arity = 2 if item.op in BINARY else 1
+            operands = stack[-arity:]
+            del stack[-arity:]
+            keys = [ operand.key for operand in operands ]
+            contiguous = operands[-1].end == i and all(
+                a.end == b.begin for a, b in zip(operands, operands[1:]))
+            if None in keys or not contiguous:
+                push(None, i, i + 1)
+                continue
+            if item.op in COMMUTATIVE:
+                keys.sort(key=repr)
+            push((item.op, *keys), operands[0].begin, i + 1)
+        else:
+            if item.op == 'store':
+                versions[item.arg] += 1
+                variables.pop(item.arg, None)
+            stack = []
+    return occurrences
+
+
+def eliminate_block(block: list[Item], code: list[Item], meta: FnMeta,
+                    removed: Counter) -> list[Item]:
+    '''Replaces recomputations of values in basic block.
+
+    :param block: labels and instructions of basic block
+    :type block: list[Item]
+    :param code: code of the whole function, used to find free variables
+    :type code: list[Item]
+    :param meta: function's metadata, temporary variables are added to locals
+    :type meta: class:`rustyc.frontend.FnMeta`
+    :param removed: counter of removed instructions
+    :type removed: class:`collections.Counter`
+
+    :return: labels and instructions of basic block
+    :rtype: list[Item]
+    '''
+    occurrences = value_numbers(block)
+    replaced = {}
+    appended = {}
+
+    def available(begin: int, end: int) -> bool:
+        # range is neither removed nor hides a store of other value
+        return not any(b <= begin and end <= e for b, (e, _) in replaced.items()) \
+            and not any(begin < position < end for position in appended)
+
+    for key in sorted(occurrences, key=lambda key: max(
+            end - begin for begin, end in occurrences[key]), reverse=True):
+        ranges = [ r for r in occurrences[key] if available(*r) ]
+        if len(ranges) < 2:
+            continue
+        first, rest = ranges[0], ranges[1:]
+        saved = sum(end - begin - 1 for begin, end in rest)
+        if len(rest) == 1 and rest[0][0] == first[1]:
+            replaced[rest[0][0]] = (rest[0][1], [Instr('dup')])
+            removed['common-subexpression'] += saved
+            continue
+        if saved <= 2:
+            continue
+        identifier = fresh_variable(code, meta)
+        meta.locals[f'.cse{identifier}'] = VariableMeta(identifier, True)
+        appended.setdefault(first[1], []).extend([Instr('dup'),
+                                                  Instr('store', identifier)])
+        for begin, end in rest:
+            replaced[begin] = (end, [Instr('load', identifier)])
+        removed['common-subexpression'] += saved - 2
+
+    result = []
+    i = 0
+    while i <= len(block):
+        result.extend(appended.get(i, ()))
+        if i == len(block):
+            break
+        if i in replaced:
+            i, replacement = replaced[i]
+            result.extend(replacement)
+            continue
+        result.append(block[i])
+        i += 1
+    return result
+
+
+def eliminate(items: Iterable[Item], functions: dict[str, FnMeta]) -> tuple[list[Item], Counter]:
+    '''Eliminates common subexpressions inside basic blocks of all functions.
+
+    :param items: labels and instructions
+    :type items: Iterable[Item]
+    :param functions: metadata of all functions
+    :type functions: dict[str, class:`rustyc.frontend.FnMeta`]
+
+    :return: program and number of removed instructions
+    :rtype: (list[Item], class:`collections.Counter`)
+    '''
+    items = [ item for item in items if isinstance(item, (Label, Instr)) ]
+    prologue, bodies = split_functions(items, functions)
+    removed = Counter({ 'common-subexpression': 0 })
+    program = list(prologue)
+    for name, body in bodies.items():
+        for block in basic_blocks(body):
+            program.extend(eliminate_block(block, body, functions[name], removed))
+    return program, removed
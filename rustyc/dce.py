@@ -0,0 +1,197 @@
+#!/usr/bin/env python3
+'''Модуль, реализующий удаление мертвого кода из программы, которую строит
+фронтенд компилятора:
+
++ удаление функций, недостижимых по графу вызовов из функции main;
++ удаление базовых блоков, недостижимых по графу потока управления от начала
+  функции (например, код после break, continue и return).
+
+Программа разбивается на пролог (вызов main и остановка машины) и функции,
+каждая из которых начинается с метки с именем функции и продолжается до метки
+следующей функции.
+'''
+from collections import Counter
+from typing import Iterable
+
+from .ir import Item, Label, Instr, JUMPS, TERMINATORS
+
+
+# instructions that end basic block
+BRANCHES = TERMINATORS + ('jift', 'jiff')
+
+
+def split_functions(items: Iterable[Item],
+                    names: Iterable[str]) -> tuple[list[Item], dict[str, list[Item]]]:
+    '''Splits program into prologue and functions.
+
+    :param items: labels and instructions
+    :type items: Iterable[Item]
+    :param names: names of functions
+    :type names: Iterable[str]
+
+    :return: prologue and items of every function in order of definition,
+    every function starts with its label
+    :rtype: (list[Item], dict[str, list[Item]])
+    '''
+    names = set(names)
+    prologue = []
+    functions = {}
+    current = prologue
+    for item in items:
+        if isinstance(item, Label) and item.name in names:
+            current = functions[item.name] = []
+        current.append(item)
+    return prologue, functions
+
+
+def call_graph(functions: dict[str, list[Item]]) -> dict[str, set[str]]:
+    '''Builds the graph of calls between functions.
+
+    :param functions: items of every function by its name
+    :type functions: dict[str, list[Item]]
+
+    :return: names of callees by name of caller
+    :rtype: dict[str, set[str]]
+    '''
+    return {
+        name: { item.arg for item in body
+                if isinstance(item, Instr) and item.op in ('call', 'tcall') }
+        for name, body in functions.items()
+    }
+
+
+def reachable_functions(graph: dict[str, set[str]], roots: Iterable[str]) -> set[str]:
+    '''Finds all functions that can be called starting from roots.
+
+    :param graph: names of callees by name of caller
+    :type graph: dict[str, set[str]]
+    :param roots: names of functions called from outside, e.g. main
+    :type roots: Iterable[str]
+
+    :return: names of reachable functions
+    :rtype: set[str]
+    '''
+    reachable = set()
+    worklist = list(roots)
+    while worklist:
+        name = worklist.pop()
+        if name in reachable or name not in graph:
+            continue
+        reachable.add(name)
+        worklist.extend(graph[name])
+    return reachable
+
+
+def basic_blocks(items: Iterable[Item]) -> list[list[Item]]:
+    '''Splits code into basic blocks. Every block starts with labels (if any)
+    and ends with branch instruction or right before the next label.
+
+    :param items: labels and instructions
+    :type items: Iterable[Item]
+
+    :return: basic blocks in program order
+    :rtype: list[list[Item]]
+    '''
+    blocks = []
+    current = []
+    has_instructions = False
+    for item in items:
+        if isinstance(item, Label) and has_instructions:
+            blocks.append(current)
+            current = []
+            has_instructions = False
+        current.append(item)
+        if isinstance(item, Instr):
+            has_instructions = True
+            if item.op in BRANCHES:
+                blocks.append(current)
+                current = []
+                has_instructions = False
+    if current:
+        blocks.append(current)
+    return blocks
+
+
+def successors(blocks: list[list[Item]], index: int,
+               labels: dict[str, int]) -> list[int]:
+    '''Lists indices of blocks that control can pass to after the block.
+
+    :param blocks: basic blocks in program order
+    :type blocks: list[list[Item]]
+    :param index: index of the block
+    :type index: int
+    :param labels: index of block by every label
+    :type labels: dict[str, int]
+
+    :return: indices of successors
+    :rtype: list[int]
+    '''
+    last = blocks[index][-1]
+    result = []
+    if not (isinstance(last, Instr) and last.op in TERMINATORS):
+        if index + 1 < len(blocks):
+            result.append(index + 1)
+    if isinstance(last, Instr) and last.op in JUMPS \
+            and last.arg in labels:
+        result.append(labels[last.arg])
+    return result
+
+
+def reachable_code(items: list[Item]) -> list[Item]:
+    '''Removes basic blocks that are unreachable from the first one.
+
+    :param items: code of function
+    :type items: list[Item]
+
+    :return: code of function without unreachable blocks
+    :rtype: list[Item]
+    '''
+    blocks = basic_blocks(items)
+    labels = { item.name: i for i, block in enumerate(blocks)
+               for item in block if isinstance(item, Label) }
+    reachable = set()
+    worklist = [0] if blocks else []
+    while worklist:
+        index = worklist.pop()
+        if index in reachable:
+            continue
+        reachable.add(index)
+        worklist.extend(successors(blocks, index, labels))
+    return [ item for i, block in enumerate(blocks) if i in reachable
+             for item in block ]
+
+
+def _instructions(items: Iterable[Item]) -> int:
+    return sum(1 for item in items if isinstance(item, Instr))
+
+
+def eliminate(items: Iterable[Item], names: Iterable[str],
+              roots: Iterable[str] = ('main',)) -> tuple[list[Item], set[str], Counter]:
+    '''Removes functions that are unreachable from roots and unreachable code
+    inside the remaining functions.
+
+    :param items: labels and instructions after frontend-stage
+    :type items: Iterable[Item]
+    :param names: names of all functions of program
+    :type names: Iterable[str]
+    :param roots: names of functions called from outside
+    :type roots: Iterable[str], default ('main',)
+
+    :return: program, names of remaining functions and number of removed
+    instructions of dead functions and dead code
+    :rtype: (list[Item], set[str], class:`collections.Counter`)
+    '''
+    items = [ item for item in items if isinstance(item, (Label, Instr)) ]
+    prologue, functions = split_functions(items, names)
+    live = reachable_functions(call_graph(functions), roots)
+    removed = Counter({ 'dead-function': 0, 'dead-code': 0 })
+
+    program = list(prologue)
+    for name, body in functions.items():
+        if name not in live:
+            removed['dead-function'] += _instructions(body)
+            continue
+        code = reachable_code(body)
+        removed['dead-code'] += _instructions(body) - _instructions(code)
+        program.extend(code)
+    return program, live, removed
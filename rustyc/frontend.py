@@ -5,17 +5,26 @@
 
 Реализация трансляции взята напрямую из документации ANTLR4, в которой класс
 Listener поддерживает словарь (map) между *контекстом* распарсенной конструкции
-языка и строкой с результирующими инструкциями. Т.е. класс обработчик кэширует
+языка и списком результирующих меток и инструкций (см. `rustyc.ir`). Т.е. класс обработчик кэширует
 соответствия между входным набором токеном и результатом их трансляции.
 
 Так как *контекст* представляет собой объект, хэш которого это уникальный
 идентификатор данного объекта в памяти, то коллизии в данном словаре исключены.
+Трансляция дочернего контекста удаляется из словаря, как только ее забирает
+родитель, поэтому в словаре остаются только еще не использованные трансляции.
 '''
-from typing import Optional
+from typing import Iterable, Optional, Union
 from dataclasses import dataclass
 
+from antlr4 import ParseTreeWalker, Token
+
+from rusty.decenc import parse_integer
+from rusty.isa import force_uint64
+
 from .libs.RustyListener import RustyListener
 from .libs.RustyParser import RustyParser
+from .ir import Label, Instr, Chunk, BLANK
+from .consteval import evaluate
 
 
 @dataclass
@@ -37,40 +46,31 @@ class FnMeta:
     Parameters and local variables are enumerated end-to-end. Thus, numerical
     identifier of every local variable is strictly greater than every identifier
     of every function parameter.
+
+    Line is the number of source line where function is defined.
     '''
     name: str
     parameters: dict[str, VariableMeta]
     locals: dict[str, VariableMeta]
+    line: int = 0
 
-
-def finstr(ins: str) -> str:
-    '''Formats program's instruction by prepending tab to distinguish them from
-    labels.
-
-    :param ins: single VM instruction
-    :type ins: str
-
-    :return: line with tab and instruction
-    :rtype: str
-    '''
-    return '\t' + ins
-
-
-def flabel(lbl: str) -> str:
-    '''Formats program's label to distinguish them from the instructions.
-
-    :param lbl: program's label
-    :type lbl: str
-
-    :return: line with label name and colon (:) at the end
-    :rtype: str
+@dataclass
+class Condition:
+    '''Stores structure of a lazy boolean expression (`&&` or `||`) which
+    operands are translations of other expressions or nested conditions. It is
+    used to translate the expression into conditional jumps that skip evaluation
+    of the right operand.
     '''
-    return lbl + ':'
+    op: str
+    left: Union[Chunk, 'Condition']
+    right: Union[Chunk, 'Condition']
 
 
 class FERListener(RustyListener):
     '''Handlers for parse rules. An observer in the oberver pattern. Builds a map
-    of translations from input subset of Rust to VM instructions.
+    of translations from input subset of Rust to VM instructions. Every
+    translation is a chunk of labels and instructions (see `rustyc.ir`) that
+    refers to translations of children without copying them.
 
     At the beginning of every module (crate) puts `call main` and `stop`:
     ```
@@ -78,14 +78,34 @@ class FERListener(RustyListener):
     1: stop
     2: ...
     ```
+
+    If constants folding is enabled, values of constant expressions are kept
+    alongside their translations. Expressions over constants are evaluated at
+    compile time, immutable variables initialized with constants are replaced
+    with their values inside the block they are declared in, and branches of
+    `if` and `while` with constant conditions are eliminated.
+
+    Lazy boolean expressions are evaluated with short circuit: the right operand
+    is skipped with conditional jumps when the left one determines the result.
+    As a value such expression is normalized to 0 or 1, and as a condition of
+    `if` or `while` it jumps directly to the branch targets.
+
+    Without entry function the crate is translated as a part of the program
+    (see `rustyc.linker`): there is no prologue and `main` is not required.
     '''
-    def __init__(self):
+    def __init__(self, fold_constants: bool = False, entry: Optional[str] = 'main'):
         super().__init__()
         self.tree = {}
         self.functions: dict[str, FnMeta] = {}
         self.counter = 0
         self.current_function: Optional[str] = None
         self.loop_labels = []
+        self.fold_constants = fold_constants
+        self.entry = entry
+        self.constants = {}
+        self.conditions: dict[object, Condition] = {}
+        self.variable_constants: dict[str, int] = {}
+        self.scopes: list[list[str]] = []
 
     def next_label(self, name: str) -> str:
         '''Generates unique label with specified name. Every call increments
@@ -102,16 +122,117 @@ class FERListener(RustyListener):
         self.counter += 1
         return salt + name + pepper
 
+    def _push_constant(self, ctx, value: int):
+        '''Translates context to push of the constant and remembers its value.
+
+        :param self: instance of listener
+        :type self: class:`rustyc.frontend.FERListener`
+        :param ctx: context of the constant expression
+        :param value: value of expression
+        :type value: int
+        '''
+        self.tree[ctx] = Chunk(Instr('push', value))
+        self.constants[ctx] = value
+
+    def _fold(self, ctx, op: str, *children) -> bool:
+        '''Evaluates instruction over children at compile time if all of them
+        are constant. On success translation of context becomes push of the
+        result and translations of children are dropped.
+
+        :param self: instance of listener
+        :type self: class:`rustyc.frontend.FERListener`
+        :param ctx: context of the expression
+        :param op: instruction applied to the values of children
+        :type op: str
+        :param children: contexts of operands in order of pushing
+
+        :return: true if expression was folded, false otherwise
+        :rtype: bool
+        '''
+        values = [ self.constants.pop(child, None) for child in children ]
+        if not self.fold_constants or None in values:
+            return False
+        value = evaluate(op, *values)
+        if value is None:
+            return False
+        for child in children:
+            self.tree.pop(child)
+        self._push_constant(ctx, value)
+        return True
+
+    def _jump_if(self, condition: Union[Chunk, Condition], target: str) -> Chunk:
+        '''Translates condition into code that jumps to target if it holds
+        and falls through otherwise, leaving operands stack unchanged.
+
+        :param self: instance of listener
+        :type self: class:`rustyc.frontend.FERListener`
+        :param condition: translation of value or lazy boolean condition
+        :type condition: Union[class:`rustyc.ir.Chunk`, class:`rustyc.frontend.Condition`]
+        :param target: label to jump to
+        :type target: str
+
+        :return: translation
+        :rtype: class:`rustyc.ir.Chunk`
+        '''
+        if isinstance(condition, Chunk):
+            return Chunk(condition, Instr('jift', target))
+        if condition.op == 'or':
+            return Chunk(self._jump_if(condition.left, target),
+                         self._jump_if(condition.right, target))
+        lbl_rhs = self.next_label('and_rhs')
+        lbl_skip = self.next_label('and_skip')
+        return Chunk(
+            self._jump_if(condition.left, lbl_rhs),
+            Instr('jmp', lbl_skip),
+            Label(lbl_rhs),
+            self._jump_if(condition.right, target),
+            Label(lbl_skip)
+        )
+
+    def _is_condition(self, ctx) -> bool:
+        '''Checks if expression is used as a condition: operand of lazy boolean
+        expression or predicate of `if` or `while`, maybe in parentheses. Only
+        such expressions keep their conditions for parents.
+
+        :param self: instance of listener
+        :type self: class:`rustyc.frontend.FERListener`
+        :param ctx: context of the expression
+
+        :return: true if parent jumps by the expression
+        :rtype: bool
+        '''
+        parent = ctx.parentCtx
+        while isinstance(parent, RustyParser.GroupedExprContext):
+            parent = parent.parentCtx
+        return isinstance(parent, (RustyParser.LazyBooleanExprContext,
+                                   RustyParser.IfExpressionContext,
+                                   RustyParser.PredicateLoopExprContext))
+
+    def _branch(self, ctx, target: str) -> Chunk:
+        '''Takes translation of expression used as condition and turns it into
+        code that jumps to target if the condition holds.
+
+        :param self: instance of listener
+        :type self: class:`rustyc.frontend.FERListener`
+        :param ctx: context of the condition expression
+        :param target: label to jump to
+        :type target: str
+
+        :return: translation
+        :rtype: class:`rustyc.ir.Chunk`
+        '''
+        value = self.tree.pop(ctx)
+        return self._jump_if(self.conditions.pop(ctx, value), target)
+
 # Implement NegationExprs alternatives
     def exitNegationExpr(self, ctx: RustyParser.NegationExprContext):
         instruction = {
             (True, False): 'neg',
             (False, True): 'not'
         }.get((ctx.MINUS() is not None, ctx.NOT() is not None))
-        self.tree[ctx] = '\n'.join([
-            self.tree[ctx.expression()],
-            finstr(instruction)
-        ])
+        if self._fold(ctx, instruction, ctx.expression()):
+            return super().exitNegationExpr(ctx)
+        self.tree[ctx] = Chunk(self.tree.pop(ctx.expression()), Instr(instruction))
         return super().exitNegationExpr(ctx)
 
 # Implement ArithOrLogicExprs alternatives
@@ -139,11 +260,11 @@ class FERListener(RustyListener):
             instruction = 'or'
         else:
             raise Exception # Unsupported operator
-        self.tree[ctx] = '\n'.join([
-            self.tree[ctx.expression()[0]],
-            self.tree[ctx.expression()[1]],
-            finstr(instruction)
-        ])
+        if self._fold(ctx, instruction, *ctx.expression()):
+            return super().exitArithOrLogicExpr(ctx)
+        self.tree[ctx] = Chunk(self.tree.pop(ctx.expression()[0]),
+                               self.tree.pop(ctx.expression()[1]),
+                               Instr(instruction))
         return super().exitArithOrLogicExpr(ctx)
 
 # Implement ComparisonOps alternatives
@@ -163,7 +284,7 @@ class FERListener(RustyListener):
             instruction = 'le'
         else:
             raise Exception # unsupported comparison operator
-        self.tree[ctx] = finstr(instruction)
+        self.tree[ctx] = Chunk(Instr(instruction))
         return super().exitComparisonOps(ctx)
 
 # Implement CompoundAssignmentOps alternatives
@@ -191,7 +312,7 @@ class FERListener(RustyListener):
             instruction = 'shr'
         else:
             raise Exception # unsupported compound operator
-        self.tree[ctx] = finstr(instruction)
+        self.tree[ctx] = Chunk(Instr(instruction))
         return super().exitCompoundAssignOps(ctx)
 
 # Implement LazyBooleanExprs alternatives
@@ -200,24 +321,41 @@ class FERListener(RustyListener):
             (True, False): 'and',
             (False, True): 'or'
         }.get((ctx.ANDAND() is not None, ctx.OROR() is not None))
-        self.tree[ctx] = '\n'.join([
-            self.tree[ctx.expression()[0]],
-            self.tree[ctx.expression()[1]],
-            finstr(instruction)
-        ])
+        for child in ctx.expression():
+            # operands are truth values, like at run time
+            if self.constants.get(child) is not None:
+                self.constants[child] = int(bool(self.constants[child]))
+        if self._fold(ctx, instruction, *ctx.expression()):
+            return super().exitLazyBooleanExpr(ctx)
+        left, right = ctx.expression()
+        condition = Condition(instruction,
+                              self.conditions.pop(left, self.tree.pop(left)),
+                              self.conditions.pop(right, self.tree.pop(right)))
+        lbl_true = self.next_label('lazy_true')
+        lbl_end = self.next_label('lazy_end')
+        self.tree[ctx] = Chunk(
+            self._jump_if(condition, lbl_true),
+            Instr('push', 0),
+            Instr('jmp', lbl_end),
+            Label(lbl_true),
+            Instr('push', 1),
+            Label(lbl_end)
+        )
+        if self._is_condition(ctx):
+            self.conditions[ctx] = condition
         return super().exitLazyBooleanExpr(ctx)
 
 # Implement callParams
     def exitCallParams(self, ctx: RustyParser.CallParamsContext):
-        self.tree[ctx] = '\n'.join(map(self.tree.get, ctx.expression()))
+        self.tree[ctx] = Chunk(*map(self.tree.pop, ctx.expression()))
         return super().exitCallParams(ctx)
 
 # Implement ifExpression rule
     def exitElseBranch(self, ctx: RustyParser.ElseBranchContext):
         if ctx.blockExpression() is not None:
-            self.tree[ctx] = self.tree[ctx.blockExpression()]
+            self.tree[ctx] = self.tree.pop(ctx.blockExpression())
         elif ctx.ifExpression is not None:
-            self.tree[ctx] = self.tree[ctx.ifExpression()]
+            self.tree[ctx] = self.tree.pop(ctx.ifExpression())
         else:
             raise Exception # malformed parsing rules
         return super().exitElseBranch(ctx)
@@ -226,41 +364,55 @@ class FERListener(RustyListener):
         lbl_fi = self.next_label('fi')
         lbl_then = self.next_label('then')
 
-        instructions = [
-            self.tree[ctx.expression()],
-            finstr('jift ' + lbl_then)
-        ]
+        condition = self.constants.pop(ctx.expression(), None)
+        if self.fold_constants and condition is not None:
+            self.tree.pop(ctx.expression())
+            taken = self.tree.pop(ctx.blockExpression())
+            if ctx.elseBranch() is not None:
+                otherwise = self.tree.pop(ctx.elseBranch())
+            else:
+                otherwise = Chunk()
+            self.tree[ctx] = taken if condition != 0 else otherwise
+            return super().exitIfExpression(ctx)
+
+        instructions = [self._branch(ctx.expression(), lbl_then)]
         if ctx.elseBranch() is not None:
-            instructions.append(self.tree[ctx.elseBranch()])
+            instructions.append(self.tree.pop(ctx.elseBranch()))
         instructions.extend([
-            finstr('jmp ' + lbl_fi),
-            flabel(lbl_then),
-            self.tree[ctx.blockExpression()],
-            flabel(lbl_fi)
+            Instr('jmp', lbl_fi),
+            Label(lbl_then),
+            self.tree.pop(ctx.blockExpression()),
+            Label(lbl_fi)
         ])
 
-        self.tree[ctx] = '\n'.join(instructions)
+        self.tree[ctx] = Chunk(*instructions)
         return super().exitIfExpression(ctx)
 
 # Implement blockExpression
+    def enterBlockExpression(self, ctx: RustyParser.BlockExpressionContext):
+        self.scopes.append([])
+        return super().enterBlockExpression(ctx)
+
     def exitBlockExpression(self, ctx: RustyParser.BlockExpressionContext):
+        for variable_name in self.scopes.pop():
+            del self.variable_constants[variable_name]
         statements = ctx.statements()
-        self.tree[ctx] = '' if statements is None else self.tree[statements]
+        self.tree[ctx] = Chunk(BLANK) if statements is None else self.tree.pop(statements)
         return super().exitBlockExpression(ctx)
 
 # Implement statements
     def exitStatements(self, ctx: RustyParser.StatementsContext):
         instructions = []
         if ctx.statement() is not None:
-            instructions.extend(map(self.tree.get, ctx.statement()))
+            instructions.extend(map(self.tree.pop, ctx.statement()))
         if ctx.expression() is not None:
-            instructions.append(self.tree[ctx.expression()])
-        self.tree[ctx] = '\n'.join(instructions)
+            instructions.append(self.tree.pop(ctx.expression()))
+        self.tree[ctx] = Chunk(*instructions)
         return super().exitStatements(ctx)
 
 # Implement expressionWithBlock alternatives
     def exitBlockExpr(self, ctx: RustyParser.BlockExprContext):
-        self.tree[ctx] = self.tree[ctx.blockExpression()]
+        self.tree[ctx] = self.tree.pop(ctx.blockExpression())
         return super().exitBlockExpr(ctx)
 
     def enterInfiniteLoopExpr(self, ctx: RustyParser.InfiniteLoopExprContext):
@@ -272,12 +424,12 @@ class FERListener(RustyListener):
 
     def exitInfiniteLoopExpr(self, ctx: RustyParser.InfiniteLoopExprContext):
         lbl_loop_enter, lbl_loop_exit = self.loop_labels.pop()
-        self.tree[ctx] = '\n'.join([
-            flabel(lbl_loop_enter),
-            self.tree[ctx.blockExpression()],
-            finstr('jmp ' + lbl_loop_enter),
-            flabel(lbl_loop_exit)
-        ])
+        self.tree[ctx] = Chunk(
+            Label(lbl_loop_enter),
+            self.tree.pop(ctx.blockExpression()),
+            Instr('jmp', lbl_loop_enter),
+            Label(lbl_loop_exit)
+        )
         return super().exitInfiniteLoopExpr(ctx)
 
     def enterPredicateLoopExpr(self, ctx: RustyParser.PredicateLoopExprContext):
@@ -291,19 +443,32 @@ class FERListener(RustyListener):
         lbl_loop_cond, lbl_loop_exit = self.loop_labels.pop()
         lbl_loop_enter = self.next_label('predlo_enter')
 
-        self.tree[ctx] = '\n'.join([
-            finstr('jmp ' + lbl_loop_cond),
-            flabel(lbl_loop_enter),
-            self.tree[ctx.blockExpression()],
-            flabel(lbl_loop_cond),
-            self.tree[ctx.expression()],
-            finstr('jift ' + lbl_loop_enter),
-            flabel(lbl_loop_exit)
-        ])
+        condition = self.constants.pop(ctx.expression(), None)
+        if self.fold_constants and condition is not None:
+            self.tree.pop(ctx.expression())
+            body = self.tree.pop(ctx.blockExpression())
+            self.tree[ctx] = Chunk()
+            if condition != 0:
+                self.tree[ctx] = Chunk(
+                    Label(lbl_loop_cond),
+                    body,
+                    Instr('jmp', lbl_loop_cond),
+                    Label(lbl_loop_exit)
+                )
+            return super().exitPredicateLoopExpr(ctx)
+
+        self.tree[ctx] = Chunk(
+            Instr('jmp', lbl_loop_cond),
+            Label(lbl_loop_enter),
+            self.tree.pop(ctx.blockExpression()),
+            Label(lbl_loop_cond),
+            self._branch(ctx.expression(), lbl_loop_enter),
+            Label(lbl_loop_exit)
+        )
         return super().exitPredicateLoopExpr(ctx)
 
     def exitIfExpr(self, ctx: RustyParser.IfExprContext):
-        self.tree[ctx] = self.tree[ctx.ifExpression()]
+        self.tree[ctx] = self.tree.pop(ctx.ifExpression())
         return super().exitIfExpr(ctx)
 
 # Implement expression alternatives
@@ -313,19 +478,26 @@ class FERListener(RustyListener):
             for bit_depth in ('8', '16', '32', '64', '128', 'size'):
                 integer_literal = integer_literal.replace(signedness + bit_depth,
                                                           '')
-        self.tree[ctx] = finstr('push ' + integer_literal)
+        value = parse_integer(integer_literal)
+        self.tree[ctx] = Chunk(Instr('push', value, integer_literal))
+        if self.fold_constants:
+            self.constants[ctx] = int(force_uint64(value))
         return super().exitIntegerLiteral(ctx)
 
     def exitFloatLiteral(self, ctx: RustyParser.FloatLiteralContext):
-        self.tree[ctx] = finstr('push ' + str(ctx.FLOAT_LITERAL()))
+        self.tree[ctx] = Chunk(Instr('push', str(ctx.FLOAT_LITERAL())))
         return super().exitFloatLiteral(ctx)
 
     def exitTrueLiteral(self, ctx: RustyParser.TrueLiteralContext):
-        self.tree[ctx] = finstr('push 1')
+        self.tree[ctx] = Chunk(Instr('push', 1))
+        if self.fold_constants:
+            self.constants[ctx] = 1
         return super().exitTrueLiteral(ctx)
 
     def exitFalseLiteral(self, ctx: RustyParser.FalseLiteralContext):
-        self.tree[ctx] = finstr('push 0')
+        self.tree[ctx] = Chunk(Instr('push', 0))
+        if self.fold_constants:
+            self.constants[ctx] = 0
         return super().exitFalseLiteral(ctx)
 
     def _get_variable(self, variable_name: str) -> VariableMeta:
@@ -351,32 +523,37 @@ class FERListener(RustyListener):
 
     def exitPathExpr(self, ctx: RustyParser.PathExprContext):
         variable = self._get_variable(str(ctx.IDENTIFIER()))
-        self.tree[ctx] = finstr(f'load {variable.identifier}')
+        value = self.variable_constants.get(str(ctx.IDENTIFIER()), None)
+        if value is not None:
+            self._push_constant(ctx, value)
+            return super().exitPathExpr(ctx)
+        self.tree[ctx] = Chunk(Instr('load', variable.identifier))
         return super().exitPathExpr(ctx)
 
     def exitCallExpr(self, ctx: RustyParser.CallExprContext):
         instructions = []
         if ctx.callParams() is not None:
-            instructions.append(self.tree[ctx.callParams()])
-        instructions.append(finstr('call ' + str(ctx.IDENTIFIER())))
-        self.tree[ctx] = '\n'.join(instructions)
+            instructions.append(self.tree.pop(ctx.callParams()))
+        instructions.append(Instr('call', str(ctx.IDENTIFIER())))
+        self.tree[ctx] = Chunk(*instructions)
         return super().exitCallExpr(ctx)
 
     def exitComparisonExpr(self, ctx: RustyParser.ComparisonExprContext):
-        self.tree[ctx] = '\n'.join([
-            self.tree[ctx.expression()[0]],
-            self.tree[ctx.expression()[1]],
-            self.tree[ctx.comparisonOps()]
-        ])
+        comparison, = self.tree[ctx.comparisonOps()]
+        if self._fold(ctx, comparison.op, *ctx.expression()):
+            self.tree.pop(ctx.comparisonOps())
+            return super().exitComparisonExpr(ctx)
+        self.tree[ctx] = Chunk(self.tree.pop(ctx.expression()[0]),
+                               self.tree.pop(ctx.expression()[1]),
+                               self.tree.pop(ctx.comparisonOps()))
         return super().exitComparisonExpr(ctx)
 
     def exitAssignmentExpr(self, ctx: RustyParser.AssignmentExprContext):
         variable = self._get_variable(str(ctx.IDENTIFIER()))
         if not variable.mutable:
             raise Exception # variable is immutable
-        instructions = [self.tree[ctx.expression()]]
-        instructions.append(finstr(f'store {variable.identifier}'))
-        self.tree[ctx] = '\n'.join(instructions)
+        self.tree[ctx] = Chunk(self.tree.pop(ctx.expression()),
+                               Instr('store', variable.identifier))
         return super().exitAssignmentExpr(ctx)
 
     def exitCompoundAssignmentExpr(self, ctx: RustyParser.CompoundAssignmentExprContext):
@@ -384,46 +561,50 @@ class FERListener(RustyListener):
         if not variable.mutable:
             raise Exception # variable is immutable
 
-        self.tree[ctx] = '\n'.join([
-            finstr(f'load {variable.identifier}'),
-            self.tree[ctx.expression()],
-            self.tree[ctx.compoundAssignOps()],
-            finstr(f'store {variable.identifier}')
-        ])
+        self.tree[ctx] = Chunk(
+            Instr('load', variable.identifier),
+            self.tree.pop(ctx.expression()),
+            self.tree.pop(ctx.compoundAssignOps()),
+            Instr('store', variable.identifier)
+        )
         return super().exitCompoundAssignmentExpr(ctx)
 
     def exitContinueExpr(self, ctx: RustyParser.ContinueExprContext):
         continue_label, _ = self.loop_labels[-1]
-        self.tree[ctx] = finstr('jmp ' + continue_label)
+        self.tree[ctx] = Chunk(Instr('jmp', continue_label))
         return super().exitContinueExpr(ctx)
 
     def exitBreakExpr(self, ctx: RustyParser.BreakExprContext):
         _, break_label = self.loop_labels[-1]
-        self.tree[ctx] = finstr('jmp ' + break_label)
+        self.tree[ctx] = Chunk(Instr('jmp', break_label))
         return super().exitBreakExpr(ctx)
 
     def exitReturnExpr(self, ctx: RustyParser.ReturnExprContext):
         instructions = []
         if ctx.expression() is not None:
-            instructions.append(self.tree[ctx.expression()])
-        instructions.append(finstr('ret'))
-        self.tree[ctx] = '\n'.join(instructions)
+            instructions.append(self.tree.pop(ctx.expression()))
+        instructions.append(Instr('ret'))
+        self.tree[ctx] = Chunk(*instructions)
         return super().exitReturnExpr(ctx)
 
     def exitGroupedExpr(self, ctx: RustyParser.GroupedExprContext):
-        self.tree[ctx] = self.tree[ctx.expression()]
+        self.tree[ctx] = self.tree.pop(ctx.expression())
+        if ctx.expression() in self.constants:
+            self.constants[ctx] = self.constants.pop(ctx.expression())
+        if ctx.expression() in self.conditions:
+            self.conditions[ctx] = self.conditions.pop(ctx.expression())
         return super().exitGroupedExpr(ctx)
 
     def exitExprWithBlock(self, ctx: RustyParser.ExprWithBlockContext):
-        self.tree[ctx] = self.tree[ctx.getChild()]
+        self.tree[ctx] = self.tree.pop(ctx.expressionWithBlock())
         return super().exitExprWithBlock(ctx)
 
 # Implement expressionStatement
     def exitExpressionStatement(self, ctx: RustyParser.ExpressionStatementContext):
         if ctx.expression() is not None:
-            self.tree[ctx] = self.tree[ctx.expression()]
+            self.tree[ctx] = self.tree.pop(ctx.expression())
         elif ctx.expressionWithBlock() is not None:
-            self.tree[ctx] = self.tree[ctx.expressionWithBlock()]
+            self.tree[ctx] = self.tree.pop(ctx.expressionWithBlock())
         else:
             raise Exception # malformed parsing rules
         return super().exitExpressionStatement(ctx)
@@ -459,25 +640,29 @@ class FERListener(RustyListener):
                                        ctx.KW_MUT() is not None)
         instructions = []
         if ctx.expression() is not None:
-            instructions.append(self.tree[ctx.expression()])
+            value = self.constants.pop(ctx.expression(), None)
+            if value is not None and not variable.mutable:
+                self.variable_constants[str(ctx.IDENTIFIER())] = value
+                self.scopes[-1].append(str(ctx.IDENTIFIER()))
+            instructions.append(self.tree.pop(ctx.expression()))
         else:
             # init with the default value
-            instructions.append(finstr('push 0'))
-        instructions.append(finstr(f'store {variable.identifier}'))
-        self.tree[ctx] = '\n'.join(instructions)
+            instructions.append(Instr('push', 0))
+        instructions.append(Instr('store', variable.identifier))
+        self.tree[ctx] = Chunk(*instructions)
         return super().exitLetStatement(ctx)
 
 # Implement statement alternatives
     def exitStNopStatement(self, ctx: RustyParser.StNopStatementContext):
-        self.tree[ctx] = finstr('nop')
+        self.tree[ctx] = Chunk(Instr('nop'))
         return super().exitStNopStatement(ctx)
 
     def exitStLetStatement(self, ctx: RustyParser.StLetStatementContext):
-        self.tree[ctx] = self.tree[ctx.letStatement()]
+        self.tree[ctx] = self.tree.pop(ctx.letStatement())
         return super().exitStLetStatement(ctx)
 
     def exitStExprStatement(self, ctx: RustyParser.StExprStatementContext):
-        self.tree[ctx] = self.tree[ctx.expressionStatement()]
+        self.tree[ctx] = self.tree.pop(ctx.expressionStatement())
         return super().exitStExprStatement(ctx)
 
 # Implement function rule
@@ -507,40 +692,84 @@ class FERListener(RustyListener):
         if self.current_function in self.functions:
             raise Exception # function already defined
         self.functions[self.current_function] = FnMeta(self.current_function,
-            _list_parameters(ctx), {})
+            _list_parameters(ctx), {}, ctx.start.line)
         return super().enterFunction(ctx)
 
     def exitFunction(self, ctx: RustyParser.FunctionContext):
-        instructions = [str(ctx.IDENTIFIER()) + ':']
-        save_instructions = map(lambda id: finstr(f'store {id}'),
+        instructions = [Label(str(ctx.IDENTIFIER()))]
+        save_instructions = map(lambda id: Instr('store', id),
             reversed(sorted(list(map(lambda var: var.identifier,
                                      self.functions[self.current_function].parameters.values())))))
         instructions.extend(save_instructions)
         instructions.extend([
-            self.tree[ctx.blockExpression()],
-            finstr('ret')
+            self.tree.pop(ctx.blockExpression()),
+            Instr('ret')
         ])
         self.current_function = None
-        self.tree[ctx] = '\n'.join(instructions)
+        self.constants.clear()
+        self.conditions.clear()
+        self.tree[ctx] = Chunk(*instructions)
         return super().exitFunction(ctx)
 
 # Implement root rules (crate and item)
     def exitItem(self, ctx: RustyParser.ItemContext):
-        self.tree[ctx] = self.tree[ctx.function()]
+        self.tree[ctx] = self.tree.pop(ctx.function())
         return super().exitItem(ctx)
 
-    def exitCrate(self, ctx: RustyParser.CrateContext):
-        self.tree[ctx] = ''
-        if ctx.item() is None:
-            return super().exitCrate(ctx)
+    def link(self, items: Iterable[Chunk]) -> Chunk:
+        '''Builds the whole program from translated items: the program calls
+        entry function and stops the VM after it returns.
+
+        :param self: listener
+        :type self: class:`rustyc.frontend.FERListener`
+        :param items: translated items of crate
+        :type items: Iterable[class:`rustyc.ir.Chunk`]
 
-        if 'main' not in self.functions:
+        :return: translated program
+        :rtype: class:`rustyc.ir.Chunk`
+        '''
+        if self.entry is None:
+            return Chunk(*items)
+        if self.entry not in self.functions:
             raise Exception # no start function defined
 
         program = [
-            finstr('call main'),
-            finstr('stop')
+            Instr('call', self.entry),
+            Instr('stop')
         ]
-        program.extend(map(self.tree.get, ctx.item()))
-        self.tree[ctx] = '\n'.join(program)
+        program.extend(items)
+        return Chunk(*program)
+
+    def exitCrate(self, ctx: RustyParser.CrateContext):
+        self.tree[ctx] = Chunk()
+        if ctx.item() is None:
+            return super().exitCrate(ctx)
+
+        self.tree[ctx] = self.link(map(self.tree.pop, ctx.item()))
         return super().exitCrate(ctx)
+
+
+def translate(parser: RustyParser, listener: FERListener) -> Chunk:
+    '''Parses and translates crate item by item. Parse tree of an item is
+    walked as soon as it is parsed and released before the next item is parsed,
+    so at most one function's parse tree is alive at a time.
+
+    :param parser: parser over the source tokens
+    :type parser: class:`rustyc.libs.RustyParser.RustyParser`
+    :param listener: listener that collects translations and metadata
+    :type listener: class:`rustyc.frontend.FERListener`
+
+    :return: translated program
+    :rtype: class:`rustyc.ir.Chunk`
+    '''
+    walker = ParseTreeWalker()
+    tokens = parser.getTokenStream()
+    items = []
+    while tokens.LA(1) != Token.EOF:
+        item = parser.item()
+        walker.walk(listener, item)
+        items.append(listener.tree.pop(item))
+        del item
+    if not items:
+        return Chunk()
+    return listener.link(items)
@@ -0,0 +1,291 @@
+#!/usr/bin/env python3
+'''Модуль, реализующий встраивание (inlining) функций в места их вызова.
+
+Инструкция `call f` заменяется телом функции f, в котором:
++ идентификаторы переменных f (параметров и локальных переменных) заменены
+  новыми идентификаторами локальных переменных вызывающей функции - они
+  добавляются в `FnMeta.locals` вызывающей функции;
++ метки переименованы, чтобы не совпадать с метками других копий тела;
++ каждая инструкция `ret` заменена переходом на метку продолжения, которая
+  ставится сразу после встроенного тела.
+
+Аргументы вызова уже лежат на стеке операндов, поэтому пролог функции (сохранение
+параметров инструкциями store) остается без изменений. Новый фрейм вызова
+инициализирует все переменные нулем, поэтому переменные, которые могут быть
+прочитаны до первой записи, явно обнуляются перед встроенным телом.
+
+Встраиваются только нерекурсивные функции: небольшие - во все места вызова,
+вызываемые один раз - независимо от размера в пределах `MAX_SINGLE_CALL_SIZE`.
+Функции обрабатываются от листьев графа вызовов к корню, а общий прирост размера
+программы ограничен. По профилю исполнения (см. `rustyc.pgo`) ни разу не
+исполненные места вызова пропускаются, а в горячие места встраиваются функции
+до `MAX_HOT_INLINE_SIZE` инструкций.
+'''
+from collections import Counter
+from typing import Iterable, Optional
+
+from .ir import Item, Label, Instr, JUMPS
+from .frontend import FnMeta, VariableMeta
+from .dce import split_functions, call_graph, basic_blocks, successors
+from .pgo import Profile
+
+
+# functions of at most this number of instructions are inlined everywhere
+MAX_INLINE_SIZE = 16
+# functions called once are inlined if they are not larger than this
+MAX_SINGLE_CALL_SIZE = 256
+# functions of at most this number of instructions are inlined into hot calls
+MAX_HOT_INLINE_SIZE = 64
+# default limit of the program's growth in percents
+DEFAULT_MAX_GROWTH = 100
+
+
+def _instructions(items: Iterable[Item]) -> int:
+    return sum(1 for item in items if isinstance(item, Instr))
+
+
+def recursive_functions(graph: dict[str, set[str]]) -> set[str]:
+    '''Finds functions that can call themselves directly or through other
+    functions.
+
+    :param graph: names of callees by name of caller
+    :type graph: dict[str, set[str]]
+
+    :return: names of recursive functions
+    :rtype: set[str]
+    '''
+    recursive = set()
+    for name in graph:
+        seen = set()
+        worklist = list(graph[name])
+        while worklist:
+            callee = worklist.pop()
+            if callee == name:
+                recursive.add(name)
+                break
+            if callee in seen or callee not in graph:
+                continue
+            seen.add(callee)
+            worklist.extend(graph[callee])
+    return recursive
+
+
+def bottom_up(graph: dict[str, set[str]]) -> list[str]:
+    '''Orders functions so that callees precede their callers (post-order of
+    the call graph, cycles are broken arbitrarily).
+
+    :param graph: names of callees by name of caller
+    :type graph: dict[str, set[str]]
+
+    :return: names of functions
+    :rtype: list[str]
+    '''
+    order = []
+    visited = set()
+    for root in graph:
+        if root in visited:
+            continue
+        visited.add(root)
+        stack = [(root, iter(sorted(graph[root])))]
+        while stack:
+            name, callees = stack[-1]
+            for callee in callees:
+                if callee in graph and callee not in visited:
+                    visited.add(callee)
+                    stack.append((callee, iter(sorted(graph[callee]))))
+                    break
+            else:
+                stack.pop()
+                order.append(name)
+    return order
+
+
+def maybe_uninitialized(code: list[Item]) -> set[int]:
+    '''Finds variables that can be loaded on some path before any store to
+    them, i.e. variables that rely on zero-initialization of a new frame.
+
+    :param code: code of function
+    :type code: list[Item]
+
+    :return: identifiers of variables
+    :rtype: set[int]
+    '''
+    blocks = basic_blocks(code)
+    labels = { item.name: i for i, block in enumerate(blocks)
+               for item in block if isinstance(item, Label) }
+    variables = { item.arg for item in code
+                  if isinstance(item, Instr) and item.op in ('load', 'store') }
+    # variables that are surely stored at the beginning of every block
+    stored = [ set(variables) for _ in blocks ]
+    if blocks:
+        stored[0] = set()
+    result = set()
+    changed = True
+    while changed:
+        changed = False
+        for index, block in enumerate(blocks):
+            current = set(stored[index])
+            for item in block:
+                if not isinstance(item, Instr):
+                    continue
+                if item.op == 'load' and item.arg not in current:
+                    result.add(item.arg)
+                elif item.op == 'store':
+                    current.add(item.arg)
+            for successor in successors(blocks, index, labels):
+                narrowed = stored[successor] & current
+                if narrowed != stored[successor]:
+                    stored[successor] = narrowed
+                    changed = True
+    return result
+
+
+class Inliner:
+    '''Substitutes calls of small non-recursive functions with their bodies.
+    '''
+    def __init__(self, functions: dict[str, FnMeta],
+                 max_growth: int = DEFAULT_MAX_GROWTH,
+                 profile: Optional[Profile] = None):
+        '''Constructor
+
+        :param functions: metadata of all functions, locals of callers are
+        extended with slots for inlined variables
+        :type functions: dict[str, class:`rustyc.frontend.FnMeta`]
+        :param max_growth: limit of program's growth in percents
+        :type max_growth: int, default 100
+        :param profile: execution profile
+        :type profile: Optional[class:`rustyc.pgo.Profile`]
+        '''
+        self.functions = functions
+        self.max_growth = max_growth
+        self.profile = profile
+        self.counter = 0
+
+    def _slots(self, caller: str, callee: str) -> dict[int, int]:
+        '''Reserves fresh variables of the caller for every variable of callee.
+        '''
+        caller_meta = self.functions[caller]
+        callee_meta = self.functions[callee]
+        mapping = {}
+        variables = list(callee_meta.parameters.items()) \
+            + list(callee_meta.locals.items())
+        for name, variable in variables:
+            identifier = len(caller_meta.parameters) + len(caller_meta.locals)
+            caller_meta.locals[f'{callee}.{self.counter}.{name}'] \
+                = VariableMeta(identifier, variable.mutable)
+            mapping[variable.identifier] = identifier
+        return mapping
+
+    def expand(self, caller: str, callee: str, body: list[Item]) -> list[Item]:
+        '''Builds copy of callee's body to be placed instead of its call.
+
+        :param self: inliner
+        :type self: class:`rustyc.inline.Inliner`
+        :param caller: name of the function that contains the call
+        :type caller: str
+        :param callee: name of the called function
+        :type callee: str
+        :param body: code of callee starting with its label
+        :type body: list[Item]
+
+        :return: code to be placed instead of call instruction
+        :rtype: list[Item]
+        '''
+        self.counter += 1
+        mapping = self._slots(caller, callee)
+        prefix = f'.{self.counter}_inl{callee}'
+        continuation = f'{prefix}_cont'
+
+        code = []
+        for identifier in sorted(maybe_uninitialized(body[1:])):
+            code.extend([Instr('push', 0), Instr('store', mapping[identifier])])
+        for item in body[1:]:
+            if isinstance(item, Label):
+                code.append(Label(prefix + item.name))
+            elif item.op in ('load', 'store'):
+                code.append(Instr(item.op, mapping[item.arg]))
+            elif item.op in JUMPS:
+                code.append(Instr(item.op, prefix + item.arg))
+            elif item.op == 'ret':
+                code.append(Instr('jmp', continuation))
+            else:
+                code.append(item)
+        code.append(Label(continuation))
+        return code
+
+    def run(self, items: Iterable[Item]) -> tuple[list[Item], Counter]:
+        '''Inlines calls in the whole program.
+
+        :param self: inliner
+        :type self: class:`rustyc.inline.Inliner`
+        :param items: labels and instructions
+        :type items: Iterable[Item]
+
+        :return: program and number of inlined calls
+        :rtype: (list[Item], class:`collections.Counter`)
+        '''
+        items = [ item for item in items if isinstance(item, (Label, Instr)) ]
+        prologue, bodies = split_functions(items, self.functions)
+        graph = call_graph(bodies)
+        recursive = recursive_functions(graph)
+        sites = Counter(item.arg for item in items
+                        if isinstance(item, Instr) and item.op == 'call')
+
+        size = _instructions(items)
+        budget = size * self.max_growth // 100
+        inlined = Counter({ 'calls': 0 })
+        for caller in bottom_up(graph):
+            code = []
+            # execution count of the current block, None if it is unknown
+            count = self.profile.count(caller) if self.profile else None
+            for item in bodies[caller]:
+                if isinstance(item, Label) and self.profile:
+                    count = self.profile.count(item.name)
+                callee = item.arg if isinstance(item, Instr) \
+                    and item.op == 'call' else None
+                if isinstance(item, Instr) and item.op in JUMPS:
+                    count = None # the next block is not labeled
+                if callee is None or callee == caller or callee in recursive \
+                        or callee == 'main' or callee not in bodies:
+                    code.append(item)
+                    continue
+                callee_size = _instructions(bodies[callee])
+                small = callee_size <= MAX_INLINE_SIZE
+                single = sites[callee] == 1 and callee_size <= MAX_SINGLE_CALL_SIZE
+                if self.profile and count == 0:
+                    small = False # the call is never executed
+                if self.profile and self.profile.is_hot(count):
+                    small = callee_size <= MAX_HOT_INLINE_SIZE
+                growth = callee_size - 1
+                if not (small or single) or growth > budget:
+                    code.append(item)
+                    continue
+                budget -= growth
+                code.extend(self.expand(caller, callee, bodies[callee]))
+                inlined['calls'] += 1
+            bodies[caller] = code
+
+        program = list(prologue)
+        for body in bodies.values():
+            program.extend(body)
+        return program, inlined
+
+
+def inline(items: Iterable[Item], functions: dict[str, FnMeta],
+           max_growth: int = DEFAULT_MAX_GROWTH,
+           profile: Optional[Profile] = None) -> tuple[list[Item], Counter]:
+    '''Inlines calls of small non-recursive functions.
+
+    :param items: labels and instructions
+    :type items: Iterable[Item]
+    :param functions: metadata of all functions
+    :type functions: dict[str, class:`rustyc.frontend.FnMeta`]
+    :param max_growth: limit of program's growth in percents
+    :type max_growth: int, default 100
+    :param profile: execution profile
+    :type profile: Optional[class:`rustyc.pgo.Profile`]
+
+    :return: program and number of inlined calls
+    :rtype: (list[Item], class:`collections.Counter`)
+    '''
+    return Inliner(functions, max_growth, profile).run(items)
@@ -0,0 +1,131 @@
+#!/usr/bin/env python3
+'''Модуль, описывающий промежуточное представление программы, которое строит
+фронтенд компилятора. Программа - это последовательность меток и инструкций.
+Аргументом инструкций call, tcall, jmp, jift и jiff является имя метки, аргументом
+остальных инструкций - целое число.
+
+Фрагменты программы объединяются в дерево `Chunk` за время, пропорциональное
+числу непосредственных частей, без копирования содержимого вложенных фрагментов.
+Дерево обходится один раз - при сериализации или разрешении меток.
+
+Текстовая форма программы получается сериализацией каждого элемента в
+отдельную строку. Пустые блоки кода представлены элементом `BLANK`, который
+сериализуется в пустую строку и не является инструкцией.
+'''
+from typing import Iterable, Iterator, Optional, Union
+
+
+LABEL_OPERANDS = ('call', 'tcall', 'jmp', 'jift', 'jiff')
+# instructions that pass control to a label inside the function
+JUMPS = ('jmp', 'jift', 'jiff')
+# instructions that never pass control to the next one
+TERMINATORS = ('jmp', 'ret', 'stop', 'tcall')
+
+
+class Label:
+    '''Label that marks address of the next instruction.
+    '''
+    __slots__ = ('name',)
+
+    def __init__(self, name: str):
+        self.name = name
+
+    def __str__(self) -> str:
+        return self.name + ':'
+
+    def __repr__(self) -> str:
+        return f'Label({self.name!r})'
+
+    def __eq__(self, other) -> bool:
+        return isinstance(other, Label) and self.name == other.name
+
+    def __hash__(self) -> int:
+        return hash(self.name)
+
+
+class Instr:
+    '''Single VM instruction with optional argument. Spelling is the original
+    text of the literal argument that is used for textual form only.
+    '''
+    __slots__ = ('op', 'arg', 'spelling')
+
+    def __init__(self, op: str, arg: Optional[Union[int, str]] = None,
+                 spelling: Optional[str] = None):
+        self.op = op
+        self.arg = arg
+        self.spelling = spelling
+
+    def __str__(self) -> str:
+        if self.arg is None and self.spelling is None:
+            return '\t' + self.op
+        return '\t' + self.op + ' ' + (self.spelling or str(self.arg))
+
+    def __repr__(self) -> str:
+        if self.arg is None:
+            return f'Instr({self.op!r})'
+        return f'Instr({self.op!r}, {self.arg!r})'
+
+    def __eq__(self, other) -> bool:
+        return isinstance(other, Instr) and self.op == other.op \
+            and self.arg == other.arg
+
+    def __hash__(self) -> int:
+        return hash((self.op, self.arg))
+
+
+class _Blank:
+    '''Placeholder of empty code block in textual form.
+    '''
+    __slots__ = ()
+
+    def __str__(self) -> str:
+        return ''
+
+    def __repr__(self) -> str:
+        return 'BLANK'
+
+
+BLANK = _Blank()
+
+Item = Union[Label, Instr, _Blank]
+
+
+class Chunk:
+    '''Immutable concatenation of items and other chunks. Building a chunk does
+    not copy nested chunks, iterating over it yields items in program order.
+    '''
+    __slots__ = ('parts', 'size')
+
+    def __init__(self, *parts: Union[Item, 'Chunk']):
+        self.parts = parts
+        self.size = sum(part.size if isinstance(part, Chunk) else 1
+                        for part in parts)
+
+    def __len__(self) -> int:
+        return self.size
+
+    def __iter__(self) -> Iterator[Item]:
+        stack = [iter(self.parts)]
+        while stack:
+            for part in stack[-1]:
+                if isinstance(part, Chunk):
+                    stack.append(iter(part.parts))
+                    break
+                yield part
+            else:
+                stack.pop()
+
+    def __repr__(self) -> str:
+        return f'Chunk({list(self)!r})'
+
+
+def serialize(items: Iterable[Item]) -> str:
+    '''Translates program to its textual form.
+
+    :param items: labels and instructions
+    :type items: Iterable[Item]
+
+    :return: program in text
+    :rtype: str
+    '''
+    return '\n'.join(map(str, items))
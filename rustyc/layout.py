@@ -0,0 +1,367 @@
+#!/usr/bin/env python3
+'''Модуль, реализующий размещение базовых блоков (block layout) и сокращение
+цепочек переходов (jump threading).
+
+Функция разбивается на базовые блоки, у каждого из которых явно записываются
+преемники: блок, в который передается управление безусловно или при ложном
+условии, и блок, в который передается управление при истинном условии. После
+этого:
+
++ переходы на пустые блоки, которые только передают управление дальше
+  (например, цепочки от `break` и `jmp .fi` пустой ветки else), заменяются
+  переходами в конечный блок;
++ безусловный переход на маленький блок, который заканчивается возвратом или
+  условным переходом, заменяется копией этого блока. Так `jmp` на `ret`
+  становится `ret`, а переход на условие цикла `while` - проверкой условия
+  перед входом в цикл;
++ блоки размещаются так, чтобы как можно больше переходов стали проходом к
+  следующему блоку: следующим ставится преемник, идущий далее в исходном
+  порядке, или преемник, в который больше никто не переходит. Если известен
+  профиль исполнения (см. `rustyc.pgo`), следующим ставится более горячий
+  преемник условного перехода;
++ если следующим поставлен блок истинного условия, условный переход
+  инвертируется в инструкцию jiff, которая переходит при нулевом условии.
+
+Например:
+```
+    load 0
+    jift .0_then_utlbl
+    jmp .1_fi_utlbl
+.0_then_utlbl:
+    ...
+.1_fi_utlbl:
+```
+становится
+```
+    load 0
+    jiff .1_fi_utlbl
+    ...
+.1_fi_utlbl:
+```
+'''
+from collections import Counter
+from typing import Iterable, Optional
+
+from .ir import Item, Label, Instr, JUMPS, TERMINATORS
+from .frontend import FnMeta
+from .dce import split_functions, basic_blocks
+from .pgo import Profile
+
+
+# limit of instructions of the block copied instead of the jump to it
+MAX_DUPLICATED_SIZE = 4
+
+
+class Block:
+    '''Basic block with explicit successors. Block either leaves function by
+    its exit instruction or passes control to the successor, if branch is set
+    then control goes there when the popped condition is not zero.
+    '''
+    def __init__(self, labels: list[Label], code: list[Instr],
+                 exit_: Optional[Instr] = None, successor: Optional[int] = None,
+                 branch: Optional[int] = None):
+        self.labels = labels
+        self.code = code
+        self.exit = exit_
+        self.successor = successor
+        self.branch = branch
+
+    @property
+    def successors(self) -> list[int]:
+        '''Indices of blocks that may be executed after this one.
+        '''
+        return [ index for index in (self.successor, self.branch)
+                 if index is not None ]
+
+    @property
+    def is_empty(self) -> bool:
+        '''Block has no instructions except unconditional jump.
+        '''
+        return not self.code and self.exit is None and self.branch is None
+
+
+def build_blocks(code: list[Item]) -> Optional[list[Block]]:
+    '''Splits function into basic blocks with explicit successors.
+
+    :param code: code of function
+    :type code: list[Item]
+
+    :return: blocks in program order or None if control leaves the function
+    without terminator or jumps outside of it
+    :rtype: Optional[list[class:`rustyc.layout.Block`]]
+    '''
+    items = basic_blocks(code)
+    labels = { item.name: i for i, block in enumerate(items)
+               for item in block if isinstance(item, Label) }
+    blocks = []
+    for i, block in enumerate(items):
+        head = [ item for item in block if isinstance(item, Label) ]
+        instructions = block[len(head):]
+        last = instructions[-1] if instructions else None
+        if last is not None and last.op in JUMPS:
+            if last.arg not in labels:
+                return None
+            if last.op != 'jmp' and i + 1 == len(items):
+                return None
+            target = labels[last.arg]
+            successor, branch = {
+                'jmp': (target, None),
+                'jift': (i + 1, target),
+                'jiff': (target, i + 1),
+            }[last.op]
+            blocks.append(Block(head, instructions[:-1], None, successor, branch))
+        elif last is not None and last.op in TERMINATORS:
+            blocks.append(Block(head, instructions[:-1], last))
+        elif i + 1 < len(items):
+            blocks.append(Block(head, instructions, None, i + 1))
+        else:
+            return None
+    return blocks
+
+
+def thread_jumps(blocks: list[Block]):
+    '''Retargets transfers of control to empty blocks to their final
+    destinations.
+
+    :param blocks: blocks of function
+    :type blocks: list[class:`rustyc.layout.Block`]
+    '''
+    def resolve(index: int) -> int:
+        visited = set()
+        while blocks[index].is_empty and index not in visited:
+            visited.add(index)
+            index = blocks[index].successor
+        return index
+
+    for block in blocks:
+        for field in ('successor', 'branch'):
+            index = getattr(block, field)
+            if index is not None:
+                setattr(block, field, resolve(index))
+        if block.branch is not None and block.branch == block.successor:
+            # both ways lead to the same block, only the condition is dropped
+            block.code = block.code + [Instr('pop')]
+            block.branch = None
+
+
+def duplicate_tails(blocks: list[Block], jumps: set[int]):
+    '''Replaces unconditional jumps to small blocks that end with return or
+    conditional branch by copies of those blocks.
+
+    :param blocks: blocks of function
+    :type blocks: list[class:`rustyc.layout.Block`]
+    :param jumps: indices of blocks that end with explicit jmp
+    :type jumps: set[int]
+    '''
+    for index in sorted(jumps):
+        block = blocks[index]
+        if block.branch is not None or block.exit is not None:
+            continue
+        target = blocks[block.successor]
+        if block.successor == index or len(target.code) > MAX_DUPLICATED_SIZE \
+                or (target.exit is None and target.branch is None):
+            continue
+        block.code = block.code + target.code
+        block.exit = target.exit
+        block.successor = target.successor
+        block.branch = target.branch
+
+
+def reachable_blocks(blocks: list[Block]) -> list[int]:
+    '''Finds blocks reachable from the first one.
+
+    :param blocks: blocks of function
+    :type blocks: list[class:`rustyc.layout.Block`]
+
+    :return: indices of reachable blocks in program order
+    :rtype: list[int]
+    '''
+    reachable = set()
+    worklist = [0]
+    while worklist:
+        index = worklist.pop()
+        if index in reachable:
+            continue
+        reachable.add(index)
+        worklist.extend(blocks[index].successors)
+    return sorted(reachable)
+
+
+def block_weights(blocks: list[Block], reachable: list[int],
+                  profile: Profile) -> dict[int, int]:
+    '''Estimates execution counts of blocks. Labeled blocks take counts of
+    their labels, the block with the single predecessor takes the part of the
+    predecessor's count that does not go to its other successor.
+
+    :param blocks: blocks of function
+    :type blocks: list[class:`rustyc.layout.Block`]
+    :param reachable: indices of reachable blocks
+    :type reachable: list[int]
+    :param profile: execution profile
+    :type profile: class:`rustyc.pgo.Profile`
+
+    :return: counts of blocks by their indices, unknown counts are omitted
+    :rtype: dict[int, int]
+    '''
+    weights = {}
+    predecessors = { index: [] for index in reachable }
+    for index in reachable:
+        counts = [ count for count in (profile.count(label.name)
+                                       for label in blocks[index].labels)
+                   if count is not None ]
+        if counts:
+            weights[index] = max(counts)
+        for successor in set(blocks[index].successors):
+            predecessors[successor].append(index)
+
+    changed = True
+    while changed:
+        changed = False
+        for index in reachable:
+            if index in weights or len(predecessors[index]) != 1 \
+                    or predecessors[index][0] not in weights:
+                continue
+            predecessor = predecessors[index][0]
+            others = [ successor for successor in blocks[predecessor].successors
+                       if successor != index ]
+            if not others:
+                weights[index] = weights[predecessor]
+            elif others[0] in weights and predecessors[others[0]] == [predecessor]:
+                weights[index] = max(0, weights[predecessor] - weights[others[0]])
+            else:
+                continue
+            changed = True
+    return weights
+
+
+def place_blocks(blocks: list[Block], reachable: list[int],
+                 weights: Optional[dict[int, int]] = None) -> list[int]:
+    '''Orders blocks so that control falls through to the next block as often
+    as possible. The first block stays the first.
+
+    :param blocks: blocks of function
+    :type blocks: list[class:`rustyc.layout.Block`]
+    :param reachable: indices of blocks to place in program order
+    :type reachable: list[int]
+    :param weights: execution counts of blocks, the hotter successor of the
+    conditional branch is placed next
+    :type weights: Optional[dict[int, int]]
+
+    :return: indices of blocks in new order
+    :rtype: list[int]
+    '''
+    weights = weights or {}
+    predecessors = Counter(successor for index in reachable
+                           for successor in set(blocks[index].successors))
+    order = []
+    unplaced = list(reachable)
+    current = 0
+    while True:
+        order.append(current)
+        unplaced.remove(current)
+        if not unplaced:
+            break
+        candidates = [ index for index in blocks[current].successors
+                       if index in unplaced ]
+        following = next((index for index in unplaced if index > current), None)
+        known = [ weights[index] for index in candidates if index in weights ]
+        if len(candidates) == 2 and len(known) == 2 and known[0] != known[1]:
+            current = max(candidates, key=weights.get)
+        elif following in candidates:
+            current = following
+        else:
+            single = sorted(index for index in candidates
+                            if predecessors[index] == 1)
+            current = single[0] if single else unplaced[0]
+    return order
+
+
+def layout_function(code: list[Item], name: str,
+                    profile: Optional[Profile] = None) -> list[Item]:
+    '''Threads jumps and reorders basic blocks of function.
+
+    :param code: code of function
+    :type code: list[Item]
+    :param name: name of function, it is used for new labels
+    :type name: str
+    :param profile: execution profile
+    :type profile: Optional[class:`rustyc.pgo.Profile`]
+
+    :return: code of function
+    :rtype: list[Item]
+    '''
+    blocks = build_blocks(code)
+    if not blocks:
+        return code
+    jumps = { i for i, block in enumerate(basic_blocks(code))
+              if isinstance(block[-1], Instr) and block[-1].op == 'jmp' }
+    thread_jumps(blocks)
+    duplicate_tails(blocks, jumps)
+    reachable = reachable_blocks(blocks)
+    weights = block_weights(blocks, reachable, profile) if profile else None
+    order = place_blocks(blocks, reachable, weights)
+
+    names = {}
+    def target(index: int) -> str:
+        if index not in names:
+            labels = blocks[index].labels
+            names[index] = labels[0].name if labels \
+                else f'.{index}_{name}_block_utlbl'
+        return names[index]
+
+    tails = []
+    for position, index in enumerate(order):
+        block = blocks[index]
+        following = order[position + 1] if position + 1 < len(order) else None
+        if block.exit is not None:
+            tail = [block.exit]
+        elif block.branch is None:
+            tail = [] if block.successor == following \
+                else [Instr('jmp', target(block.successor))]
+        elif block.successor == following:
+            tail = [Instr('jift', target(block.branch))]
+        elif block.branch == following:
+            tail = [Instr('jiff', target(block.successor))]
+        else:
+            tail = [Instr('jift', target(block.branch)),
+                    Instr('jmp', target(block.successor))]
+        tails.append(tail)
+
+    result = []
+    for index, tail in zip(order, tails):
+        block = blocks[index]
+        if index == 0:
+            result.extend(block.labels[:1])
+        if index in names and index != 0:
+            result.append(Label(names[index]))
+        result.extend(block.code)
+        result.extend(tail)
+    return result
+
+
+def arrange(items: Iterable[Item], functions: dict[str, FnMeta],
+            profile: Optional[Profile] = None) -> tuple[list[Item], Counter]:
+    '''Threads jumps and lays out basic blocks of all functions.
+
+    :param items: labels and instructions
+    :type items: Iterable[Item]
+    :param functions: metadata of all functions
+    :type functions: dict[str, class:`rustyc.frontend.FnMeta`]
+    :param profile: execution profile
+    :type profile: Optional[class:`rustyc.pgo.Profile`]
+
+    :return: program and number of removed jumps
+    :rtype: (list[Item], class:`collections.Counter`)
+    '''
+    items = [ item for item in items if isinstance(item, (Label, Instr)) ]
+    prologue, bodies = split_functions(items, functions)
+    removed = Counter({ 'jumps': 0 })
+    program = list(prologue)
+    for name, body in bodies.items():
+        code = layout_function(body, name, profile)
+        removed['jumps'] += sum(1 for item in body if isinstance(item, Instr)
+                                and item.op in JUMPS) \
+            - sum(1 for item in code if isinstance(item, Instr)
+                  and item.op in JUMPS)
+        program.extend(code)
+    return program, removed
@@ -0,0 +1,213 @@
+#!/usr/bin/env python3
+'''Модуль, реализующий вынос инвариантного кода из циклов (loop-invariant code
+motion).
+
+Цикл - это участок кода от метки до инструкции перехода назад на эту метку
+(обратной дуги). Так фронтенд транслирует и `loop`, и `while`. Внутри цикла ищутся
+выражения, которые вычисляются только из констант и переменных, не изменяемых в
+цикле, с помощью чистых операций, не вызывающих исключений виртуальной машины.
+Каждое такое выражение из двух и более инструкций вычисляется один раз перед
+циклом и сохраняется во временную переменную, а в теле цикла заменяется ее
+загрузкой. Вызовы функций не могут изменить переменные вызывающей функции, так
+как каждая функция работает в собственном фрейме.
+
+Код перед циклом ставится перед меткой заголовка цикла, если в цикл можно войти
+только последовательно, или перед единственным переходом внутрь цикла, который
+стоит прямо перед заголовком (так транслируется `while`). Циклы с другими
+входами не обрабатываются. Вложенные циклы обрабатываются от внутренних к
+внешним.
+'''
+from collections import Counter
+from typing import Iterable, NamedTuple, Optional
+
+from .ir import Item, Label, Instr, JUMPS, LABEL_OPERANDS, TERMINATORS
+from .frontend import FnMeta, VariableMeta
+from .dce import split_functions
+
+
+# operations without side effects that never trap
+PURE_BINARY = ('add', 'sub', 'mul', 'shl', 'shr', 'max', 'min', 'and', 'or',
+               'xor', 'lt', 'le', 'eq', 'neq', 'ge', 'gt')
+PURE_UNARY = ('inc', 'dec', 'neg', 'not')
+
+
+class Fragment(NamedTuple):
+    '''Range of instructions that pushes a single value onto the stack.
+    '''
+    begin: int
+    end: int
+    invariant: bool
+
+
+def _loops(code: list[Item]) -> list[tuple[int, int]]:
+    '''Finds loops as ranges from header label to the back edge, innermost
+    loops go first.
+    '''
+    labels = { item.name: i for i, item in enumerate(code)
+               if isinstance(item, Label) }
+    loops = []
+    for i, item in enumerate(code):
+        if isinstance(item, Instr) and item.op in JUMPS \
+                and labels.get(item.arg, i) < i:
+            loops.append((labels[item.arg], i))
+    return sorted(loops, key=lambda loop: loop[1] - loop[0])
+
+
+def _preheader(code: list[Item], header: int, end: int) -> Optional[int]:
+    '''Finds position to insert code executed once before the loop.
+    '''
+    inside = { item.name for item in code[header:end + 1]
+               if isinstance(item, Label) }
+    entries = [ i for i, item in enumerate(code)
+                if not header <= i <= end and isinstance(item, Instr)
+                and item.op in LABEL_OPERANDS and item.arg in inside ]
+    previous = header - 1
+    while previous >= 0 and isinstance(code[previous], Label):
+        previous -= 1
+    falls_through = previous < 0 or not (isinstance(code[previous], Instr)
+                                         and code[previous].op in TERMINATORS)
+    if not entries and falls_through:
+        return header
+    if entries == [previous] and code[previous].op == 'jmp':
+        return previous
+    return None
+
+
+def invariant_expressions(code: list[Item], begin: int, end: int) -> list[Fragment]:
+    '''Finds maximal invariant expressions of at least two instructions in
+    the range of code.
+
+    :param code: code of function
+    :type code: list[Item]
+    :param begin: position of the loop's header
+    :type begin: int
+    :param end: position of the loop's back edge
+    :type end: int
+
+    :return: ranges of invariant expressions
+    :rtype: list[class:`rustyc.licm.Fragment`]
+    '''
+    stored = { item.arg for item in code[begin:end + 1]
+               if isinstance(item, Instr) and item.op == 'store' }
+    found = []
+    stack = []
+
+    def flush(fragments: Iterable[Fragment]):
+        for fragment in fragments:
+            if fragment.invariant and fragment.end - fragment.begin >= 2:
+                found.append(fragment)
+
+    for i in range(begin, end + 1):
+        item = code[i]
+        if isinstance(item, Label):
+            flush(stack)
+            stack = []
+            continue
+        if item.op == 'push' or (item.op == 'load' and item.arg not in stored):
+            stack.append(Fragment(i, i + 1, isinstance(item.arg, int)))
+            continue
+        arity = 2 if item.op in PURE_BINARY else 1 if item.op in PURE_UNARY else None
+        if arity is None or len(stack) < arity:
+            flush(stack)
+            stack = []
+            continue
+        operands = stack[-arity:]
+        del stack[-arity:]
+        invariant = all(operand.invariant for operand in operands) \
+            and operands[-1].end == i \
+            and all(a.end == b.begin for a, b in zip(operands, operands[1:]))
+        if invariant:
+            stack.append(Fragment(operands[0].begin, i + 1, True))
+        else:
+            flush(operands)
+            stack.append(Fragment(i, i + 1, False))
+    flush(stack)
+    return found
+
+
+def fresh_variable(code: list[Item], meta: FnMeta) -> int:
+    '''Finds identifier of variable that is not used by function.
+
+    :param code: code of function
+    :type code: list[Item]
+    :param meta: function's metadata
+    :type meta: class:`rustyc.frontend.FnMeta`
+
+    :return: identifier of variable
+    :rtype: int
+    '''
+    identifiers = { item.arg for item in code
+                    if isinstance(item, Instr) and item.op in ('load', 'store') }
+    identifiers.update(variable.identifier for variable
+                       in [*meta.parameters.values(), *meta.locals.values()])
+    return max(identifiers, default=-1) + 1
+
+
+def hoist_function(code: list[Item], meta: FnMeta, removed: Counter) -> list[Item]:
+    '''Hoists invariant expressions out of all loops of function.
+
+    :param code: code of function
+    :type code: list[Item]
+    :param meta: function's metadata, temporary variables are added to locals
+    :type meta: class:`rustyc.frontend.FnMeta`
+    :param removed: counter of instructions removed from loops
+    :type removed: class:`collections.Counter`
+
+    :return: code of function
+    :rtype: list[Item]
+    '''
+    processed = set()
+    while True:
+        loops = [ loop for loop in _loops(code)
+                  if code[loop[0]].name not in processed ]
+        if not loops:
+            return code
+        header, end = loops[0]
+        processed.add(code[header].name)
+        position = _preheader(code, header, end)
+        if position is None:
+            continue
+        fragments = invariant_expressions(code, header, end)
+        if not fragments:
+            continue
+
+        preheader = []
+        replacements = {}
+        for fragment in fragments:
+            identifier = fresh_variable(code + preheader, meta)
+            meta.locals[f'.licm{identifier}'] = VariableMeta(identifier, True)
+            preheader.extend(code[fragment.begin:fragment.end])
+            preheader.append(Instr('store', identifier))
+            replacements[fragment.begin] = (fragment.end, Instr('load', identifier))
+            removed['loop-instructions'] += fragment.end - fragment.begin - 1
+
+        result = code[:position] + preheader + code[position:header]
+        i = header
+        while i < len(code):
+            if i in replacements:
+                i, load = replacements[i]
+                result.append(load)
+                continue
+            result.append(code[i])
+            i += 1
+        code = result
+
+
+def hoist(items: Iterable[Item], functions: dict[str, FnMeta]) -> tuple[list[Item], Counter]:
+    '''Hoists loop invariant expressions in all functions.
+
+    :param items: labels and instructions
+    :type items: Iterable[Item]
+    :param functions: metadata of all functions
+    :type functions: dict[str, class:`rustyc.frontend.FnMeta`]
+
+    :return: program and number of instructions removed from loops
+    :rtype: (list[Item], class:`collections.Counter`)
+    '''
+    items = [ item for item in items if isinstance(item, (Label, Instr)) ]
+    prologue, bodies = split_functions(items, functions)
+    removed = Counter({ 'loop-instructions': 0 })
+    program = list(prologue)
+    for name, body in bodies.items():
+        program.extend(hoist_function(body, functions[name], removed))
+    return program, removed
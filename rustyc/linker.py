@@ -0,0 +1,170 @@
+#!/usr/bin/env python3
+'''Модуль, реализующий раздельную компиляцию: перемещаемые объектные файлы и
+компоновщик.
+
+Исходный файл компилируется в объектный файл командой `rustyc --emit obj`.
+Функция `main` в нем не обязательна, а пролога (вызова main и остановки
+машины) нет. Объектный файл - это JSON:
+```
+{
+    "format": "rustyc-object",
+    "version": 1,
+    "container": "<контейнер rusty в base64>",
+    "relocations": [[<адрес инструкции>, "<имя функции>"], ...]
+}
+```
+Контейнер (см. `rusty.container`) хранит код, таблицу функций и строки
+исходного файла. Все функции таблицы экспортируются. Вызовы функций, которые в
+файле не определены, импортируются: инструкции call и tcall получают нулевое
+смещение и запись о перемещении (relocation).
+
+Переходы и вызовы виртуальной машины относительны, поэтому код объекта можно
+разместить по любому адресу без изменения вызовов внутри него. Компоновщик
+(`rustyc link`) ставит пролог, размещает код объектов друг за другом, проверяет,
+что каждая функция определена ровно один раз, и записывает смещения в
+перемещаемые вызовы. Адреса в таблице функций и строках сдвигаются, а глубина
+стека функций пересчитывается с числом параметров импортированных функций.
+'''
+import json
+import base64
+from dataclasses import dataclass, field
+from typing import Iterable
+
+from rusty import container, isa, traps
+
+from .backend import max_stack_depth
+
+
+FORMAT = 'rustyc-object'
+VERSION = 1
+
+
+class LinkError(Exception):
+    '''Thrown if object file is malformed or objects cannot be linked into
+    the program.
+    '''
+
+
+@dataclass
+class ObjectFile:
+    '''Relocatable object: code with function table and source lines, and
+    calls of imported functions by their addresses.
+    '''
+    program: container.Container
+    relocations: list[tuple[int, str]] = field(default_factory=list)
+
+    @property
+    def exports(self) -> list[str]:
+        '''Names of functions defined in the object.
+        '''
+        return [ function.name for function in self.program.functions ]
+
+    @property
+    def imports(self) -> set[str]:
+        '''Names of functions called but not defined in the object.
+        '''
+        return { name for _, name in self.relocations }
+
+
+def pack(obj: ObjectFile) -> bytes:
+    '''Serializes object file to bytes.
+
+    :param obj: object file
+    :type obj: class:`rustyc.linker.ObjectFile`
+
+    :return: JSON text
+    :rtype: bytes
+    '''
+    return json.dumps({
+        'format': FORMAT,
+        'version': VERSION,
+        'container': base64.b64encode(container.pack(obj.program)).decode('ascii'),
+        'relocations': [ [address, name] for address, name in obj.relocations ],
+    }, indent=1).encode('utf-8')
+
+
+def unpack(buffer: bytes) -> ObjectFile:
+    '''Deserializes object file.
+
+    :param buffer: JSON text
+    :type buffer: bytes
+
+    :return: object file
+    :rtype: class:`rustyc.linker.ObjectFile`
+    '''
+    try:
+        data = json.loads(buffer)
+        if data['format'] != FORMAT:
+            raise LinkError('not an object file')
+        if data['version'] != VERSION:
+            raise LinkError(f'unsupported version {data["version"]}')
+        program = container.unpack(base64.b64decode(data['container']))
+        relocations = [ (int(address), str(name))
+                        for address, name in data['relocations'] ]
+    except (ValueError, KeyError, TypeError, traps.InvalidContainerTrap) as e:
+        raise LinkError(f'malformed object file: {e}') from e
+    for address, _ in relocations:
+        if not 0 <= address < len(program.code) or program.code[address].opcode() \
+                not in (isa.Opcode.CALL, isa.Opcode.TCALL):
+            raise LinkError(f'relocation at {address} is not a call')
+    return ObjectFile(program, relocations)
+
+
+def load(path: str) -> ObjectFile:
+    '''Reads object file.
+
+    :param path: path to object file
+    :type path: str
+
+    :return: object file
+    :rtype: class:`rustyc.linker.ObjectFile`
+    '''
+    with open(path, 'rb') as fp:
+        return unpack(fp.read())
+
+
+def link(objects: Iterable[ObjectFile], entry: str = 'main') -> container.Container:
+    '''Places objects one after another behind the prologue that calls entry
+    function, and resolves calls between objects.
+
+    :param objects: object files in order of placement
+    :type objects: Iterable[class:`rustyc.linker.ObjectFile`]
+    :param entry: name of the function called by prologue
+    :type entry: str, default 'main'
+
+    :return: runnable program
+    :rtype: class:`rusty.container.Container`
+    '''
+    code = [isa.Call(0), isa.Stop()]
+    functions: list[container.FunctionEntry] = []
+    lines = []
+    relocations = []
+    addresses = {}
+    for obj in objects:
+        base = len(code)
+        for function in obj.program.functions:
+            if function.name in addresses:
+                raise LinkError(f'function {function.name} is defined more than once')
+            addresses[function.name] = base + function.address
+            functions.append(container.FunctionEntry(function.name,
+                base + function.address, function.parameters, function.locals))
+        lines.extend((base + address, line) for address, line in obj.program.lines)
+        relocations.extend((base + address, name) for address, name in obj.relocations)
+        code.extend(obj.program.code)
+
+    if entry not in addresses:
+        raise LinkError(f'entry function {entry} is not defined')
+    relocations.append((0, entry))
+    for address, name in relocations:
+        if name not in addresses:
+            raise LinkError(f'undefined function {name}')
+        cls = type(code[address])
+        code[address] = cls(addresses[name] - address)
+
+    functions.sort(key=lambda function: function.address)
+    ends = [ function.address for function in functions[1:] ] + [len(code)]
+    callees = { function.address: function.parameters for function in functions }
+    for function, end in zip(functions, ends):
+        function.max_stack = max_stack_depth(code, function.address, end,
+                                             function.parameters, callees)
+    return container.Container(code, 0, functions, sorted(lines))
@@ -0,0 +1,190 @@
+#!/usr/bin/env python3
+'''Модуль, реализующий анализ живости переменных по графу потока управления
+каждой функции и две оптимизации на его основе:
+
++ удаление мертвых сохранений - инструкция `store` переменной, которая больше
+  не читается, заменяется инструкцией `pop` (значение со стека все равно нужно
+  снять), а оконный оптимизатор затем удаляет пару из вычисления значения и
+  `pop`;
++ уплотнение фрейма - переменные, времена жизни которых не пересекаются, получают
+  один и тот же идентификатор (слот фрейма).
+
+Переменная, живая на входе в функцию, может быть прочитана до первой записи и
+тогда полагается на инициализацию нулем нового фрейма. Такие переменные получают
+собственные слоты, которые не делятся ни с какими другими переменными.
+
+После уплотнения идентификаторы в `FnMeta` обновляются, неиспользуемые локальные
+переменные удаляются, а неиспользуемые параметры сохраняют прежние
+идентификаторы.
+'''
+from collections import Counter
+from typing import Iterable
+
+from .ir import Item, Label, Instr
+from .frontend import FnMeta
+from .dce import split_functions, basic_blocks, successors
+
+
+def block_liveness(blocks: list[list[Item]]) -> tuple[list[set[int]], list[set[int]]]:
+    '''Computes variables that are live at the beginning and at the end of
+    every basic block. Nothing is live after ret and stop.
+
+    :param blocks: basic blocks of function in program order
+    :type blocks: list[list[Item]]
+
+    :return: live variables at the beginning and at the end of every block
+    :rtype: (list[set[int]], list[set[int]])
+    '''
+    labels = { item.name: i for i, block in enumerate(blocks)
+               for item in block if isinstance(item, Label) }
+    edges = [ successors(blocks, i, labels) for i in range(len(blocks)) ]
+    uses = []
+    defs = []
+    for block in blocks:
+        used, defined = set(), set()
+        for item in block:
+            if not isinstance(item, Instr):
+                continue
+            if item.op == 'load' and item.arg not in defined:
+                used.add(item.arg)
+            elif item.op == 'store':
+                defined.add(item.arg)
+        uses.append(used)
+        defs.append(defined)
+
+    live_in = [ set() for _ in blocks ]
+    live_out = [ set() for _ in blocks ]
+    changed = True
+    while changed:
+        changed = False
+        for i in reversed(range(len(blocks))):
+            out = set()
+            for successor in edges[i]:
+                out |= live_in[successor]
+            live_out[i] = out
+            new_in = uses[i] | (out - defs[i])
+            if new_in != live_in[i]:
+                live_in[i] = new_in
+                changed = True
+    return live_in, live_out
+
+
+def _interference(blocks: list[list[Item]], live_out: list[set[int]],
+                  removed: Counter) -> tuple[list[list[Item]], dict[int, set[int]]]:
+    '''Replaces dead stores with pops and builds interference graph of
+    variables: two variables interfere if one is stored while the other is live.
+    '''
+    graph = {}
+    result = []
+    for block, live in zip(blocks, live_out):
+        live = set(live)
+        code = []
+        for item in reversed(block):
+            if isinstance(item, Instr) and item.op == 'store':
+                if item.arg not in live:
+                    removed['dead-store'] += 1
+                    code.append(Instr('pop'))
+                    continue
+                live.discard(item.arg)
+                graph.setdefault(item.arg, set()).update(live)
+                for variable in live:
+                    graph.setdefault(variable, set()).add(item.arg)
+            elif isinstance(item, Instr) and item.op == 'load':
+                live.add(item.arg)
+                graph.setdefault(item.arg, set())
+            code.append(item)
+        code.reverse()
+        result.append(code)
+    return result, graph
+
+
+def assign_slots(graph: dict[int, set[int]], order: list[int],
+                 pinned: set[int]) -> dict[int, int]:
+    '''Greedily colors interference graph: every variable gets the lowest slot
+    that is not used by interfering variables. Pinned variables get slots of
+    their own.
+
+    :param graph: interfering variables of every variable
+    :type graph: dict[int, set[int]]
+    :param order: variables in order of coloring
+    :type order: list[int]
+    :param pinned: variables that can not share slot with any other
+    :type pinned: set[int]
+
+    :return: slot of every variable
+    :rtype: dict[int, int]
+    '''
+    slots = {}
+    exclusive = set()
+    for variable in order:
+        if variable in pinned:
+            taken = exclusive | set(slots.values())
+        else:
+            taken = exclusive | { slots[other] for other in graph[variable]
+                                  if other in slots }
+        slot = 0
+        while slot in taken:
+            slot += 1
+        if variable in pinned:
+            exclusive.add(slot)
+        slots[variable] = slot
+    return slots
+
+
+def compact_function(body: list[Item], meta: FnMeta,
+                     removed: Counter) -> list[Item]:
+    '''Removes dead stores of function and reuses slots of its variables.
+
+    :param body: code of function starting with its label
+    :type body: list[Item]
+    :param meta: function's metadata, identifiers are updated
+    :type meta: class:`rustyc.frontend.FnMeta`
+    :param removed: counter of removed stores and slots
+    :type removed: class:`collections.Counter`
+
+    :return: code of function
+    :rtype: list[Item]
+    '''
+    blocks = basic_blocks(body)
+    live_in, live_out = block_liveness(blocks)
+    blocks, graph = _interference(blocks, live_out, removed)
+    code = [ item for block in blocks for item in block ]
+
+    order = list(dict.fromkeys(item.arg for item in code
+                               if isinstance(item, Instr)
+                               and item.op in ('load', 'store')))
+    pinned = live_in[0] if blocks else set()
+    slots = assign_slots(graph, order, pinned)
+
+    variables = { **meta.parameters, **meta.locals }
+    before = len({ variable.identifier for variable in variables.values() })
+    for name, variable in list(meta.locals.items()):
+        if variable.identifier not in slots:
+            del meta.locals[name]
+    for variable in { **meta.parameters, **meta.locals }.values():
+        variable.identifier = slots.get(variable.identifier, variable.identifier)
+    removed['slots'] += before - len(set(slots.values()))
+
+    return [ Instr(item.op, slots[item.arg])
+             if isinstance(item, Instr) and item.op in ('load', 'store')
+             else item for item in code ]
+
+
+def compact(items: Iterable[Item], functions: dict[str, FnMeta]) -> tuple[list[Item], Counter]:
+    '''Removes dead stores and compacts frames of all functions.
+
+    :param items: labels and instructions
+    :type items: Iterable[Item]
+    :param functions: metadata of all functions
+    :type functions: dict[str, class:`rustyc.frontend.FnMeta`]
+
+    :return: program, number of removed stores and frame slots
+    :rtype: (list[Item], class:`collections.Counter`)
+    '''
+    items = [ item for item in items if isinstance(item, (Label, Instr)) ]
+    prologue, bodies = split_functions(items, functions)
+    removed = Counter({ 'dead-store': 0, 'slots': 0 })
+    program = list(prologue)
+    for name, body in bodies.items():
+        program.extend(compact_function(body, functions[name], removed))
+    return program, removed
@@ -0,0 +1,403 @@
+#!/usr/bin/env python3
+'''Модуль, реализующий обратное преобразование функции из формы SSA (см.
+`rustyc.ssa`) в стековый код виртуальной машины.
+
+Значения вычисляются в том же порядке, в котором они записаны в блоках, поэтому
+порядок вызовов функций и исключений виртуальной машины сохраняется. Чтобы
+уменьшить число инструкций `load` и `store`, значение остается на стеке
+операндов, если оно используется ровно один раз в том же блоке и к моменту
+использования лежит на вершине стека в нужном порядке. Операнды, которые лежат
+на стеке под такими значениями, загружаются заранее - перед вычислением первого
+из них. Остальные значения
+сохраняются в собственные переменные фрейма, константы не сохраняются, а
+вычисляются заново инструкцией `push` при каждом использовании. Для этого
+блоки символически исполняются над стеком значений: значение, которое нарушает
+порядок стека, переводится в переменную, и исполнение блока повторяется.
+
+Phi-функции заменяются копированиями в конце предшественников: сначала на стек
+кладутся все копируемые значения, затем они снимаются инструкциями `store` в
+обратном порядке - так копирования выполняются одновременно. Дуги из блоков с
+условным переходом в блоки с phi-функциями предварительно расщепляются.
+Phi-функция, которая используется один раз в своем блоке, передается через стек
+операндов, как значение условного выражения во фронтенде. У коммутативных
+операций и сравнений операнды переставляются, если так второй операнд может
+остаться на стеке.
+
+Параметры функции сохраняются в переменные с их исходными идентификаторами,
+остальным значениям выдаются новые идентификаторы, которые затем может уплотнить
+`rustyc.liveness`. Phi-функция и ее аргументы объединяются в группу с общей
+переменной, если ни одно значение группы не живо в точке определения другого,
+и копирования внутри группы не нужны. Так увеличение счетчика цикла остается
+одной инструкцией `store`.
+'''
+from typing import Iterable, Optional
+
+from .ir import Item, Label, Instr
+from .frontend import FnMeta, VariableMeta
+from .cse import COMMUTATIVE
+from .ssa import Value, Block, Function, DominatorTree, live_in
+
+
+# operations that give the same result with swapped operands
+MIRRORED = { **{ op: op for op in COMMUTATIVE },
+             'lt': 'gt', 'gt': 'lt', 'le': 'ge', 'ge': 'le' }
+
+
+def split_critical_edges(function: Function) -> list[Block]:
+    '''Inserts empty blocks on edges from blocks with several successors to
+    blocks with phi-functions, so that copies of phi-functions' operands have
+    a place.
+
+    :param function: function in SSA form
+    :type function: class:`rustyc.ssa.Function`
+
+    :return: inserted blocks
+    :rtype: list[class:`rustyc.ssa.Block`]
+    '''
+    inserted = []
+    for block in function.blocks:
+        if len(block.successors) < 2:
+            continue
+        for i, successor in enumerate(block.successors):
+            if not successor.phis:
+                continue
+            middle = Block()
+            middle.terminator = Value('jmp')
+            middle.successors = [successor]
+            middle.predecessors = [block]
+            block.successors[i] = middle
+            successor.predecessors[successor.predecessors.index(block)] = middle
+            inserted.append(middle)
+    function.blocks.extend(inserted)
+    return inserted
+
+
+def _copies(block: Block) -> list[tuple[Value, Value]]:
+    '''Phi-functions of the only successor with their operands from block,
+    copies of phi-function to itself are skipped.
+    '''
+    if len(block.successors) != 1:
+        return []
+    successor = block.successors[0]
+    position = successor.predecessors.index(block)
+    return [ (phi, phi.args[position]) for phi in successor.phis
+             if phi.args[position] is not phi ]
+
+
+def _prepushed(function: Function, block: Block) -> list[Value]:
+    if block is function.entry:
+        return function.parameters
+    return block.phis
+
+
+def _consumers(block: Block, group: dict[Value, Value] = {}) -> list[tuple[Optional[Value], list[Value]]]:
+    '''Instructions of block with their operands, the last one is the end of
+    block with operands of terminator and copies. Copies between values of the
+    same group are skipped.
+    '''
+    consumers = [ (value, value.args) for value in block.instructions ]
+    sources = [ source for phi, source in _copies(block)
+                if group.get(phi, phi) is not group.get(source, source) ]
+    consumers.append((None, block.terminator.args + sources))
+    return consumers
+
+
+def _kept_prefix(values: list[Value], kept: set[Value]):
+    # values below the first stored one cannot stay on the stack
+    for i, value in enumerate(values):
+        if value not in kept:
+            kept.difference_update(values[i:])
+            return
+
+
+def _split(operands: list[Value], kept: set[Value]) -> tuple[int, int]:
+    '''Bounds of kept operands, if they are not contiguous then the ones after
+    the gap are not kept anymore.
+    '''
+    first = next((i for i, operand in enumerate(operands) if operand in kept),
+                 len(operands))
+    last = first
+    while last < len(operands) and operands[last] in kept:
+        last += 1
+    kept.difference_update(operands[last:])
+    return first, last
+
+
+def schedule(function: Function, block: Block, kept: set[Value],
+             group: dict[Value, Value] = {}) -> Optional[dict[int, list[Value]]]:
+    '''Simulates the operands stack of block. Operands that go before kept
+    ones are loaded early, right before the computation of the first kept
+    operand starts. If a kept value breaks order of the stack, it is removed
+    from the kept ones.
+
+    :param function: function in SSA form
+    :type function: class:`rustyc.ssa.Function`
+    :param block: simulated block
+    :type block: class:`rustyc.ssa.Block`
+    :param kept: values that are not stored to variables, it is updated
+    :type kept: set[class:`rustyc.ssa.Value`]
+    :param group: representatives of values sharing variables
+    :type group: dict[class:`rustyc.ssa.Value`, class:`rustyc.ssa.Value`]
+
+    :return: early loaded values by position of instruction or None if kept
+    values were changed
+    :rtype: Optional[dict[int, list[class:`rustyc.ssa.Value`]]]
+    '''
+    before = len(kept)
+    _kept_prefix(_prepushed(function, block), kept)
+    stack = [ value for value in _prepushed(function, block) if value in kept ]
+    positions = { value: i for i, value in enumerate(block.instructions) }
+    starts = {}
+    early = {}
+    for index, (value, operands) in enumerate(_consumers(block, group)):
+        first, last = _split(operands, kept)
+        if len(kept) != before:
+            return None
+        suffix = operands[first:last]
+        if suffix and stack[len(stack) - len(suffix):] != suffix:
+            if stack and stack[-1] not in suffix:
+                kept.discard(stack[-1])
+            else:
+                kept.difference_update(suffix)
+            return None
+        start = starts.get(suffix[0]) if suffix else index
+        if suffix and first:
+            if start is None or any(positions.get(operand, -1) >= start
+                                    for operand in operands[:first]):
+                kept.difference_update(suffix)
+                return None
+            early[start] = operands[:first] + early.get(start, [])
+        del stack[len(stack) - len(suffix):]
+        if value in kept:
+            stack.append(value)
+            starts[value] = start
+    if stack:
+        kept.difference_update(stack)
+        return None
+    return early
+
+
+def stack_values(function: Function, inserted: Iterable[Block] = ()) -> set[Value]:
+    '''Finds values that stay on the operands stack from definition to the
+    only use. Operands of commutative operations and comparisons are swapped
+    if only the second one may stay on the stack.
+
+    :param function: function in SSA form without critical edges to blocks
+    with phi-functions
+    :type function: class:`rustyc.ssa.Function`
+    :param inserted: blocks inserted on critical edges, phi-functions of their
+    successors are stored to variables, so that the blocks stay empty
+    :type inserted: Iterable[class:`rustyc.ssa.Block`]
+
+    :return: values that are not stored to variables
+    :rtype: set[class:`rustyc.ssa.Value`]
+    '''
+    uses = function.uses()
+    defined = {}
+    used = {}
+    for block in function.blocks:
+        for value in [*_prepushed(function, block), *block.instructions]:
+            defined[value] = block
+        for _, operands in _consumers(block):
+            for operand in operands:
+                used[operand] = block
+    kept = { value for value, block in defined.items()
+             if value.results == 1 and uses[value] == 1 and used.get(value) is block }
+    for block in inserted:
+        kept.difference_update(block.successors[0].phis)
+    for block in function.blocks:
+        block.phis.sort(key=lambda phi: phi not in kept)
+        for value in block.instructions:
+            if value.op in MIRRORED and value.args[1] in kept \
+                    and value.args[0] not in kept and value.args[1].op != 'const':
+                value.op = MIRRORED[value.op]
+                value.args = value.args[::-1]
+
+    for block in function.blocks:
+        while schedule(function, block, kept) is None:
+            pass
+    return kept
+
+
+def _live_on_edge(live: dict[Block, set[Value]], block: Block,
+                  successor: Block) -> set[Value]:
+    position = successor.predecessors.index(block)
+    return live[successor] | { phi.args[position] for phi in successor.phis }
+
+
+def coalesce(function: Function, kept: set[Value]) -> dict[Value, Value]:
+    '''Groups phi-functions with their operands, so that values of a group
+    share the same variable and copies between them are not needed. Values do
+    not join the group if one of them is live at the definition of another.
+
+    :param function: function in SSA form
+    :type function: class:`rustyc.ssa.Function`
+    :param kept: values that are not stored to variables
+    :type kept: set[class:`rustyc.ssa.Value`]
+
+    :return: representatives of grouped values, parameter of function
+    represents its group
+    :rtype: dict[class:`rustyc.ssa.Value`, class:`rustyc.ssa.Value`]
+    '''
+    tree = DominatorTree(function)
+    live = live_in(function)
+    points = {}
+    after = {}
+    for block in function.blocks:
+        current = set()
+        for successor in block.successors:
+            current |= _live_on_edge(live, block, successor)
+        values = [*block.instructions, block.terminator]
+        for i in reversed(range(len(values))):
+            after[values[i]] = set(current)
+            points[values[i]] = (block, i)
+            current.discard(values[i])
+            current.update(values[i].args)
+        for value in _prepushed(function, block):
+            after[value] = current
+            points[value] = (block, -1)
+
+    def interfere(a: Value, b: Value) -> bool:
+        if points[a] == points[b]:
+            return True
+        (block_a, i), (block_b, j) = points[a], points[b]
+        if block_a is block_b:
+            return a in after[b] if i < j else b in after[a]
+        if tree.dominates(block_a, block_b):
+            return a in after[b]
+        if tree.dominates(block_b, block_a):
+            return b in after[a]
+        return False
+
+    group = {}
+    members = {}
+    for block in tree.order:
+        for phi in block.phis:
+            if phi in kept:
+                continue
+            for arg in phi.args:
+                a, b = group.get(phi, phi), group.get(arg, arg)
+                if arg in kept or arg.op == 'const' or a is b:
+                    continue
+                merged = members.get(a, [a]) + members.get(b, [b])
+                parameters = [ value for value in merged if value.op == 'param' ]
+                if len(parameters) > 1 \
+                        or any(interfere(x, y) for x in members.get(a, [a])
+                               for y in members.get(b, [b])):
+                    continue
+                representative = parameters[0] if parameters else a
+                members.pop(a, None)
+                members.pop(b, None)
+                members[representative] = merged
+                for value in merged:
+                    group[value] = representative
+    return group
+
+
+def lower_function(function: Function, meta: FnMeta) -> list[Item]:
+    '''Translates function from SSA form to stack code. Local variables of
+    function's metadata are replaced with the new ones.
+
+    :param function: function in SSA form, critical edges are split
+    :type function: class:`rustyc.ssa.Function`
+    :param meta: function's metadata
+    :type meta: class:`rustyc.frontend.FnMeta`
+
+    :return: code of function that starts with its label
+    :rtype: list[Item]
+    '''
+    kept = stack_values(function, split_critical_edges(function))
+    group = coalesce(function, kept)
+    uses = function.uses()
+
+    identifiers = sorted(variable.identifier for variable in meta.parameters.values())
+    slots = dict(zip(function.parameters, identifiers))
+    locals_ = {}
+
+    def slot(value: Value) -> int:
+        value = group.get(value, value)
+        if value not in slots:
+            identifier = max([*identifiers, *slots.values()], default=-1) + 1
+            slots[value] = identifier
+            locals_[f'.ssa{identifier}'] = VariableMeta(identifier, True)
+        return slots[value]
+
+    def loads(values: list[Value]) -> list[Instr]:
+        return [ Instr('push', value.arg) if value.op == 'const'
+                 else Instr('load', slot(value)) for value in values ]
+
+    def operands(values: list[Value]) -> list[Instr]:
+        # operands before the kept ones are loaded early
+        kept_positions = [ i for i, value in enumerate(values) if value in kept ]
+        return loads(values[kept_positions[-1] + 1:] if kept_positions else values)
+
+    bodies = []
+    for block in function.blocks:
+        early = schedule(function, block, kept, group)
+        code = []
+        if block is function.entry:
+            for parameter in reversed(function.parameters):
+                if parameter not in kept:
+                    code.append(Instr('store', slot(parameter))
+                                if uses[parameter] else Instr('pop'))
+        for i, value in enumerate(block.instructions):
+            code.extend(loads(early.get(i, [])))
+            code.extend(operands(value.args))
+            if value.op == 'const':
+                if value in kept:
+                    code.append(Instr('push', value.arg))
+                continue
+            code.append(Instr(value.op, value.arg))
+            if value.results and value not in kept:
+                code.append(Instr('store', slot(value)) if uses[value]
+                            else Instr('pop'))
+        copies = [ (phi, source) for phi, source in _copies(block)
+                   if group.get(phi, phi) is not group.get(source, source) ]
+        code.extend(loads(early.get(len(block.instructions), [])))
+        code.extend(operands(block.terminator.args
+                             + [ source for _, source in copies ]))
+        code.extend(Instr('store', slot(phi)) for phi, _ in reversed(copies)
+                    if phi not in kept)
+        bodies.append(code)
+
+    reserved = { block.label for block in function.blocks }
+    names = {}
+    def target(block: Block) -> str:
+        if block not in names:
+            name = block.label
+            counter = len(names)
+            while name is None:
+                candidate = f'.{counter}_{function.name}_ssa_utlbl'
+                counter += 1
+                if candidate not in reserved:
+                    name = candidate
+            reserved.add(name)
+            names[block] = name
+        return names[block]
+
+    order = function.blocks
+    for position, (block, code) in enumerate(zip(order, bodies)):
+        following = order[position + 1] if position + 1 < len(order) else None
+        terminator = block.terminator
+        if terminator.op == 'jmp':
+            if block.successors[0] is not following:
+                code.append(Instr('jmp', target(block.successors[0])))
+        elif terminator.op == 'br':
+            taken, fallen = block.successors
+            if fallen is following:
+                code.append(Instr('jift', target(taken)))
+            elif taken is following:
+                code.append(Instr('jiff', target(fallen)))
+            else:
+                code.extend([Instr('jift', target(taken)),
+                             Instr('jmp', target(fallen))])
+        else:
+            code.append(Instr(terminator.op, terminator.arg))
+
+    result = [Label(function.name)]
+    for block, code in zip(order, bodies):
+        if block in names and block is not function.entry:
+            result.append(Label(names[block]))
+        result.extend(code)
+    meta.locals = locals_
+    return result
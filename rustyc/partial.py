@@ -0,0 +1,174 @@
+#!/usr/bin/env python3
+'''Модуль, реализующий частичное вычисление (partial evaluation) программы:
+вызовы функций с константными аргументами выполняются во время компиляции на
+виртуальной машине `rusty` и заменяются инструкцией `push` результата.
+
+Функции языка не имеют побочных эффектов: результат зависит только от
+аргументов, потому что у виртуальной машины нет глобальной памяти и
+ввода-вывода, а каждый вызов получает новый фрейм. Поэтому вызов можно
+вычислить заранее, если вычисление:
+
++ завершается, не превысив заданного числа инструкций (бюджета);
++ не приводит к исключению виртуальной машины (например, делению на ноль);
++ оставляет на стеке столько целых значений, сколько ожидает вызывающая
+  функция - значение с плавающей точкой после инструкции div не сворачивается.
+
+Вызов функции без результата, вычисление которого завершается, удаляется.
+Вызовы ищутся в форме SSA (см. `rustyc.ssa`), поэтому аргументами могут быть
+переменные с известными значениями и результаты других свернутых вызовов, а
+после замены вызова константой сворачиваются зависящие от нее выражения и
+переходы. Функции, в которых ничего не вычислено, остаются без изменений.
+Функции, которые могут вызвать импортированную функцию объектного файла (см.
+`rustyc.linker`), не вычисляются.
+'''
+from collections import Counter
+from typing import Iterable, Optional
+
+import numpy as np
+
+from rusty import isa, traps
+from rusty.vm import VM
+
+from .ir import Item, Label, Instr
+from .frontend import FnMeta
+from .backend import assemble
+from .dce import split_functions, call_graph, reachable_functions
+from .ssa import Function
+from .ssaopt import SsaPass, fold_constants, eliminate_dead_values, optimize
+
+
+# default limit of instructions executed by evaluation of a single call
+DEFAULT_BUDGET = 100000
+
+
+class Evaluator:
+    '''Executes functions of the program on the virtual machine and remembers
+    results of calls.
+    '''
+    def __init__(self, items: Iterable[Item], functions: dict[str, FnMeta],
+                 budget: int = DEFAULT_BUDGET):
+        '''Constructor
+
+        :param items: labels and instructions of the whole program
+        :type items: Iterable[Item]
+        :param functions: metadata of all functions
+        :type functions: dict[str, class:`rustyc.frontend.FnMeta`]
+        :param budget: limit of instructions executed by a single call
+        :type budget: int, default 100000
+        '''
+        items = [ item for item in items if isinstance(item, (Label, Instr)) ]
+        graph = call_graph(split_functions(items, functions)[1])
+        imported = set().union(*graph.values()) - set(functions)
+        importers = { name for name, callees in graph.items() if callees & imported }
+        self.opaque = { name for name in functions
+                        if reachable_functions(graph, [name]) & importers }
+        for name in functions:
+            # entry points that call the function and stop the machine
+            items.extend([Label(self._entry(name)), Instr('call', name),
+                          Instr('stop')])
+        for name in imported:
+            items.extend([Label(name), Instr('stop')]) # never executed
+        self.code, self.labels = assemble(items)
+        self.budget = budget
+        self.results = {}
+
+    @staticmethod
+    def _entry(name: str) -> str:
+        return f'.{name}_eval_utlbl'
+
+    def call(self, name: str, args: Iterable[int]) -> Optional[list[int]]:
+        '''Evaluates call of the function.
+
+        :param self: evaluator
+        :type self: class:`rustyc.partial.Evaluator`
+        :param name: name of the function
+        :type name: str
+        :param args: arguments in order of parameters
+        :type args: Iterable[int]
+
+        :return: values left on the stack by the function or None if the call
+        does not finish within the budget, traps, gives non-integer values or
+        may call imported function
+        :rtype: Optional[list[int]]
+        '''
+        if name in self.opaque:
+            return None
+        key = (name, tuple(args))
+        if key not in self.results:
+            self.results[key] = self._run(*key)
+        return self.results[key]
+
+    def _run(self, name: str, args: tuple[int, ...]) -> Optional[list[int]]:
+        vm = VM()
+        vm.load_program(self.code, self.labels[self._entry(name)])
+        vm.ctx.operands_stack = [ isa.force_uint64(arg) for arg in args ]
+        try:
+            with np.errstate(all='ignore'):
+                for _ in range(self.budget):
+                    if vm.is_halted:
+                        break
+                    vm.next()
+        except (traps.Trap, TypeError):
+            return None
+        stack = vm.ctx.operands_stack
+        if not vm.is_halted \
+                or not all(isinstance(value, np.integer) for value in stack):
+            return None
+        return [ int(value) for value in stack ]
+
+
+def evaluation_pass(evaluator: Evaluator) -> SsaPass:
+    '''Builds SSA pass that replaces calls with constant arguments by their
+    results and folds constants depending on them.
+
+    :param evaluator: evaluator of the program's functions
+    :type evaluator: class:`rustyc.partial.Evaluator`
+
+    :return: optimization pass
+    :rtype: class:`rustyc.ssaopt.SsaPass`
+    '''
+    def run(function: Function, stats: Counter):
+        evaluated = stats['partial-evaluation']
+        changed = True
+        while changed:
+            fold_constants(function, stats)
+            changed = False
+            for block in function.blocks:
+                instructions = []
+                for value in block.instructions:
+                    if value.op == 'call' and value.results <= 1 \
+                            and all(arg.op == 'const' for arg in value.args):
+                        result = evaluator.call(value.arg,
+                                                [ arg.arg for arg in value.args ])
+                        if result is not None and len(result) == value.results:
+                            stats['partial-evaluation'] += 1
+                            changed = True
+                            if not result:
+                                continue
+                            value.op, value.args, value.arg = 'const', [], result[0]
+                    instructions.append(value)
+                block.instructions = instructions
+        if stats['partial-evaluation'] != evaluated:
+            eliminate_dead_values(function, stats)
+
+    return SsaPass('partial-evaluation', run)
+
+
+def evaluate(items: Iterable[Item], functions: dict[str, FnMeta],
+             budget: int = DEFAULT_BUDGET) -> tuple[list[Item], Counter]:
+    '''Evaluates calls with constant arguments in all functions.
+
+    :param items: labels and instructions
+    :type items: Iterable[Item]
+    :param functions: metadata of all functions
+    :type functions: dict[str, class:`rustyc.frontend.FnMeta`]
+    :param budget: limit of instructions executed by a single call
+    :type budget: int, default 100000
+
+    :return: program and number of evaluated calls and folded constants
+    :rtype: (list[Item], class:`collections.Counter`)
+    '''
+    items = [ item for item in items if isinstance(item, (Label, Instr)) ]
+    evaluator = Evaluator(items, functions, budget)
+    return optimize(items, functions, [evaluation_pass(evaluator)],
+                    only_changed=True)
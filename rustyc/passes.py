@@ -0,0 +1,153 @@
+#!/usr/bin/env python3
+'''Модуль, реализующий менеджер проходов компилятора. Компиляция - это
+последовательность проходов `Pass`: фронтенд, проходы оптимизации, разрешение
+меток и вывод программы. Каждый проход получает общее состояние `Compilation`,
+изменяет его и может вернуть счетчик удаленных инструкций по правилам.
+
+Менеджер `PassManager` пропускает проходы, которые требуют более высокого
+уровня оптимизации или отключены по имени (например, чтобы найти проход,
+который портит программу, отключая их по одному), а для выполненных проходов
+записывает время работы и число инструкций программы до и после прохода.
+'''
+import time
+from collections import Counter
+from typing import Any, Callable, Iterable, NamedTuple, Optional, Union
+
+from rusty.container import Container
+
+from .ir import Item, Instr
+from .frontend import FnMeta
+from .pgo import Profile
+
+
+class Compilation:
+    '''State of compilation shared by passes: options, program in the current
+    form and statistics of optimizations.
+    '''
+    def __init__(self, options: Any):
+        '''Constructor
+
+        :param options: parsed command line arguments
+        :type options: class:`argparse.Namespace`
+        '''
+        self.options = options
+        self.program: list[Item] = []
+        self.functions: dict[str, FnMeta] = {}
+        # program after label resolution: text or bytecode container
+        self.resolved: Optional[Union[str, Container]] = None
+        # final output of compiler
+        self.output: Optional[Union[str, bytes]] = None
+        self.removed: dict[str, Counter] = {}
+        # execution profile that guides optimizations
+        self.profile: Optional[Profile] = None
+
+    def instructions(self) -> int:
+        '''Counts instructions of the program in its latest form.
+
+        :param self: compilation
+        :type self: class:`rustyc.passes.Compilation`
+
+        :return: number of instructions
+        :rtype: int
+        '''
+        if isinstance(self.resolved, Container):
+            return len(self.resolved.code)
+        if isinstance(self.resolved, str):
+            return sum(1 for line in self.resolved.split('\n')
+                       if line.strip() and not line.rstrip().endswith(':'))
+        return sum(1 for item in self.program if isinstance(item, Instr))
+
+
+class Pass(NamedTuple):
+    '''Stage of compilation. Optimization passes run at the given level and
+    above and may be disabled, the other passes always run.
+    '''
+    name: str
+    run: Callable[[Compilation], Optional[Counter]]
+    level: int = 0
+    optimization: bool = True
+
+
+class Timing(NamedTuple):
+    '''Wall time of the pass and number of instructions before and after it.
+    '''
+    name: str
+    seconds: float
+    before: int
+    after: int
+
+
+class PassManager:
+    '''Runs passes in order and measures them.
+    '''
+    def __init__(self, passes: Iterable[Pass], level: int = 0,
+                 disabled: Iterable[str] = ()):
+        '''Constructor
+
+        :param passes: passes in order of execution
+        :type passes: Iterable[class:`rustyc.passes.Pass`]
+        :param level: optimization level
+        :type level: int, default 0
+        :param disabled: names of optimization passes to skip
+        :type disabled: Iterable[str]
+        '''
+        self.passes = list(passes)
+        self.level = level
+        self.disabled = set(disabled)
+        self.timings: list[Timing] = []
+
+    def enabled(self, stage: Pass) -> bool:
+        '''Checks if the pass should run.
+
+        :param self: pass manager
+        :type self: class:`rustyc.passes.PassManager`
+        :param stage: pass
+        :type stage: class:`rustyc.passes.Pass`
+
+        :return: True if the pass runs
+        :rtype: bool
+        '''
+        if not stage.optimization:
+            return True
+        return stage.level <= self.level and stage.name not in self.disabled
+
+    def run(self, compilation: Compilation) -> Compilation:
+        '''Runs enabled passes over compilation. Counters of removed
+        instructions returned by passes with the same name are summed up.
+
+        :param self: pass manager
+        :type self: class:`rustyc.passes.PassManager`
+        :param compilation: state of compilation
+        :type compilation: class:`rustyc.passes.Compilation`
+
+        :return: the same compilation
+        :rtype: class:`rustyc.passes.Compilation`
+        '''
+        for stage in self.passes:
+            if not self.enabled(stage):
+                continue
+            before = compilation.instructions()
+            start = time.perf_counter()
+            removed = stage.run(compilation)
+            seconds = time.perf_counter() - start
+            self.timings.append(Timing(stage.name, seconds, before,
+                                       compilation.instructions()))
+            if removed is not None:
+                compilation.removed.setdefault(stage.name, Counter()).update(removed)
+        return compilation
+
+    def report(self) -> list[str]:
+        '''Formats timings of passes and the total time.
+
+        :param self: pass manager
+        :type self: class:`rustyc.passes.PassManager`
+
+        :return: lines of report
+        :rtype: list[str]
+        '''
+        lines = [ f'{timing.name}: {timing.seconds * 1000:.3f} ms, '
+                  f'{timing.before} -> {timing.after} instructions'
+                  for timing in self.timings ]
+        total = sum(timing.seconds for timing in self.timings)
+        lines.append(f'total: {total * 1000:.3f} ms')
+        return lines
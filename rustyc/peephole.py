@@ -0,0 +1,331 @@
+#!/usr/bin/env python3
+'''Модуль, реализующий оконный (peephole) оптимизатор программы, которую строит
+фронтенд компилятора. Оптимизатор работает между фронтендом и бэкендом над
+последовательностью меток и инструкций (см. `rustyc.ir`).
+
+Правила оптимизации собраны в таблицу `RULES`. Каждое правило сопоставляет
+образцу хвост уже обработанной части программы (скользящее окно из нескольких
+элементов) и заменяет его более короткой последовательностью. После замены
+правила снова применяются к новому хвосту. Программа обрабатывается проходами до
+тех пор, пока хотя бы одно правило срабатывает - удаление переходов может
+сделать метки неиспользуемыми, а код за ними недостижимым.
+
+Кроме удаления инструкций правила понижают стоимость операций (strength
+reduction): умножение на степень двойки заменяется сдвигом, остаток от деления на
+степень двойки - побитовым И, а прибавление и вычитание единицы - инструкциями
+inc и dec. Деление на степень двойки не заменяется сдвигом, так как инструкция
+div виртуальной машины возвращает число с плавающей точкой. По той же причине
+сдвиг и побитовое И, которые не применимы к таким числам, заменяют умножение и
+остаток, только если операнд заведомо целый: в программе нет инструкций div и
+вызовов неопределенных в ней (импортированных) функций, либо операнд вычисляет
+предыдущая инструкция с целым результатом (см. `INTEGER_RESULTS`).
+
+Вызов функции, за которым сразу следует возврат, заменяется хвостовым вызовом
+tcall: вызываемая функция переиспользует фрейм вызывающей и возвращается прямо в
+точку ее вызова, поэтому хвостовая рекурсия исполняется в постоянной памяти.
+
+Например:
+```
+    lt
+    jift .0_then_utlbl
+    jmp .1_fi_utlbl
+.0_then_utlbl:
+```
+становится
+```
+    ge
+    jift .1_fi_utlbl
+```
+'''
+from collections import Counter
+from typing import Callable, Iterable, NamedTuple, Optional
+
+from .ir import Item, Label, Instr, LABEL_OPERANDS, TERMINATORS
+
+# comparison and comparison that gives the opposite result
+INVERSE_COMPARISONS = {
+    'eq': 'neq', 'neq': 'eq',
+    'lt': 'ge', 'ge': 'lt',
+    'gt': 'le', 'le': 'gt',
+}
+
+# instructions that only push a value onto the operands stack
+PURE_PUSHES = ('push', 'load', 'dup')
+
+# instructions whose result is an integer even if operands come from div: they
+# either compare or trap on floating point operands
+INTEGER_RESULTS = ('and', 'or', 'xor', 'not', 'shl', 'shr',
+                   'eq', 'neq', 'lt', 'le', 'gt', 'ge')
+
+
+def _is(item: Item, *ops: str) -> bool:
+    return isinstance(item, Instr) and item.op in ops
+
+
+def _is_int_push(item: Item) -> bool:
+    return _is(item, 'push') and isinstance(item.arg, int)
+
+
+class Rule(NamedTuple):
+    '''Rewrite rule. Rewrite function receives the last `size` items of the
+    program and labels' references counter. It returns replacement of those
+    items or None if the rule does not match.
+    '''
+    name: str
+    size: int
+    rewrite: Callable[[list[Item], Counter], Optional[list[Item]]]
+
+
+def _nop(window: list[Item], refs: Counter) -> Optional[list[Item]]:
+    # nop
+    if _is(window[0], 'nop'):
+        return []
+    return None
+
+
+def _unreachable(window: list[Item], refs: Counter) -> Optional[list[Item]]:
+    # jmp/ret/stop; <instruction> - only label can be reached after terminator
+    terminator, instruction = window
+    if _is(terminator, *TERMINATORS) and isinstance(instruction, Instr):
+        return [terminator]
+    return None
+
+
+def _dead_label(window: list[Item], refs: Counter) -> Optional[list[Item]]:
+    # <label> that is referred by nothing
+    label = window[0]
+    if isinstance(label, Label) and refs[label.name] == 0:
+        return []
+    return None
+
+
+def _jump_to_next(window: list[Item], refs: Counter) -> Optional[list[Item]]:
+    # jmp L; L: or jift L; L: or jiff L; L:
+    jump, label = window
+    if not (_is(jump, 'jmp', 'jift', 'jiff') and isinstance(label, Label)) \
+            or jump.arg != label.name:
+        return None
+    if jump.op == 'jmp':
+        return [label]
+    return [Instr('pop'), label]
+
+
+def _inverted_branch(window: list[Item], refs: Counter) -> Optional[list[Item]]:
+    # <cmp>; jift A; jmp B; A: -> <inverted cmp>; jift B; A:
+    compare, branch, jump, label = window
+    if _is(compare, *INVERSE_COMPARISONS) and _is(branch, 'jift') \
+            and _is(jump, 'jmp') and isinstance(label, Label) \
+            and branch.arg == label.name:
+        return [Instr(INVERSE_COMPARISONS[compare.op]),
+                Instr('jift', jump.arg), label]
+    return None
+
+
+def _constant_branch(window: list[Item], refs: Counter) -> Optional[list[Item]]:
+    # push C; jift L -> jmp L if C is not zero, nothing otherwise
+    # push C; jiff L -> jmp L if C is zero, nothing otherwise
+    push, branch = window
+    if not (_is_int_push(push) and _is(branch, 'jift', 'jiff')):
+        return None
+    if (push.arg != 0) == (branch.op == 'jift'):
+        return [Instr('jmp', branch.arg)]
+    return []
+
+
+def _redundant_test(window: list[Item], refs: Counter) -> Optional[list[Item]]:
+    # push 0; neq; jift L -> jift L
+    # push 0; eq; jift L -> jiff L (and vice versa)
+    push, compare, branch = window
+    if not (_is_int_push(push) and push.arg == 0 and _is(compare, 'neq', 'eq')
+            and _is(branch, 'jift', 'jiff')):
+        return None
+    if compare.op == 'neq':
+        return [branch]
+    return [Instr('jiff' if branch.op == 'jift' else 'jift', branch.arg)]
+
+
+def _store_load(window: list[Item], refs: Counter) -> Optional[list[Item]]:
+    # store N; load N -> dup; store N
+    store, load = window
+    if _is(store, 'store') and _is(load, 'load') and store.arg == load.arg:
+        return [Instr('dup'), store]
+    return None
+
+
+def _self_assignment(window: list[Item], refs: Counter) -> Optional[list[Item]]:
+    # load N; store N
+    load, store = window
+    if _is(load, 'load') and _is(store, 'store') and store.arg == load.arg:
+        return []
+    return None
+
+
+def _power_of_two(item: Item) -> Optional[int]:
+    # exponent k if item pushes 2^k
+    if _is_int_push(item) and item.arg > 0 and item.arg & (item.arg - 1) == 0:
+        return item.arg.bit_length() - 1
+    return None
+
+
+def _strength_reduction(window: list[Item], refs: Counter) -> Optional[list[Item]]:
+    # push 1; mul -> nothing, push 2^k; mul -> push k; shl
+    # push 2^k; mod -> push 2^k-1; and
+    push, operation = window
+    exponent = _power_of_two(push)
+    if exponent is None:
+        return None
+    if _is(operation, 'mul'):
+        if exponent == 0:
+            return []
+        return [Instr('push', exponent), Instr('shl')]
+    if _is(operation, 'mod') and exponent > 0:
+        return [Instr('push', push.arg - 1), Instr('and')]
+    return None
+
+
+def _checked_strength_reduction(window: list[Item], refs: Counter) -> Optional[list[Item]]:
+    # <integer result>; push 2^k; mul/mod -> <integer result>; strength reduction
+    producer, push, operation = window
+    if not (_is_int_push(producer) or _is(producer, *INTEGER_RESULTS)):
+        return None
+    replacement = _strength_reduction([push, operation], refs)
+    if replacement is None:
+        return None
+    return [producer] + replacement
+
+
+def _swapped_multiplication(window: list[Item], refs: Counter) -> Optional[list[Item]]:
+    # push 2^k; push/load; mul -> push/load; push 2^k; mul
+    push, operand, multiply = window
+    if _power_of_two(push) is not None and _is(operand, 'push', 'load') \
+            and _power_of_two(operand) is None and _is(multiply, 'mul'):
+        return [operand, push, multiply]
+    return None
+
+
+def _increment(window: list[Item], refs: Counter) -> Optional[list[Item]]:
+    # push 1; add -> inc, push 1; sub -> dec
+    push, operation = window
+    if _is_int_push(push) and push.arg == 1 and _is(operation, 'add', 'sub'):
+        return [Instr('inc' if operation.op == 'add' else 'dec')]
+    return None
+
+
+def _tail_call(window: list[Item], refs: Counter) -> Optional[list[Item]]:
+    # call F; ret -> tcall F
+    call, ret = window
+    if _is(call, 'call') and _is(ret, 'ret'):
+        return [Instr('tcall', call.arg)]
+    return None
+
+
+def _labelled_tail_call(window: list[Item], refs: Counter) -> Optional[list[Item]]:
+    # call F; L: ret -> tcall F; L: ret
+    call, label, ret = window
+    if _is(call, 'call') and isinstance(label, Label) and _is(ret, 'ret'):
+        return [Instr('tcall', call.arg), label, ret]
+    return None
+
+
+def _discarded_push(window: list[Item], refs: Counter) -> Optional[list[Item]]:
+    # push/load/dup; pop
+    push, pop = window
+    if _is(push, *PURE_PUSHES) and _is(pop, 'pop'):
+        return []
+    return None
+
+
+RULES = [
+    Rule('nop', 1, _nop),
+    Rule('dead-label', 1, _dead_label),
+    Rule('unreachable', 2, _unreachable),
+    Rule('jump-to-next', 2, _jump_to_next),
+    Rule('constant-branch', 2, _constant_branch),
+    Rule('store-load', 2, _store_load),
+    Rule('self-assignment', 2, _self_assignment),
+    Rule('discarded-push', 2, _discarded_push),
+    Rule('strength-reduction', 3, _checked_strength_reduction),
+    Rule('increment', 2, _increment),
+    Rule('tail-call', 2, _tail_call),
+    Rule('redundant-test', 3, _redundant_test),
+    Rule('swapped-multiplication', 3, _swapped_multiplication),
+    Rule('labelled-tail-call', 3, _labelled_tail_call),
+    Rule('inverted-branch', 4, _inverted_branch),
+]
+
+# rules for programs where every value is an integer
+INTEGER_RULES = [ Rule(rule.name, 2, _strength_reduction)
+                  if rule.name == 'strength-reduction' else rule for rule in RULES ]
+
+
+def _count_refs(items: Iterable[Item], refs: Counter, sign: int = 1):
+    for item in items:
+        if isinstance(item, Instr) and item.op in LABEL_OPERANDS:
+            refs[item.arg] += sign
+
+
+def _instructions(items: Iterable[Item]) -> int:
+    return sum(1 for item in items if isinstance(item, Instr))
+
+
+def _integer_program(items: list[Item]) -> bool:
+    # floating point values come from div, also imported function may return them
+    labels = { item.name for item in items if isinstance(item, Label) }
+    return not any(_is(item, 'div') or _is(item, 'call', 'tcall')
+                   and item.arg not in labels for item in items)
+
+
+def _run(items: list[Item], refs: Counter, removed: Counter,
+         rules: list[Rule]) -> tuple[list[Item], bool]:
+    '''Single pass of all rules over the program.
+    '''
+    out = []
+    changed = False
+    for item in items:
+        out.append(item)
+        matched = True
+        while matched and out:
+            matched = False
+            for rule in rules:
+                if len(out) < rule.size:
+                    continue
+                window = out[-rule.size:]
+                replacement = rule.rewrite(window, refs)
+                if replacement is None:
+                    continue
+                _count_refs(window, refs, -1)
+                _count_refs(replacement, refs)
+                removed[rule.name] += _instructions(window) \
+                    - _instructions(replacement)
+                del out[-rule.size:]
+                out.extend(replacement)
+                matched = changed = True
+                break
+    return out, changed
+
+
+def optimize(items: Iterable[Item], keep: Iterable[str] = ()) -> tuple[list[Item], Counter]:
+    '''Applies rewrite rules to the program until none of them matches. Blank
+    placeholders are dropped as they are not instructions.
+
+    :param items: labels and instructions after frontend-stage
+    :type items: Iterable[Item]
+    :param keep: labels that should be kept even if nothing refers them, e.g.
+    functions' labels
+    :type keep: Iterable[str]
+
+    :return: optimized program and number of removed instructions by every rule
+    :rtype: (list[Item], class:`collections.Counter`)
+    '''
+    items = [ item for item in items if isinstance(item, (Label, Instr)) ]
+    refs = Counter()
+    _count_refs(items, refs)
+    for label in keep:
+        refs[label] += 1
+
+    removed = Counter({ rule.name: 0 for rule in RULES })
+    rules = INTEGER_RULES if _integer_program(items) else RULES
+    changed = True
+    while changed:
+        items, changed = _run(items, refs, removed, rules)
+    return items, removed
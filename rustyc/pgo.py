@@ -0,0 +1,192 @@
+#!/usr/bin/env python3
+'''Модуль, реализующий оптимизацию по профилю (profile-guided optimization).
+
+Профиль записывает виртуальная машина командой `rusty run --profile OUT` -
+это JSON с таблицей функций (имя, адрес и размер), числом исполнений каждого
+адреса и числом переходов каждой инструкции jift и jiff. Профиль снимается с
+программы, собранной без оптимизаций (`rustyc -O0 --emit bin`): в ней каждая
+функция - в точности вывод фронтенда, поэтому адреса однозначно сопоставляются
+меткам фронтенда.
+
+Метки фронтенда нумеруются сквозным счетчиком, и их номера меняются при
+изменении предыдущих функций. Поэтому метка описывается ключом, который зависит
+только от кода самой функции: смыслом метки (then, fi, predlo_enter и т.п.) и ее
+порядковым номером среди меток функции с тем же смыслом. Функция, размер
+которой не совпадает с профилем или набор меток которой отличается, считается
+измененной, и ее профиль не используется, а профили неизмененных функций
+переживают перекомпиляцию.
+
+Метки, полученные копированием при встраивании и развертке циклов, получают
+счетчики исходных меток - суммарные по всем местам вызова. По профилю:
++ встраивание (`rustyc.inline`) пропускает ни разу не исполненные вызовы и
+  встраивает в горячие места вызова функции большего размера;
++ размещение блоков (`rustyc.layout`) делает следующим более горячий преемник
+  условного перехода;
++ развертка циклов (`rustyc.unroll`) пропускает циклы, которые в среднем
+  выполняются меньше, чем число копий тела.
+'''
+import re
+import json
+from typing import Iterable, Optional
+
+from .ir import Item, Label, Instr
+from .dce import split_functions
+
+
+# label generated by frontend: counter, meaning and suffix
+FRONTEND_LABEL = re.compile(r'\.\d+_(.+)_utlbl$')
+# prefix added to labels of copies by inliner and unroller
+COPY_PREFIX = re.compile(r'\.\d+_(?:inl\w*|unr)(?=\.)')
+# count is hot if it is at least this part of the hottest count
+HOT_FRACTION = 0.1
+
+
+def stable_keys(body: Iterable[Item]) -> dict[str, tuple[str, int]]:
+    '''Describes labels of function's frontend output by their meanings and
+    ordinals among labels with the same meaning.
+
+    :param body: code of function
+    :type body: Iterable[Item]
+
+    :return: keys of labels by their names
+    :rtype: dict[str, (str, int)]
+    '''
+    ordinals = {}
+    keys = {}
+    for item in body:
+        if not isinstance(item, Label):
+            continue
+        match = FRONTEND_LABEL.match(item.name)
+        if match is None:
+            continue
+        meaning = match.group(1)
+        keys[item.name] = (meaning, ordinals.get(meaning, 0))
+        ordinals[meaning] = ordinals.get(meaning, 0) + 1
+    return keys
+
+
+def label_offsets(body: Iterable[Item]) -> dict[str, int]:
+    '''Finds offsets of labels from the beginning of function.
+
+    :param body: code of function
+    :type body: Iterable[Item]
+
+    :return: number of instructions before every label by its name
+    :rtype: dict[str, int]
+    '''
+    offsets = {}
+    offset = 0
+    for item in body:
+        if isinstance(item, Label):
+            offsets[item.name] = offset
+        else:
+            offset += 1
+    return offsets
+
+
+class Profile:
+    '''Execution profile of the program: execution counts of labels and
+    functions' entries.
+    '''
+    def __init__(self, measured: dict):
+        '''Constructor
+
+        :param measured: profile recorded by VM
+        :type measured: dict
+        '''
+        self.measured = measured
+        self.counts: dict[str, int] = {}
+
+    @property
+    def hottest(self) -> int:
+        '''Maximum count of the program.
+        '''
+        return max(self.counts.values(), default=0)
+
+    def bind(self, reference: list[Item], program: list[Item],
+             functions: Iterable[str]) -> 'Profile':
+        '''Maps addresses of profiled program to labels of compiled one.
+
+        :param self: profile
+        :type self: class:`rustyc.pgo.Profile`
+        :param reference: frontend output without constant folding, it is
+        laid out like profiled program
+        :type reference: list[Item]
+        :param program: frontend output of compiled program
+        :type program: list[Item]
+        :param functions: names of functions
+        :type functions: Iterable[str]
+
+        :return: the same profile
+        :rtype: class:`rustyc.pgo.Profile`
+        '''
+        functions = list(functions)
+        table = { entry['name']: entry for entry in self.measured['functions'] }
+        hits = { int(address): count
+                 for address, count in self.measured['hits'].items() }
+        _, profiled = split_functions(reference, functions)
+        _, bodies = split_functions(program, functions)
+        for name, body in bodies.items():
+            entry, code = table.get(name), profiled.get(name)
+            if entry is None or code is None or entry['size'] != \
+                    sum(1 for item in code if isinstance(item, Instr)):
+                continue # function is changed or not profiled
+            keys, current = stable_keys(code), stable_keys(body)
+            if sorted(keys.values()) != sorted(current.values()):
+                continue
+            offsets = label_offsets(code)
+            measured = { key: hits.get(entry['address'] + offsets[label], 0)
+                         for label, key in keys.items() }
+            self.counts[name] = hits.get(entry['address'], 0)
+            for label, key in current.items():
+                self.counts[label] = measured[key]
+        return self
+
+    def count(self, label: str) -> Optional[int]:
+        '''Looks up for execution count of label, copies of labels made by
+        inliner and unroller share counts with the original ones.
+
+        :param self: profile
+        :type self: class:`rustyc.pgo.Profile`
+        :param label: name of label or function
+        :type label: str
+
+        :return: count or None if it is unknown
+        :rtype: Optional[int]
+        '''
+        while label not in self.counts:
+            original = COPY_PREFIX.sub('', label, count=1)
+            if original == label:
+                return None
+            label = original
+        return self.counts[label]
+
+    def is_hot(self, count: Optional[int]) -> bool:
+        '''Checks if count is close to the hottest one.
+
+        :param self: profile
+        :type self: class:`rustyc.pgo.Profile`
+        :param count: execution count
+        :type count: Optional[int]
+
+        :return: True if count is hot
+        :rtype: bool
+        '''
+        return bool(count) and count >= self.hottest * HOT_FRACTION
+
+
+def load(path: str) -> Profile:
+    '''Reads profile recorded by VM.
+
+    :param path: path to JSON file
+    :type path: str
+
+    :return: profile that is not bound to program yet
+    :rtype: class:`rustyc.pgo.Profile`
+    '''
+    with open(path, encoding='utf-8') as fp:
+        measured = json.load(fp)
+    if not isinstance(measured, dict) or not isinstance(measured.get('functions'), list) \
+            or not isinstance(measured.get('hits'), dict):
+        raise ValueError('not an execution profile')
+    return Profile(measured)
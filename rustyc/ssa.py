@@ -0,0 +1,750 @@
+#!/usr/bin/env python3
+'''Модуль, описывающий промежуточное представление среднего уровня (middle-end
+IR) - граф потока управления функции в форме статического единственного
+присваивания (SSA), - и анализы над ним: дерево доминаторов, вложенность
+циклов и живость значений.
+
+Функция состоит из базовых блоков `Block`. Каждый блок содержит phi-функции,
+инструкции и завершающую инструкцию, а также явные списки предшественников и
+преемников. Все они - значения `Value`, аргументами которых являются другие
+значения, а не переменные или стек:
+
++ `const` - целая константа (`arg`), `param` - аргумент функции с номером `arg`;
++ операции виртуальной машины (`add`, `lt`, `neg` и т.д.) и вызов `call` функции
+  `arg`, результат которого есть, если вызываемая функция оставляет значение на
+  стеке;
++ `phi` - аргументы соответствуют предшественникам блока по порядку;
++ завершающие инструкции: `jmp`, `br` (переход в первый преемник, если аргумент
+  не ноль, и во второй иначе), `ret`, `stop` и `tcall`, аргументами которых
+  является все содержимое стека операндов.
+
+Форма SSA строится из стекового кода символическим исполнением: переменные
+фрейма и ячейки стека, которые переходят между блоками, переименовываются по
+дереву доминаторов, phi-функции ставятся на итерированной границе доминирования
+(алгоритм Cytron et al.), затем удаляются тривиальные и неиспользуемые
+phi-функции. Загрузка переменной, которой ничего не присваивалось, дает ноль -
+так виртуальная машина инициализирует новый фрейм. Функция не переводится в SSA,
+если высота стека операндов при входе в блок зависит от пути (например,
+результат выражения-оператора остается на стеке в цикле) или вызывается
+функция, число результатов которой неизвестно.
+
+Обратное преобразование в стековый код находится в `rustyc.lowering`, а
+интерфейс проходов оптимизации - в `rustyc.ssaopt`.
+'''
+from collections import Counter
+from typing import Iterable, Iterator, Optional
+
+from .ir import Item, Instr
+from .frontend import FnMeta
+from .cse import BINARY, UNARY
+from .layout import build_blocks
+
+
+# instructions that end block and have no result
+TERMINATORS = ('jmp', 'br', 'ret', 'stop', 'tcall')
+
+# numbers of popped and pushed values of stack code instructions
+STACK_EFFECTS = {
+    'push': (0, 1), 'load': (0, 1), 'dup': (1, 2), 'swap': (2, 2),
+    'pop': (1, 0), 'store': (1, 0), 'jift': (1, 0), 'jiff': (1, 0),
+    'nop': (0, 0), 'jmp': (0, 0),
+    **{ op: (2, 1) for op in BINARY }, **{ op: (1, 1) for op in UNARY },
+}
+
+
+class Value:
+    '''Single assignment: operation, its operands and immediate argument.
+    Values are compared by identity.
+    '''
+    __slots__ = ('op', 'args', 'arg', 'results')
+
+    def __init__(self, op: str, args: Iterable['Value'] = (), arg=None,
+                 results: int = 1):
+        self.op = op
+        self.args = list(args)
+        self.arg = arg
+        self.results = 0 if op in TERMINATORS else results
+
+    def __repr__(self) -> str:
+        if self.arg is None:
+            return f'Value({self.op!r}, {len(self.args)} args)'
+        return f'Value({self.op!r}, {len(self.args)} args, {self.arg!r})'
+
+
+class Block:
+    '''Basic block of SSA form. Phi-functions are evaluated simultaneously at
+    the beginning of block, terminator passes control to successors.
+    '''
+    def __init__(self, label: Optional[str] = None):
+        self.label = label
+        self.phis = []
+        self.instructions = []
+        self.terminator = None
+        self.successors = []
+        self.predecessors = []
+
+    def values(self) -> Iterator[Value]:
+        '''All values of block in order of evaluation.
+        '''
+        yield from self.phis
+        yield from self.instructions
+        if self.terminator is not None:
+            yield self.terminator
+
+    def __repr__(self) -> str:
+        return f'Block({self.label!r})'
+
+
+class Function:
+    '''Function in SSA form. The first block is the entry, nothing jumps to
+    it. Parameters are the values passed through the operands stack, the last
+    one is the top.
+    '''
+    def __init__(self, name: str, parameters: list[Value], blocks: list[Block]):
+        self.name = name
+        self.parameters = parameters
+        self.blocks = blocks
+
+    @property
+    def entry(self) -> Block:
+        return self.blocks[0]
+
+    def values(self) -> Iterator[Value]:
+        '''All values of function.
+        '''
+        for block in self.blocks:
+            yield from block.values()
+
+    def uses(self) -> Counter:
+        '''Counts uses of every value as an operand.
+
+        :param self: function
+        :type self: class:`rustyc.ssa.Function`
+
+        :return: number of uses by value
+        :rtype: class:`collections.Counter`
+        '''
+        return Counter(arg for value in self.values() for arg in value.args)
+
+    def replace(self, mapping: dict[Value, Value]):
+        '''Replaces operands of all values, chains of replacements are
+        followed to the end.
+
+        :param self: function
+        :type self: class:`rustyc.ssa.Function`
+        :param mapping: replacement by replaced value
+        :type mapping: dict[class:`rustyc.ssa.Value`, class:`rustyc.ssa.Value`]
+        '''
+        def resolve(value: Value) -> Value:
+            while value in mapping:
+                value = mapping[value]
+            return value
+
+        for value in self.values():
+            value.args = [ resolve(arg) for arg in value.args ]
+
+    def remove_edge(self, block: Block, successor: Block):
+        '''Removes edge between blocks together with corresponding operands of
+        successor's phi-functions. Terminator is not changed.
+
+        :param self: function
+        :type self: class:`rustyc.ssa.Function`
+        :param block: source of the edge
+        :type block: class:`rustyc.ssa.Block`
+        :param successor: destination of the edge
+        :type successor: class:`rustyc.ssa.Block`
+        '''
+        block.successors.remove(successor)
+        index = successor.predecessors.index(block)
+        del successor.predecessors[index]
+        for phi in successor.phis:
+            del phi.args[index]
+
+    def remove_unreachable(self) -> int:
+        '''Removes blocks that are unreachable from the entry.
+
+        :param self: function
+        :type self: class:`rustyc.ssa.Function`
+
+        :return: number of removed blocks
+        :rtype: int
+        '''
+        reachable = set(self.reverse_postorder())
+        dead = [ block for block in self.blocks if block not in reachable ]
+        for block in dead:
+            for successor in list(block.successors):
+                self.remove_edge(block, successor)
+        self.blocks = [ block for block in self.blocks if block in reachable ]
+        return len(dead)
+
+    def remove_trivial_phis(self) -> int:
+        '''Removes phi-functions that merge a single value (and possibly
+        themselves) and phi-functions that are used only by phi-functions.
+
+        :param self: function
+        :type self: class:`rustyc.ssa.Function`
+
+        :return: number of removed phi-functions
+        :rtype: int
+        '''
+        removed = 0
+        changed = True
+        while changed:
+            changed = False
+            mapping = {}
+            for block in self.blocks:
+                for phi in block.phis:
+                    merged = { arg for arg in phi.args if arg is not phi }
+                    if len(merged) != 1:
+                        continue
+                    value = merged.pop()
+                    while value in mapping:
+                        value = mapping[value]
+                    if value is not phi:
+                        mapping[phi] = value
+            if mapping:
+                self.replace(mapping)
+                for block in self.blocks:
+                    block.phis = [ phi for phi in block.phis if phi not in mapping ]
+                removed += len(mapping)
+                changed = True
+
+        live = set()
+        worklist = [ arg for block in self.blocks
+                     for value in [*block.instructions, block.terminator]
+                     for arg in value.args if arg.op == 'phi' ]
+        while worklist:
+            phi = worklist.pop()
+            if phi in live:
+                continue
+            live.add(phi)
+            worklist.extend(arg for arg in phi.args if arg.op == 'phi')
+        for block in self.blocks:
+            removed += sum(1 for phi in block.phis if phi not in live)
+            block.phis = [ phi for phi in block.phis if phi in live ]
+        return removed
+
+    def reverse_postorder(self) -> list[Block]:
+        '''Orders blocks reachable from the entry so that every block goes
+        after its predecessors except the ones reaching it by back edges.
+
+        :param self: function
+        :type self: class:`rustyc.ssa.Function`
+
+        :return: reachable blocks
+        :rtype: list[class:`rustyc.ssa.Block`]
+        '''
+        order = []
+        visited = { self.entry }
+        stack = [(self.entry, iter(self.entry.successors))]
+        while stack:
+            block, successors = stack[-1]
+            for successor in successors:
+                if successor not in visited:
+                    visited.add(successor)
+                    stack.append((successor, iter(successor.successors)))
+                    break
+            else:
+                stack.pop()
+                order.append(block)
+        return order[::-1]
+
+
+class DominatorTree:
+    '''Immediate dominators of blocks of function. Block A dominates block B
+    if every path from the entry to B goes through A.
+    '''
+    def __init__(self, function: Function):
+        '''Builds the tree by the iterative algorithm of Cooper, Harvey and
+        Kennedy.
+
+        :param function: function in SSA form
+        :type function: class:`rustyc.ssa.Function`
+        '''
+        order = function.reverse_postorder()
+        number = { block: i for i, block in enumerate(order) }
+        idom = { function.entry: function.entry }
+
+        def intersect(a: Block, b: Block) -> Block:
+            while a is not b:
+                while number[a] > number[b]:
+                    a = idom[a]
+                while number[b] > number[a]:
+                    b = idom[b]
+            return a
+
+        changed = True
+        while changed:
+            changed = False
+            for block in order[1:]:
+                processed = [ p for p in block.predecessors if p in idom ]
+                new = processed[0]
+                for predecessor in processed[1:]:
+                    new = intersect(predecessor, new)
+                if idom.get(block) is not new:
+                    idom[block] = new
+                    changed = True
+
+        self.order = order
+        self.idom = { block: (None if block is function.entry else parent)
+                      for block, parent in idom.items() }
+        self.children = { block: [] for block in order }
+        for block in order[1:]:
+            self.children[self.idom[block]].append(block)
+
+    def dominates(self, a: Block, b: Block) -> bool:
+        '''Checks if block a dominates block b, every block dominates itself.
+
+        :param self: dominator tree
+        :type self: class:`rustyc.ssa.DominatorTree`
+        :param a: dominator
+        :type a: class:`rustyc.ssa.Block`
+        :param b: dominated block
+        :type b: class:`rustyc.ssa.Block`
+
+        :return: true if a dominates b
+        :rtype: bool
+        '''
+        while b is not None:
+            if b is a:
+                return True
+            b = self.idom[b]
+        return False
+
+    def preorder(self) -> list[Block]:
+        '''Blocks in preorder of the tree, dominators go before dominated.
+
+        :param self: dominator tree
+        :type self: class:`rustyc.ssa.DominatorTree`
+
+        :return: blocks of function
+        :rtype: list[class:`rustyc.ssa.Block`]
+        '''
+        order = []
+        stack = [self.order[0]]
+        while stack:
+            block = stack.pop()
+            order.append(block)
+            stack.extend(reversed(self.children[block]))
+        return order
+
+    def frontiers(self) -> dict[Block, set[Block]]:
+        '''Computes dominance frontiers: blocks where dominance of a block ends.
+
+        :param self: dominator tree
+        :type self: class:`rustyc.ssa.DominatorTree`
+
+        :return: dominance frontier by block
+        :rtype: dict[class:`rustyc.ssa.Block`, set[class:`rustyc.ssa.Block`]]
+        '''
+        frontiers = { block: set() for block in self.order }
+        for block in self.order:
+            predecessors = [ p for p in block.predecessors if p in frontiers ]
+            if len(predecessors) < 2:
+                continue
+            for runner in predecessors:
+                while runner is not self.idom[block]:
+                    frontiers[runner].add(block)
+                    runner = self.idom[runner]
+        return frontiers
+
+
+class Loop:
+    '''Natural loop: header dominates all blocks of the loop and is reached
+    by back edges from them. Loops with the same header are merged.
+    '''
+    def __init__(self, header: Block, blocks: set[Block]):
+        self.header = header
+        self.blocks = blocks
+        self.parent = None
+        self.children = []
+
+    @property
+    def depth(self) -> int:
+        '''Nesting depth, outermost loops have depth 1.
+        '''
+        depth = 1
+        loop = self.parent
+        while loop is not None:
+            depth += 1
+            loop = loop.parent
+        return depth
+
+    def __repr__(self) -> str:
+        return f'Loop({self.header!r}, {len(self.blocks)} blocks)'
+
+
+def loop_nest(function: Function, tree: Optional[DominatorTree] = None) -> list[Loop]:
+    '''Finds natural loops of function and their nesting.
+
+    :param function: function in SSA form
+    :type function: class:`rustyc.ssa.Function`
+    :param tree: dominator tree of the function, built if not given
+    :type tree: Optional[class:`rustyc.ssa.DominatorTree`]
+
+    :return: loops, outer loops go before inner ones
+    :rtype: list[class:`rustyc.ssa.Loop`]
+    '''
+    tree = tree or DominatorTree(function)
+    bodies = {}
+    for block in tree.order:
+        for header in block.successors:
+            if not tree.dominates(header, block):
+                continue
+            body = bodies.setdefault(header, { header })
+            worklist = [block]
+            while worklist:
+                member = worklist.pop()
+                if member in body:
+                    continue
+                body.add(member)
+                worklist.extend(p for p in member.predecessors if p in tree.idom)
+
+    loops = sorted((Loop(header, body) for header, body in bodies.items()),
+                   key=lambda loop: len(loop.blocks), reverse=True)
+    for i, loop in enumerate(loops):
+        for outer in reversed(loops[:i]):
+            if loop.header in outer.blocks and outer is not loop:
+                loop.parent = outer
+                outer.children.append(loop)
+                break
+    return loops
+
+
+def live_in(function: Function) -> dict[Block, set[Value]]:
+    '''Finds values that are live at the beginning of every block. Operand of
+    phi-function is live at the end of the corresponding predecessor, but not
+    at the beginning of phi-function's block.
+
+    :param function: function in SSA form
+    :type function: class:`rustyc.ssa.Function`
+
+    :return: live values by block
+    :rtype: dict[class:`rustyc.ssa.Block`, set[class:`rustyc.ssa.Value`]]
+    '''
+    live = { block: set() for block in function.blocks }
+    changed = True
+    while changed:
+        changed = False
+        for block in reversed(function.reverse_postorder()):
+            values = set()
+            for successor in block.successors:
+                position = successor.predecessors.index(block)
+                values |= live[successor]
+                values.update(phi.args[position] for phi in successor.phis)
+            for value in reversed([*block.instructions, block.terminator]):
+                values.discard(value)
+                values.update(value.args)
+            values.difference_update(block.phis)
+            if values != live[block]:
+                live[block] = values
+                changed = True
+    return live
+
+
+def stack_effect(instruction: Instr, functions: dict[str, FnMeta],
+                 results: dict[str, int]) -> Optional[tuple[int, int]]:
+    '''Number of values that instruction pops from and pushes onto the operands
+    stack. Terminators ret, stop and tcall consume the whole stack and are not
+    described.
+
+    :param instruction: VM instruction
+    :type instruction: class:`rustyc.ir.Instr`
+    :param functions: metadata of all functions
+    :type functions: dict[str, class:`rustyc.frontend.FnMeta`]
+    :param results: number of values left on the stack by every function
+    :type results: dict[str, int]
+
+    :return: popped and pushed values or None if they are unknown
+    :rtype: Optional[(int, int)]
+    '''
+    op = instruction.op
+    if op == 'call':
+        if instruction.arg not in functions or instruction.arg not in results:
+            return None
+        return len(functions[instruction.arg].parameters), results[instruction.arg]
+    return STACK_EFFECTS.get(op, None)
+
+
+def stack_heights(code: list[Item], parameters: int, functions: dict[str, FnMeta],
+                  results: dict[str, int],
+                  partial: bool = False) -> Optional[tuple[dict[int, int], list[int]]]:
+    '''Computes height of the operands stack at the beginning of every
+    reachable basic block and at every exit from function.
+
+    :param code: code of function
+    :type code: list[Item]
+    :param parameters: number of function's parameters
+    :type parameters: int
+    :param functions: metadata of all functions
+    :type functions: dict[str, class:`rustyc.frontend.FnMeta`]
+    :param results: number of values left on the stack by known functions
+    :type results: dict[str, int]
+    :param partial: paths through calls of functions with unknown results are
+    not followed instead of failure
+    :type partial: bool, default False
+
+    :return: heights by index of block of `rustyc.layout.build_blocks` and
+    numbers of values left on the stack by every reachable exit, or None if
+    heights depend on path or cannot be computed
+    :rtype: Optional[(dict[int, int], list[int])]
+    '''
+    blocks = build_blocks(code)
+    if blocks is None:
+        return None
+    heights = { 0: parameters }
+    exits = []
+    worklist = [0]
+    while worklist:
+        index = worklist.pop()
+        block = blocks[index]
+        height = heights[index]
+        for instruction in block.code:
+            effect = stack_effect(instruction, functions, results)
+            if effect is None and partial and instruction.arg in functions:
+                break # result is not known yet
+            if effect is None or height < effect[0]:
+                return None
+            height += effect[1] - effect[0]
+        else:
+            effect = ()
+        if effect is None:
+            continue
+        if block.exit is not None:
+            if block.exit.op == 'tcall':
+                callee = block.exit.arg
+                if callee not in functions:
+                    return None
+                if callee not in results:
+                    if partial:
+                        continue
+                    return None
+                pops = len(functions[callee].parameters)
+                if height < pops:
+                    return None
+                height += results[callee] - pops
+            exits.append(height)
+            continue
+        if block.branch is not None:
+            if height < 1:
+                return None
+            height -= 1
+        for successor in block.successors:
+            if successor not in heights:
+                heights[successor] = height
+                worklist.append(successor)
+            elif heights[successor] != height:
+                return None
+    return heights, exits
+
+
+def result_counts(bodies: dict[str, list[Item]],
+                  functions: dict[str, FnMeta]) -> dict[str, int]:
+    '''Finds the number of values that every function leaves on the operands
+    stack. Functions whose exits leave different numbers of values or which
+    never return are omitted.
+
+    :param bodies: code of every function
+    :type bodies: dict[str, list[Item]]
+    :param functions: metadata of all functions
+    :type functions: dict[str, class:`rustyc.frontend.FnMeta`]
+
+    :return: number of results by function's name
+    :rtype: dict[str, int]
+    '''
+    results = {}
+    while True:
+        changed = True
+        while changed:
+            changed = False
+            for name, body in bodies.items():
+                if name in results:
+                    continue
+                analysis = stack_heights(body, len(functions[name].parameters),
+                                         functions, results, partial=True)
+                if analysis is None or len(set(analysis[1])) != 1:
+                    continue
+                results[name] = analysis[1][0]
+                changed = True
+        # counts of recursive functions are guessed by paths without
+        # recursion and have to be confirmed by all paths
+        wrong = []
+        for name in results:
+            analysis = stack_heights(bodies[name], len(functions[name].parameters),
+                                     functions, results)
+            if analysis is None or set(analysis[1]) - { results[name] }:
+                wrong.append(name)
+        if not wrong:
+            return results
+        for name in wrong:
+            del results[name]
+
+
+def build_function(code: list[Item], meta: FnMeta, functions: dict[str, FnMeta],
+                   results: dict[str, int]) -> Optional[Function]:
+    '''Translates stack code of function to SSA form.
+
+    :param code: code of function, starts with its label
+    :type code: list[Item]
+    :param meta: function's metadata
+    :type meta: class:`rustyc.frontend.FnMeta`
+    :param functions: metadata of all functions
+    :type functions: dict[str, class:`rustyc.frontend.FnMeta`]
+    :param results: number of values left on the stack by every function, see
+    `result_counts`
+    :type results: dict[str, int]
+
+    :return: function in SSA form or None if it cannot be translated
+    :rtype: Optional[class:`rustyc.ssa.Function`]
+    '''
+    analysis = stack_heights(code, len(meta.parameters), functions, results)
+    if analysis is None:
+        return None
+    heights, _ = analysis
+    source = build_blocks(code)
+    indices = sorted(heights)
+
+    blocks = {}
+    for index in indices:
+        names = [ label.name for label in source[index].labels
+                  if label.name != meta.name ]
+        blocks[index] = Block(names[0] if names else None)
+    parameters = [ Value('param', arg=i) for i in range(len(meta.parameters)) ]
+
+    def connect(block: Block, successor: Block):
+        block.successors.append(successor)
+        successor.predecessors.append(block)
+
+    for index in indices:
+        item = source[index]
+        if item.branch is not None and item.branch != item.successor:
+            connect(blocks[index], blocks[item.branch])
+        if item.successor is not None:
+            connect(blocks[index], blocks[item.successor])
+    entry = blocks[0]
+    order = [ blocks[index] for index in indices ]
+    if entry.predecessors:
+        # function starts with a loop
+        entry = Block()
+        entry.terminator = Value('jmp')
+        connect(entry, blocks[0])
+        order.insert(0, entry)
+    function = Function(meta.name, parameters, order)
+
+    # placement of phi-functions for variables and stack cells
+    block_index = { block: index for index, block in blocks.items() }
+    tree = DominatorTree(function)
+    frontiers = tree.frontiers()
+    definitions = {}
+    for index in indices:
+        for instruction in source[index].code:
+            if instruction.op == 'store':
+                definitions.setdefault(instruction.arg, set()).add(blocks[index])
+    for index in indices:
+        item = source[index]
+        outgoing = [ heights[s] for s in item.successors ]
+        for cell in range(max(outgoing, default=0)):
+            definitions.setdefault(('stack', cell), set()).add(blocks[index])
+    for cell in range(len(parameters)):
+        definitions.setdefault(('stack', cell), set()).add(entry)
+    phis = {}
+    for variable, defined in definitions.items():
+        worklist = list(defined)
+        placed = set()
+        while worklist:
+            block = worklist.pop()
+            for frontier in frontiers[block]:
+                if frontier in placed or (isinstance(variable, tuple)
+                        and heights[block_index[frontier]] <= variable[1]):
+                    continue # stack cell is not live
+                placed.add(frontier)
+                phi = Value('phi', [None] * len(frontier.predecessors))
+                frontier.phis.append(phi)
+                phis[phi] = variable
+                worklist.append(frontier)
+
+    # renaming along the dominator tree
+    zero = Value('const', arg=0)
+    entry.instructions.append(zero)
+    current = { ('stack', i): [parameter]
+                for i, parameter in enumerate(parameters) }
+
+    def read(variable) -> Value:
+        values = current.get(variable)
+        if values:
+            return values[-1]
+        if isinstance(variable, tuple):
+            raise Exception # stack cell is not defined
+        return zero
+
+    stack = [(entry, None)]
+    while stack:
+        block, defined = stack.pop()
+        if defined is not None:
+            for variable in defined:
+                current[variable].pop()
+            continue
+        defined = []
+
+        def write(variable, value: Value):
+            current.setdefault(variable, []).append(value)
+            defined.append(variable)
+
+        for phi in block.phis:
+            write(phis[phi], phi)
+        if block in block_index:
+            index = block_index[block]
+            item = source[index]
+            values = [ read(('stack', cell)) for cell in range(heights[index]) ]
+            for instruction in item.code:
+                op = instruction.op
+                if op == 'push':
+                    value = Value('const', arg=instruction.arg)
+                    block.instructions.append(value)
+                    values.append(value)
+                elif op == 'load':
+                    values.append(read(instruction.arg))
+                elif op == 'store':
+                    write(instruction.arg, values.pop())
+                elif op == 'dup':
+                    values.append(values[-1])
+                elif op == 'swap':
+                    values[-2:] = values[:-3:-1]
+                elif op == 'pop':
+                    values.pop()
+                elif op == 'call':
+                    pops = len(functions[instruction.arg].parameters)
+                    args = values[len(values) - pops:]
+                    del values[len(values) - pops:]
+                    value = Value('call', args, instruction.arg,
+                                  results[instruction.arg])
+                    block.instructions.append(value)
+                    values.extend([value] * value.results)
+                elif op != 'nop':
+                    arity = 2 if op in BINARY else 1
+                    value = Value(op, values[-arity:])
+                    del values[-arity:]
+                    block.instructions.append(value)
+                    values.append(value)
+            if item.exit is not None:
+                block.terminator = Value(item.exit.op, values,
+                                         item.exit.arg if item.exit.op == 'tcall' else None)
+            elif item.branch is not None:
+                condition = values.pop()
+                block.terminator = Value('br', [condition]) \
+                    if item.branch != item.successor else Value('jmp')
+            else:
+                block.terminator = Value('jmp')
+            for cell, value in enumerate(values):
+                write(('stack', cell), value)
+
+        for successor in block.successors:
+            position = successor.predecessors.index(block)
+            for phi in successor.phis:
+                phi.args[position] = read(phis[phi])
+        stack.append((block, defined))
+        stack.extend((child, None) for child in reversed(tree.children[block]))
+
+    function.remove_trivial_phis()
+    return function
+
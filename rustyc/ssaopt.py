@@ -0,0 +1,157 @@
+#!/usr/bin/env python3
+'''Модуль, реализующий интерфейс проходов оптимизации над формой SSA (см.
+`rustyc.ssa`) и запуск этих проходов для всех функций программы.
+
+Проход - это `SsaPass`: имя и функция, которая получает функцию в форме SSA и
+счетчик статистики. Проход изменяет функцию на месте и добавляет в счетчик под
+своим именем число удаленных или упрощенных значений. Проход должен сохранять
+инварианты формы:
+
++ аргументы phi-функции соответствуют предшественникам блока по порядку, а
+  списки преемников и предшественников согласованы - для изменения дуг
+  используются методы `Function.remove_edge` и `Function.remove_unreachable`;
++ между двумя блоками не больше одной дуги, у `br` два разных преемника;
++ значение определяется раньше всех его использований, кроме аргументов
+  phi-функций, а порядок инструкций с побочными эффектами (вызовов, операций,
+  которые вызывают исключения виртуальной машины) не меняется;
++ первый блок является входом в функцию, в него нет переходов.
+
+Замена значения другим выполняется `Function.replace`, а значение можно
+изменить на месте, не трогая его использования: например, свертка констант
+превращает операцию в `const`.
+
+Новый проход добавляется в список `PASSES` или передается в `optimize`. Функции,
+которые не переводятся в SSA, остаются без изменений.
+'''
+from collections import Counter
+from typing import Callable, Iterable, NamedTuple
+
+from .ir import Item, Label, Instr
+from .frontend import FnMeta
+from .cse import BINARY, UNARY
+from .licm import PURE_BINARY, PURE_UNARY
+from .dce import split_functions
+from .consteval import evaluate
+from .ssa import Value, Function, build_function, result_counts
+from .lowering import lower_function
+
+
+class SsaPass(NamedTuple):
+    '''Optimization pass over SSA form of a single function. Run function
+    changes the function in place and counts its changes under pass's name.
+    '''
+    name: str
+    run: Callable[[Function, Counter], None]
+
+
+def fold_constants(function: Function, stats: Counter):
+    '''Evaluates operations over constants and removes branches that are never
+    taken. Operations that trap are left to be executed.
+
+    :param function: function in SSA form
+    :type function: class:`rustyc.ssa.Function`
+    :param stats: counter of folded values and branches
+    :type stats: class:`collections.Counter`
+    '''
+    changed = True
+    while changed:
+        changed = False
+        for block in function.blocks:
+            for value in block.instructions:
+                if value.op not in BINARY + UNARY \
+                        or any(arg.op != 'const' for arg in value.args):
+                    continue
+                result = evaluate(value.op, *(arg.arg for arg in value.args))
+                if result is None:
+                    continue
+                value.op, value.args, value.arg = 'const', [], result
+                stats['constant-folding'] += 1
+                changed = True
+            condition = block.terminator.args[0] \
+                if block.terminator.op == 'br' else None
+            if condition is not None and condition.op == 'const':
+                taken, fallen = block.successors
+                function.remove_edge(block, fallen if condition.arg else taken)
+                block.terminator = Value('jmp')
+                stats['constant-folding'] += 1
+                changed = True
+        if changed:
+            function.remove_unreachable()
+            function.remove_trivial_phis()
+
+
+def eliminate_dead_values(function: Function, stats: Counter):
+    '''Removes values without uses whose computation has no side effects.
+
+    :param function: function in SSA form
+    :type function: class:`rustyc.ssa.Function`
+    :param stats: counter of removed values
+    :type stats: class:`collections.Counter`
+    '''
+    pure = ('const',) + PURE_BINARY + PURE_UNARY
+    stats['dead-values'] += function.remove_trivial_phis()
+    while True:
+        uses = function.uses()
+        removed = 0
+        for block in function.blocks:
+            instructions = [ value for value in block.instructions
+                             if value.op not in pure or uses[value] ]
+            removed += len(block.instructions) - len(instructions)
+            block.instructions = instructions
+        if not removed:
+            return
+        stats['dead-values'] += removed + function.remove_trivial_phis()
+
+
+PASSES = [
+    SsaPass('constant-folding', fold_constants),
+    SsaPass('dead-values', eliminate_dead_values),
+]
+
+
+def _memory_accesses(items: Iterable[Item]) -> int:
+    return sum(1 for item in items
+               if isinstance(item, Instr) and item.op in ('load', 'store'))
+
+
+def optimize(items: Iterable[Item], functions: dict[str, FnMeta],
+             passes: Iterable[SsaPass] = PASSES,
+             only_changed: bool = False) -> tuple[list[Item], Counter]:
+    '''Translates every function to SSA form, runs passes over it and
+    translates it back to stack code.
+
+    :param items: labels and instructions
+    :type items: Iterable[Item]
+    :param functions: metadata of all functions
+    :type functions: dict[str, class:`rustyc.frontend.FnMeta`]
+    :param passes: optimization passes in order of execution
+    :type passes: Iterable[class:`rustyc.ssaopt.SsaPass`], default PASSES
+    :param only_changed: keep code of functions that passes did not change
+    :type only_changed: bool, default False
+
+    :return: program and statistics of every pass together with the number of
+    removed load and store instructions
+    :rtype: (list[Item], class:`collections.Counter`)
+    '''
+    passes = list(passes)
+    items = [ item for item in items if isinstance(item, (Label, Instr)) ]
+    prologue, bodies = split_functions(items, functions)
+    results = result_counts(bodies, functions)
+    stats = Counter({ ssa_pass.name: 0 for ssa_pass in passes })
+    stats['load-store'] = 0
+    program = list(prologue)
+    for name, body in bodies.items():
+        function = build_function(body, functions[name], functions, results)
+        if function is None:
+            program.extend(body)
+            continue
+        changes = sum(stats.values())
+        for ssa_pass in passes:
+            ssa_pass.run(function, stats)
+        if only_changed and sum(stats.values()) == changes:
+            program.extend(body)
+            continue
+        code = lower_function(function, functions[name])
+        stats['load-store'] += _memory_accesses(body) - _memory_accesses(code)
+        program.extend(code)
+    return program, stats
@@ -0,0 +1,319 @@
+#!/usr/bin/env python3
+'''Модуль, реализующий развертку (unrolling) циклов со счетчиком вида:
+```
+while i < N {
+    ...
+    i += 1;
+}
+```
+где граница N - константа или переменная, не изменяемая в цикле, а счетчик
+увеличивается на единицу только в конце тела. Фронтенд транслирует такой цикл в
+```
+    jmp COND
+ENTER:
+    <тело>
+    load i
+    inc
+    store i
+COND:
+    load i
+    <граница>
+    lt
+    jift ENTER
+```
+Тело цикла не должно содержать переходов за свои пределы (break, continue), а
+метки цикла не должны использоваться вне его.
+
+Цикл разворачивается в несколько копий тела, которые выполняются, пока до
+границы остается не меньше итераций, чем копий. Оставшиеся итерации выполняет
+исходный цикл:
+```
+    load i; <граница>; gt; jift EXIT    # при i > N цикл не выполняется
+    jmp MAIN_COND
+MAIN:
+    <тело> ... <тело>                   # k копий
+MAIN_COND:
+    <граница>; load i; sub; push k; ge; jift MAIN
+    <исходный цикл>
+EXIT:
+```
+Если начальное значение счетчика и граница - константы и развернутый цикл не
+превышает заданного размера, цикл заменяется копиями тела целиком.
+
+По профилю исполнения (см. `rustyc.pgo`) не разворачиваются циклы, среднее
+число итераций которых меньше числа копий тела: метка ENTER исполняется на
+каждой итерации, а метка COND - еще и при каждом выходе из цикла.
+'''
+from collections import Counter
+from typing import Iterable, Optional
+
+from .ir import Item, Label, Instr, JUMPS, LABEL_OPERANDS
+from .frontend import FnMeta
+from .dce import split_functions
+from .pgo import Profile
+
+
+# default number of copies of the loop's body
+DEFAULT_UNROLL_FACTOR = 4
+# default limit of instructions in the unrolled loop's bodies
+DEFAULT_MAX_UNROLLED_SIZE = 128
+
+
+def _instructions(items: Iterable[Item]) -> int:
+    return sum(1 for item in items if isinstance(item, Instr))
+
+
+def _increments(body: list[Item]) -> Optional[int]:
+    '''Returns counter's identifier if body ends with its increment.
+    '''
+    for pattern in (['load', 'inc', 'store'], ['load', 'push', 'add', 'store']):
+        tail = body[-len(pattern):]
+        if len(tail) == len(pattern) \
+                and all(isinstance(item, Instr) for item in tail) \
+                and [item.op for item in tail] == pattern \
+                and tail[0].arg == tail[-1].arg \
+                and (len(pattern) == 3 or tail[1].arg == 1):
+            return tail[0].arg
+    return None
+
+
+class CountedLoop:
+    '''Counted loop found in function's code.
+    '''
+    def __init__(self, code: list[Item], jump: int, cond: int):
+        self.jump = jump
+        self.cond = cond
+        self.enter = code[jump + 1].name
+        self.body = code[jump + 2:cond]
+        self.counter = code[cond + 1].arg
+        self.bound = code[cond + 2]
+
+    @property
+    def end(self) -> int:
+        '''Position after the loop's back edge.
+        '''
+        return self.cond + 5
+
+
+def find_loop(code: list[Item], jump: int) -> Optional[CountedLoop]:
+    '''Checks if counted loop starts at position.
+
+    :param code: code of function
+    :type code: list[Item]
+    :param jump: position of the jump to loop's condition
+    :type jump: int
+
+    :return: loop or None if there is no counted loop at position
+    :rtype: Optional[class:`rustyc.unroll.CountedLoop`]
+    '''
+    if not (isinstance(code[jump], Instr) and code[jump].op == 'jmp'
+            and jump + 1 < len(code) and isinstance(code[jump + 1], Label)):
+        return None
+    enter = code[jump + 1].name
+    labels = { item.name: i for i, item in enumerate(code)
+               if isinstance(item, Label) }
+    cond = labels.get(code[jump].arg, -1)
+    if cond <= jump + 1 or cond + 4 >= len(code):
+        return None
+    load, bound, compare, branch = code[cond + 1:cond + 5]
+    if not (all(isinstance(item, Instr) for item in (load, bound, compare, branch))
+            and load.op == 'load' and compare.op == 'lt'
+            and branch.op == 'jift' and branch.arg == enter
+            and (bound.op == 'load' or (bound.op == 'push'
+                                        and isinstance(bound.arg, int)))):
+        return None
+
+    loop = CountedLoop(code, jump, cond)
+    if _increments(loop.body) != loop.counter:
+        return None
+    stored = [ item.arg for item in loop.body
+               if isinstance(item, Instr) and item.op == 'store' ]
+    if stored.count(loop.counter) != 1 \
+            or (bound.op == 'load' and bound.arg in stored):
+        return None
+
+    inner = { item.name for item in loop.body if isinstance(item, Label) }
+    for i, item in enumerate(code):
+        if not (isinstance(item, Instr) and item.op in LABEL_OPERANDS):
+            continue
+        inside = jump + 2 <= i < cond
+        if inside and item.op in JUMPS and item.arg not in inner:
+            return None # break or continue
+        if not inside and (item.arg in inner or item.arg == enter
+                           or item.arg == code[jump].arg) \
+                and i not in (jump, cond + 4):
+            return None
+    return loop
+
+
+class Unroller:
+    '''Unrolls counted loops of functions.
+    '''
+    def __init__(self, factor: int = DEFAULT_UNROLL_FACTOR,
+                 max_size: int = DEFAULT_MAX_UNROLLED_SIZE,
+                 profile: Optional[Profile] = None):
+        '''Constructor
+
+        :param factor: number of copies of the loop's body
+        :type factor: int, default 4
+        :param max_size: limit of instructions in copies of the loop's body
+        :type max_size: int, default 128
+        :param profile: execution profile
+        :type profile: Optional[class:`rustyc.pgo.Profile`]
+        '''
+        self.factor = factor
+        self.max_size = max_size
+        self.profile = profile
+        self.counter = 0
+
+    def copy(self, body: list[Item]) -> list[Item]:
+        '''Copies body of the loop with renamed labels.
+
+        :param self: unroller
+        :type self: class:`rustyc.unroll.Unroller`
+        :param body: labels and instructions of the loop's body
+        :type body: list[Item]
+
+        :return: labels and instructions
+        :rtype: list[Item]
+        '''
+        self.counter += 1
+        prefix = f'.{self.counter}_unr'
+        inner = { item.name for item in body if isinstance(item, Label) }
+        code = []
+        for item in body:
+            if isinstance(item, Label):
+                code.append(Label(prefix + item.name))
+            elif item.op in JUMPS and item.arg in inner:
+                code.append(Instr(item.op, prefix + item.arg))
+            else:
+                code.append(item)
+        return code
+
+    def _trip_count(self, code: list[Item], loop: CountedLoop) -> Optional[int]:
+        '''Number of iterations of loop with constant bounds. Initial value of
+        the counter is searched in straight-line code before the loop.
+        '''
+        if loop.bound.op != 'push':
+            return None
+        for i in reversed(range(1, loop.jump)):
+            item = code[i]
+            if isinstance(item, Label) or item.op in LABEL_OPERANDS + ('ret',):
+                return None
+            if item.op in ('load', 'store') and item.arg == loop.counter:
+                push = code[i - 1]
+                if item.op == 'store' and isinstance(push, Instr) \
+                        and push.op == 'push' and isinstance(push.arg, int):
+                    return max(0, loop.bound.arg - push.arg)
+                return None
+        return None
+
+    def _short(self, code: list[Item], loop: CountedLoop) -> bool:
+        '''Checks if profile shows less iterations of the loop per its
+        execution than copies of the body.
+        '''
+        if self.profile is None:
+            return False
+        iterations = self.profile.count(loop.enter)
+        checks = self.profile.count(code[loop.jump].arg)
+        if iterations is None or checks is None:
+            return False
+        return iterations < self.factor * (checks - iterations)
+
+    def unroll(self, code: list[Item], loop: CountedLoop,
+               unrolled: Counter) -> Optional[list[Item]]:
+        '''Unrolls the loop if it fits into size limit.
+
+        :param self: unroller
+        :type self: class:`rustyc.unroll.Unroller`
+        :param code: code of function
+        :type code: list[Item]
+        :param loop: counted loop of the function
+        :type loop: class:`rustyc.unroll.CountedLoop`
+        :param unrolled: counter of unrolled loops
+        :type unrolled: class:`collections.Counter`
+
+        :return: code of function or None if the loop is left as is
+        :rtype: Optional[list[Item]]
+        '''
+        size = _instructions(loop.body)
+        trips = self._trip_count(code, loop)
+        if trips is not None and trips * size <= self.max_size:
+            unrolled['fully-unrolled'] += 1
+            copies = [ item for _ in range(trips) for item in self.copy(loop.body) ]
+            return code[:loop.jump] + copies + code[loop.end:]
+        if self.factor < 2 or size * self.factor > self.max_size \
+                or self._short(code, loop):
+            return None
+
+        self.counter += 1
+        main = f'.{self.counter}_unrolled_utlbl'
+        main_cond = f'.{self.counter}_unrolled_cond_utlbl'
+        exit_ = f'.{self.counter}_unrolled_exit_utlbl'
+        counter = Instr('load', loop.counter)
+        unrolled_loop = [
+            counter, loop.bound, Instr('gt'), Instr('jift', exit_),
+            Instr('jmp', main_cond),
+            Label(main),
+            *(item for _ in range(self.factor) for item in self.copy(loop.body)),
+            Label(main_cond),
+            loop.bound, counter, Instr('sub'), Instr('push', self.factor),
+            Instr('ge'), Instr('jift', main),
+            *code[loop.jump:loop.end],
+            Label(exit_)
+        ]
+        unrolled['unrolled'] += 1
+        return code[:loop.jump] + unrolled_loop + code[loop.end:]
+
+    def run_function(self, code: list[Item], unrolled: Counter) -> list[Item]:
+        '''Unrolls loops of function, innermost loops go first.
+
+        :param self: unroller
+        :type self: class:`rustyc.unroll.Unroller`
+        :param code: code of function
+        :type code: list[Item]
+        :param unrolled: counter of unrolled loops
+        :type unrolled: class:`collections.Counter`
+
+        :return: code of function
+        :rtype: list[Item]
+        '''
+        processed = set()
+        while True:
+            loops = [ loop for loop in (find_loop(code, i) for i in range(len(code)))
+                      if loop is not None and loop.enter not in processed ]
+            if not loops:
+                return code
+            loop = min(loops, key=lambda loop: loop.end - loop.jump)
+            processed.add(loop.enter)
+            code = self.unroll(code, loop, unrolled) or code
+
+
+def unroll(items: Iterable[Item], functions: dict[str, FnMeta],
+           factor: int = DEFAULT_UNROLL_FACTOR,
+           max_size: int = DEFAULT_MAX_UNROLLED_SIZE,
+           profile: Optional[Profile] = None) -> tuple[list[Item], Counter]:
+    '''Unrolls counted loops in all functions.
+
+    :param items: labels and instructions
+    :type items: Iterable[Item]
+    :param functions: metadata of all functions
+    :type functions: dict[str, class:`rustyc.frontend.FnMeta`]
+    :param factor: number of copies of the loop's body
+    :type factor: int, default 4
+    :param max_size: limit of instructions in copies of the loop's body
+    :type max_size: int, default 128
+    :param profile: execution profile
+    :type profile: Optional[class:`rustyc.pgo.Profile`]
+
+    :return: program and number of unrolled loops
+    :rtype: (list[Item], class:`collections.Counter`)
+    '''
+    items = [ item for item in items if isinstance(item, (Label, Instr)) ]
+    prologue, bodies = split_functions(items, functions)
+    unroller = Unroller(factor, max_size, profile)
+    unrolled = Counter({ 'unrolled': 0, 'fully-unrolled': 0 })
+    program = list(prologue)
+    for body in bodies.values():
+        program.extend(unroller.run_function(body, unrolled))
+    return program, unrolled
@@ -1,20 +1,49 @@
 #!/usr/bin/env python3
 import unittest
+import unittest.mock
+import os
+import tempfile
+from collections import Counter
 import antlr4
+import numpy as np
 from rustyc.libs.RustyLexer import RustyLexer
 from rustyc.libs.RustyParser import RustyParser
-from rustyc.frontend import FERListener
+from rustyc.frontend import FERListener, translate as translate_items
+from rustyc.ir import serialize, Label, Instr, Chunk, BLANK
+from rustyc.backend import assemble, process
+from rusty.asm import AssemblyError
+from rustyc import cse, dce, inline, layout, licm, liveness, peephole, unroll
+from rustyc import cache, consteval, linker, partial, pgo, ssa, ssaopt
+from rustyc.passes import Compilation, Pass, PassManager
+from rustyc import __main__ as rustyc_main
+from rustyc.frontend import FnMeta, VariableMeta
+from rusty import container, isa
+from rusty.vm import VM
 
 
-def translate(program: str) -> str:
+def frontend(program: str, **options) -> list:
     lexer = RustyLexer(antlr4.InputStream(program))
     parser = RustyParser(antlr4.CommonTokenStream(lexer))
     crate = parser.crate()
-    listener = FERListener()
+    listener = FERListener(**options)
     antlr4.ParseTreeWalker().walk(listener, crate)
     return listener.tree[crate]
 
 
+def translate(program: str) -> str:
+    return serialize(frontend(program))
+
+
+def execute(items: list) -> list:
+    code, _ = assemble(items)
+    ctx = isa.Context()
+    while not isinstance(code[ctx.ip], isa.Stop):
+        instruction = code[ctx.ip]
+        ctx.ip += 1
+        instruction.execute(ctx)
+    return ctx.operands_stack
+
+
 class RustycRulesCases(unittest.TestCase):
     INTEGER_SUFFIXES = [ '', 'i8', 'u8', 'i16', 'u16', 'i32', 'u32', 'i64', 'u64',
         'i128', 'u128', 'isize', 'usize' ]
@@ -116,7 +145,7 @@ main:
         binary_operations = {
             '+': 'add', '-': 'sub', '*': 'mul', '/': 'div', '%': 'mod',
             '<<': 'shl', '>>': 'shr', '&': 'and', '|': 'or', '^': 'xor',
-            '&&': 'and', '||': 'or', '==': 'eq', '!=': 'neq', '<': 'lt',
+            '==': 'eq', '!=': 'neq', '<': 'lt',
             '>': 'gt', '<=': 'le', '>=': 'ge'
         }
         for binop, ins in binary_operations.items():
@@ -133,5 +162,949 @@ main:
 \tret''')
 
 
+class RustycLazyBooleanCases(unittest.TestCase):
+    def test_short_circuit_value(self):
+        self.assertEqual(translate('fn main() { 42 || 86 }'), '''\tcall main
+\tstop
+main:
+\tpush 42
+\tjift .0_lazy_true_utlbl
+\tpush 86
+\tjift .0_lazy_true_utlbl
+\tpush 0
+\tjmp .1_lazy_end_utlbl
+.0_lazy_true_utlbl:
+\tpush 1
+.1_lazy_end_utlbl:
+\tret''')
+
+    def test_condition_jumps_to_branches(self):
+        source_code = translate('''fn main() {
+            let a = 1; let mut b = 2;
+            if a > 0 && (b < 3 || a == b) { b = 0; }
+        }''')
+        self.assertNotIn('lazy', source_code)
+        self.assertIn('''\tlt
+\tjift .7_then_utlbl
+\tload 0
+\tload 1
+\teq
+\tjift .7_then_utlbl
+.9_and_skip_utlbl:''', source_code)
+
+    def test_right_operand_skipped(self):
+        program = frontend('''fn main() -> u64 {
+            let x = 0; x != 0 && 10 % x == 1
+        }''')
+        self.assertEqual(execute(program), [0])
+
+    def test_conditions_of_values_released(self):
+        class Listener(FERListener):
+            def exitFunction(self, ctx):
+                kept.append(len(self.conditions))
+                return super().exitFunction(ctx)
+
+        kept = []
+        lexer = RustyLexer(antlr4.InputStream('''fn f(x: u64) -> u64 { x }
+        fn main() {
+            let a = 1; let b = 0;
+            let c = a && b;
+            f((a || b)) + (a && (b || a));
+            if (a || b) && c { f(1); }
+        }'''))
+        parser = RustyParser(antlr4.CommonTokenStream(lexer))
+        translate_items(parser, Listener())
+        self.assertEqual(kept, [0, 0])
+
+
+class RustycIRCases(unittest.TestCase):
+    def test_chunk_order(self):
+        chunk = Chunk(Instr('push', 1), Chunk(Chunk(), Instr('push', 2)),
+                      Chunk(BLANK), Instr('add'))
+        self.assertEqual(len(chunk), 4)
+        self.assertEqual(list(chunk), [Instr('push', 1), Instr('push', 2),
+                                       BLANK, Instr('add')])
+        self.assertEqual(serialize(chunk), '\tpush 1\n\tpush 2\n\n\tadd')
+
+    def test_deep_chunk(self):
+        chunk = Chunk(Instr('push', 0))
+        for _ in range(100000):
+            chunk = Chunk(chunk, Instr('inc'))
+        self.assertEqual(len(chunk), 100001)
+        self.assertEqual(sum(1 for _ in chunk), 100001)
+
+
+class RustycFrontendCases(unittest.TestCase):
+    PROGRAM = '''fn id(x: u64) -> u64 { x }
+fn main() { let mut a = 1; while a < 10 { a += id(2); } }'''
+
+    def test_consumed_translations_released(self):
+        lexer = RustyLexer(antlr4.InputStream(self.PROGRAM))
+        parser = RustyParser(antlr4.CommonTokenStream(lexer))
+        crate = parser.crate()
+        listener = FERListener()
+        antlr4.ParseTreeWalker().walk(listener, crate)
+        self.assertEqual(list(listener.tree.keys()), [crate])
+
+    def test_translate_items(self):
+        lexer = RustyLexer(antlr4.InputStream(self.PROGRAM))
+        parser = RustyParser(antlr4.CommonTokenStream(lexer))
+        listener = FERListener()
+        program = translate_items(parser, listener)
+        self.assertEqual(listener.tree, {})
+        self.assertEqual(serialize(program), translate(self.PROGRAM))
+
+
+class RustycBackendCases(unittest.TestCase):
+    def test_assemble(self):
+        program = [Instr('call', 'main'), Instr('stop'), Label('main'),
+                   Label('.0_loop'), Instr('push', 0x2a, '0x2a'),
+                   Instr('jift', '.0_loop'), Instr('ret')]
+        code, labels = assemble(program)
+        self.assertEqual(labels, {'main': 2, '.0_loop': 2})
+        self.assertEqual(code, [isa.Call(2), isa.Stop(), isa.Push(42),
+                                isa.JumpIfTrue(-1), isa.Return()])
+
+    def test_assemble_translation(self):
+        code, _ = assemble(frontend('fn main() { 0x2a + 0b1 }'))
+        self.assertEqual(code, [isa.Call(2), isa.Stop(), isa.Push(42),
+                                isa.Push(1), isa.Add(), isa.Return()])
+
+    def test_undefined_label(self):
+        with self.assertRaises(Exception):
+            assemble([Instr('jmp', 'nowhere')])
+
+    def test_process_exact_operands(self):
+        source = '\n'.join(['\tcall p', '\tstop', 'p:', '\tjmp pu',
+                            'pu:', '\tpush 1', '\tjift p', '\tret'])
+        self.assertEqual(process(source), '\n'.join(['\tcall 2', '\tstop',
+            '\tjmp 1', '\tpush 1', '\tjift -2', '\tret']))
+        self.assertEqual(process(source, should_prepend=True).split('\n')[4],
+                         '4:\tjift -2')
+
+    def test_process_errors(self):
+        cases = [
+            ('\tpush 1\n\tjmp nowhere', 2, 'undefined label'),
+            ('a:\n\tnop\na:', 3, 'duplicate label'),
+            ('\tnop\n\tpush', 2, 'expects 1 argument'),
+            ('\tjump a', 1, 'unknown instruction'),
+        ]
+        for source, line_no, message in cases:
+            with self.assertRaises(AssemblyError) as error:
+                process(source)
+            self.assertEqual(error.exception.line_no, line_no)
+            self.assertIn(message, str(error.exception))
+
+
+class RustycConstantFoldingCases(unittest.TestCase):
+    def fold(self, program: str) -> list:
+        return list(frontend(program, fold_constants=True))
+
+    def test_wraparound(self):
+        cases = {
+            '0 - 1': 2**64 - 1, '(2 + 3) * 4': 20, '-5': 2**64 - 5,
+            '!0': 2**64 - 1, '1 << 70': 0, '0xffffffffffffffff + 2': 1,
+            '3 > 2': 1, '7 % 4 == 3': 1, 'true && false': 0,
+            '4 && 9': 1, '2 || 0': 1, '0 || 5': 1, '4 && 0': 0,
+        }
+        for expression, value in cases.items():
+            items = self.fold('fn main() { %s }' % expression)
+            self.assertEqual(items[3:5], [Instr('push', value), Instr('ret')],
+                             expression)
+
+    def test_runtime_errors_not_folded(self):
+        for expression, op in (('1 % 0', 'mod'), ('6 / 3', 'div')):
+            items = self.fold('fn main() { %s }' % expression)
+            self.assertEqual(items[5], Instr(op))
+
+    def test_immutable_propagation(self):
+        items = self.fold('''fn main() {
+            let a = 11;
+            let mut b = 4;
+            let c = a + 1;
+            if b > 0 { let d = 2; b = c * d; }
+            b = b + c;
+        }''')
+        self.assertIn(Instr('push', 12), items)
+        self.assertIn(Instr('push', 24), items)
+        self.assertNotIn(Instr('load', 0), items)
+        self.assertNotIn(Instr('load', 2), items)
+        self.assertIn(Instr('load', 1), items)
+
+    def test_scope_of_propagation(self):
+        items = self.fold('''fn main() {
+            let mut b = 4;
+            if b > 0 { let d = 2; b = d; }
+            b = d;
+        }''')
+        self.assertEqual(items[-3:], [Instr('load', 1), Instr('store', 0),
+                                      Instr('ret')])
+
+    def test_constant_conditions(self):
+        items = self.fold('''fn main() {
+            let debug = false;
+            let mut a = 0;
+            if debug { a = 1; } else { a = 2; }
+            while debug { a += 1; }
+            while !debug { break; }
+        }''')
+        self.assertNotIn(Instr('push', 1), items)
+        self.assertEqual([ item for item in items if isinstance(item, Instr)
+                           and item.op == 'jift' ], [])
+
+
+class RustycDeadCodeCases(unittest.TestCase):
+    PROGRAM = '''fn unused(x: u64) -> u64 { helper(x) }
+fn helper(x: u64) -> u64 { x + 1 }
+fn id(x: u64) -> u64 { x }
+fn main() {
+    let mut a = 0;
+    loop {
+        a += 1;
+        if a > 3 { break; a = 100; }
+        continue;
+        a = 200;
+    }
+    id(a);
+    return;
+    a = 300;
+}'''
+
+    def test_dead_functions(self):
+        names = ['unused', 'helper', 'id', 'main']
+        items, live, removed = dce.eliminate(frontend(self.PROGRAM), names)
+        self.assertEqual(live, {'main', 'id'})
+        self.assertNotIn(Label('unused'), items)
+        self.assertNotIn(Label('helper'), items)
+        self.assertIn(Label('id'), items)
+        self.assertEqual(removed['dead-function'], 9)
+
+    def test_dead_code(self):
+        items, _, removed = dce.eliminate(frontend(self.PROGRAM), ['main'])
+        for value in (100, 200, 300):
+            self.assertNotIn(Instr('push', value), items)
+        self.assertEqual(removed['dead-code'], 8)
+        self.assertEqual(items[-2:], [Instr('call', 'id'), Instr('ret')])
+
+    def test_basic_blocks(self):
+        blocks = dce.basic_blocks([Label('f'), Instr('push', 1),
+            Instr('jift', 'a'), Label('b'), Label('a'), Instr('ret'),
+            Instr('ret')])
+        self.assertEqual(len(blocks), 3)
+        self.assertEqual(blocks[1], [Label('b'), Label('a'), Instr('ret')])
+
+
+class RustycInlineCases(unittest.TestCase):
+    PROGRAM = '''fn sq(x: u64) -> u64 { let y = x * x; y }
+fn fib(n: u64) -> u64 { if n < 2 { return n; } fib(n - 1) + fib(n - 2) }
+fn main() {
+    let a = 3;
+    let b = sq(a) + sq(fib(a));
+}'''
+
+    def translate(self, max_growth: int = inline.DEFAULT_MAX_GROWTH):
+        lexer = RustyLexer(antlr4.InputStream(self.PROGRAM))
+        parser = RustyParser(antlr4.CommonTokenStream(lexer))
+        listener = FERListener()
+        program = translate_items(parser, listener)
+        items, inlined = inline.inline(program, listener.functions, max_growth)
+        return items, inlined, listener.functions
+
+    def test_inline_small_function(self):
+        items, inlined, functions = self.translate()
+        self.assertEqual(inlined['calls'], 2)
+        main = items[items.index(Label('main')):]
+        self.assertNotIn(Instr('call', 'sq'), main)
+        self.assertIn(Instr('call', 'fib'), main)
+        # a, b and two copies of x and y
+        self.assertEqual(len(functions['main'].locals), 6)
+        self.assertEqual(main[3:9], [Instr('load', 0), Instr('store', 2),
+            Instr('load', 2), Instr('load', 2), Instr('mul'), Instr('store', 3)])
+        self.assertIn(Instr('jmp', '.1_inlsq_cont'), main)
+        self.assertIn(Label('.1_inlsq_cont'), main)
+        self.assertNotIn(Instr('ret'), main[:-1])
+
+    def test_growth_limit(self):
+        _, inlined, _ = self.translate(max_growth=0)
+        self.assertEqual(inlined['calls'], 0)
+
+    def test_recursive_functions(self):
+        graph = {'main': {'f', 'a'}, 'f': {'f'}, 'a': {'b'}, 'b': {'a'},
+                 'c': set()}
+        self.assertEqual(inline.recursive_functions(graph), {'f', 'a', 'b'})
+        order = inline.bottom_up({'main': {'g'}, 'g': {'h'}, 'h': set()})
+        self.assertEqual(order, ['h', 'g', 'main'])
+
+    def test_maybe_uninitialized(self):
+        code = [Instr('load', 0), Instr('jift', 'a'), Instr('push', 1),
+                Instr('store', 1), Label('a'), Instr('load', 1),
+                Instr('store', 2), Instr('load', 2), Instr('ret')]
+        self.assertEqual(inline.maybe_uninitialized(code), {0, 1})
+
+
+class RustycLivenessCases(unittest.TestCase):
+    def test_block_liveness(self):
+        blocks = dce.basic_blocks([Instr('push', 1), Instr('store', 0),
+            Label('loop'), Instr('load', 0), Instr('jift', 'loop'),
+            Instr('load', 1), Instr('ret')])
+        live_in, live_out = liveness.block_liveness(blocks)
+        self.assertEqual(live_in, [{1}, {0, 1}, {1}])
+        self.assertEqual(live_out, [{0, 1}, {0, 1}, set()])
+
+    def test_compact_slots(self):
+        meta = FnMeta('f', {'x': VariableMeta(0)}, {
+            'a': VariableMeta(1), 'b': VariableMeta(2), 'c': VariableMeta(3)})
+        body = [Label('f'), Instr('store', 0),
+                Instr('load', 0), Instr('store', 1), Instr('load', 1),
+                Instr('store', 2), Instr('load', 2), Instr('push', 1),
+                Instr('store', 3), Instr('ret')]
+        items, removed = liveness.compact([Instr('call', 'f'), Instr('stop')]
+                                          + body, {'f': meta})
+        self.assertEqual(items[2:], [Label('f'), Instr('store', 0),
+            Instr('load', 0), Instr('store', 0), Instr('load', 0),
+            Instr('store', 0), Instr('load', 0), Instr('push', 1),
+            Instr('pop'), Instr('ret')])
+        self.assertEqual(removed['dead-store'], 1)
+        self.assertEqual(removed['slots'], 3)
+        self.assertEqual(meta.parameters['x'].identifier, 0)
+        self.assertEqual(set(meta.locals), {'a', 'b'})
+
+    def test_interfering_and_uninitialized(self):
+        meta = FnMeta('f', {}, { name: VariableMeta(i)
+                                 for i, name in enumerate('abc') })
+        body = [Label('f'), Instr('load', 2), Instr('push', 1),
+                Instr('store', 0), Instr('push', 2), Instr('store', 1),
+                Instr('load', 0), Instr('load', 1), Instr('add'),
+                Instr('store', 2), Instr('ret')]
+        items, _ = liveness.compact(body, {'f': meta})
+        self.assertEqual(items[1], Instr('load', 0))
+        self.assertEqual(items[3], Instr('store', 1))
+        self.assertEqual(items[5], Instr('store', 2))
+        self.assertEqual(items[-2:], [Instr('pop'), Instr('ret')])
+
+
+class RustycCseCases(unittest.TestCase):
+    def test_adjacent_duplicate(self):
+        program = frontend('''fn f(a: u64, b: u64) -> u64 { (a + b) * (b + a) }
+        fn main() { f(1, 2) }''')
+        items, removed = cse.eliminate(program, {'f': FnMeta('f', {
+            'a': VariableMeta(0), 'b': VariableMeta(1)}, {}), 'main': FnMeta('main', {}, {})})
+        self.assertEqual(items[2:10], [Label('f'), Instr('store', 1),
+            Instr('store', 0), Instr('load', 0), Instr('load', 1), Instr('add'),
+            Instr('dup'), Instr('mul')])
+        self.assertEqual(removed['common-subexpression'], 2)
+
+    def test_temporary_variable(self):
+        meta = FnMeta('f', {'a': VariableMeta(0)}, {'x': VariableMeta(1)})
+        expression = [Instr('load', 0), Instr('push', 3), Instr('mul'),
+                      Instr('push', 1), Instr('add')]
+        body = [Label('f'), Instr('store', 0), *expression, Instr('store', 1),
+                *expression, Instr('load', 1), Instr('add'), Instr('ret')]
+        items, removed = cse.eliminate(body, {'f': meta})
+        self.assertEqual(items, [Label('f'), Instr('store', 0), *expression,
+            Instr('dup'), Instr('store', 2), Instr('store', 1),
+            Instr('load', 2), Instr('load', 1), Instr('add'), Instr('ret')])
+        self.assertEqual(removed['common-subexpression'], 2)
+        self.assertIn('.cse2', meta.locals)
+
+    def test_store_changes_value(self):
+        body = [Label('f'), Instr('load', 0), Instr('push', 1), Instr('sub'),
+            Instr('push', 7), Instr('store', 0), Instr('load', 0),
+            Instr('push', 1), Instr('sub'), Instr('add'), Instr('ret')]
+        occurrences = cse.value_numbers(body)
+        self.assertEqual(sorted(occurrences.values()), [[(1, 4)], [(6, 9)]])
+        items, _ = cse.eliminate(body, {'f': FnMeta('f', {}, {})})
+        self.assertEqual(items, body)
+
+
+class RustycUnrollCases(unittest.TestCase):
+    PROGRAM = '''fn run(start: u64, n: u64) -> u64 {
+        let mut i = start;
+        let mut s = 1;
+        while i < n { s = s * 3 + i; i += 1; }
+        s + i * 1000
+    }
+    fn main() -> u64 {
+        let mut k = 0;
+        let mut p = 1;
+        while k < 5 { p = p * 2 + k; k += 1; }
+        run(10, 3) + run(0, 7) + run(2, 13) + p
+    }'''
+
+    def optimize(self, **options) -> tuple:
+        listener = FERListener()
+        lexer = RustyLexer(antlr4.InputStream(self.PROGRAM))
+        parser = RustyParser(antlr4.CommonTokenStream(lexer))
+        program, _ = peephole.optimize(translate_items(parser, listener),
+                                       keep=listener.functions)
+        return unroll.unroll(program, listener.functions, **options)
+
+    def test_unrolled_loops(self):
+        expected = execute(frontend(self.PROGRAM))
+        for factor in (2, 3, 4):
+            items, unrolled = self.optimize(factor=factor, max_size=48)
+            self.assertEqual(unrolled['unrolled'], 1)
+            self.assertEqual(unrolled['fully-unrolled'], 1)
+            self.assertEqual(execute(items), expected)
+
+    def test_size_limit(self):
+        items, unrolled = self.optimize(factor=4, max_size=4)
+        self.assertEqual(unrolled['unrolled'] + unrolled['fully-unrolled'], 0)
+
+    def test_loop_with_break(self):
+        program = frontend('''fn main() {
+            let mut i = 0; while i < 9 { if i == 4 { break; } i += 1; }
+        }''')
+        program = list(program)
+        self.assertIsInstance(program[5], Instr)
+        self.assertEqual(program[5].op, 'jmp')
+        self.assertIsNone(unroll.find_loop(program, 5))
+        items, unrolled = unroll.unroll(program, {'main': FnMeta('main', {}, {})})
+        self.assertEqual(sum(unrolled.values()), 0)
+
+
+class RustycLicmCases(unittest.TestCase):
+    def test_hoist_from_while(self):
+        meta = FnMeta('f', {'a': VariableMeta(0)}, {'i': VariableMeta(1)})
+        body = [Label('f'), Instr('store', 0), Instr('jmp', 'cond'),
+            Label('enter'), Instr('load', 1), Instr('load', 0), Instr('push', 3),
+            Instr('shl'), Instr('add'), Instr('store', 1), Label('cond'),
+            Instr('load', 1), Instr('load', 0), Instr('inc'), Instr('lt'),
+            Instr('jift', 'enter'), Instr('load', 1), Instr('ret')]
+        items, removed = licm.hoist(body, {'f': meta})
+        self.assertEqual(items[:11], [Label('f'), Instr('store', 0),
+            Instr('load', 0), Instr('push', 3), Instr('shl'), Instr('store', 2),
+            Instr('load', 0), Instr('inc'), Instr('store', 3),
+            Instr('jmp', 'cond'), Label('enter')])
+        self.assertEqual(items[11:14], [Instr('load', 1), Instr('load', 2),
+                                        Instr('add')])
+        self.assertEqual(items[15:19], [Label('cond'), Instr('load', 1),
+                                        Instr('load', 3), Instr('lt')])
+        self.assertEqual(removed['loop-instructions'], 3)
+        self.assertEqual(len(meta.locals), 3)
+
+    def test_variant_and_trapping_expressions(self):
+        meta = FnMeta('f', {}, {'i': VariableMeta(0)})
+        body = [Label('f'), Label('loop'), Instr('load', 0), Instr('push', 2),
+            Instr('add'), Instr('store', 0), Instr('push', 8), Instr('push', 2),
+            Instr('div'), Instr('pop'), Instr('jmp', 'loop')]
+        items, removed = licm.hoist(body, {'f': meta})
+        self.assertEqual(items, body)
+        self.assertEqual(removed['loop-instructions'], 0)
+
+    def test_loop_with_several_entries(self):
+        body = [Label('f'), Instr('jift', 'inside'), Label('loop'),
+            Instr('push', 1), Instr('push', 2), Instr('add'), Instr('pop'),
+            Label('inside'), Instr('jmp', 'loop')]
+        items, _ = licm.hoist(body, {'f': FnMeta('f', {}, {})})
+        self.assertEqual(items, body)
+
+
+class RustycLayoutCases(unittest.TestCase):
+    def test_threaded_jumps(self):
+        body = [Label('f'), Instr('load', 0), Instr('jift', 'a'),
+            Instr('push', 1), Instr('store', 0), Instr('jmp', 'b'), Label('a'),
+            Instr('jmp', 'c'), Label('b'), Instr('jmp', 'c'), Label('c'),
+            Instr('load', 0), Instr('load', 1), Instr('add'), Instr('push', 1),
+            Instr('add'), Instr('call', 'f'), Instr('ret')]
+        items, removed = layout.arrange(body, ['f'])
+        self.assertEqual(items, [Label('f'), Instr('load', 0),
+            Instr('jift', 'c'), Instr('push', 1), Instr('store', 0),
+            *body[10:]])
+        self.assertEqual(removed['jumps'], 3)
+
+    def test_loop_entry_and_inverted_condition(self):
+        program = frontend('''fn f(b: bool) -> u64 {
+            let mut x = 1; if b { x = 2; } x
+        }
+        fn main() -> u64 {
+            let mut i = 0; while i < 10 { i += 1; } i + f(true) + f(false) * 10
+        }''')
+        items, _ = layout.arrange(program, ['main', 'f'])
+        self.assertNotIn('jmp', [ item.op for item in items
+                                  if isinstance(item, Instr) ])
+        self.assertIn(Instr('jiff', '.0_fi_utlbl'), items)
+        self.assertEqual(execute(items), execute(program))
+
+    def test_duplicated_return(self):
+        program = frontend('''fn g(x: u64) -> u64 { x + 1 }
+        fn f(x: u64) -> u64 { if x > 3 { g(x) } else { g(x * 2) } }
+        fn main() -> u64 { f(1) + f(5) }''')
+        items, _ = layout.arrange(program, ['main', 'f', 'g'])
+        self.assertEqual(execute(items), execute(program))
+        items, removed = peephole.optimize(items, keep=['main', 'f', 'g'])
+        self.assertEqual(removed['tail-call'], 2)
+        self.assertNotIn(Instr('call', 'g'), items)
+
+
+class RustycSsaCases(unittest.TestCase):
+    PROGRAM = '''fn f(n: u64) -> u64 {
+    let mut s = 0;
+    let mut i = 0;
+    while i < n {
+        let mut j = 0;
+        while j < i { s = s + i * j; j += 1; }
+        i += 1;
+    }
+    s
+}
+fn main() -> u64 { let k = 2; f(k * 3) + f(4) }'''
+
+    def translate(self):
+        lexer = RustyLexer(antlr4.InputStream(self.PROGRAM))
+        parser = RustyParser(antlr4.CommonTokenStream(lexer))
+        listener = FERListener()
+        return translate_items(parser, listener), listener.functions
+
+    def build(self, name: str) -> ssa.Function:
+        program, functions = self.translate()
+        _, bodies = dce.split_functions(program, functions)
+        results = ssa.result_counts(bodies, functions)
+        return ssa.build_function(bodies[name], functions[name], functions, results)
+
+    def test_loop_phis(self):
+        function = self.build('f')
+        header = next(block for block in function.blocks
+                      if block.label == '.0_predlo_cond_utlbl')
+        # s and i, j is defined inside the loop
+        self.assertEqual(len(header.phis), 2)
+        self.assertEqual(len(header.predecessors), 2)
+        self.assertEqual([ value.op for value in header.instructions ], ['lt'])
+
+    def test_dominators_and_loops(self):
+        function = self.build('f')
+        tree = ssa.DominatorTree(function)
+        self.assertTrue(all(tree.dominates(function.entry, block)
+                            for block in function.blocks))
+        loops = ssa.loop_nest(function, tree)
+        self.assertEqual([ loop.depth for loop in loops ], [1, 2])
+        outer, inner = loops
+        self.assertIs(inner.parent, outer)
+        self.assertTrue(inner.blocks < outer.blocks)
+        self.assertTrue(all(tree.dominates(outer.header, block)
+                            for block in outer.blocks))
+
+    def test_inconsistent_stack(self):
+        functions = {'f': FnMeta('f', {}, {})}
+        body = [Label('f'), Label('loop'), Instr('push', 1), Instr('jmp', 'loop')]
+        self.assertIsNone(ssa.build_function(body, functions['f'], functions,
+                                             {'f': 0}))
+        items, _ = ssaopt.optimize(body, functions)
+        self.assertEqual(items, body)
+
+    def test_lowering(self):
+        program, functions = self.translate()
+        items, stats = ssaopt.optimize(program, functions)
+        self.assertEqual(execute(items), execute(program))
+        # k stays on the stack and k * 3 is evaluated at compile time
+        self.assertEqual(stats['load-store'], 2)
+        self.assertEqual(stats['constant-folding'], 1)
+        main = items[items.index(Label('main')):]
+        self.assertEqual(main[:3], [Label('main'), Instr('push', 6),
+                                    Instr('call', 'f')])
+
+    def test_custom_pass(self):
+        def count_calls(function: ssa.Function, stats):
+            stats['calls'] += sum(1 for value in function.values()
+                                  if value.op == 'call')
+
+        program, functions = self.translate()
+        passes = [ssaopt.SsaPass('calls', count_calls)]
+        items, stats = ssaopt.optimize(program, functions, passes)
+        self.assertEqual(stats['calls'], 2)
+        self.assertEqual(execute(items), execute(program))
+
+
+class RustycPartialEvaluationCases(unittest.TestCase):
+    def evaluate(self, program: str, budget: int = partial.DEFAULT_BUDGET):
+        lexer = RustyLexer(antlr4.InputStream(program))
+        parser = RustyParser(antlr4.CommonTokenStream(lexer))
+        listener = FERListener()
+        items = translate_items(parser, listener)
+        program, evaluated = partial.evaluate(items, listener.functions, budget)
+        self.assertEqual(execute(program), execute(items))
+        return program, evaluated
+
+    def test_recursive_function(self):
+        program, evaluated = self.evaluate('''fn fact(n: u64) -> u64 {
+            if n < 2 { return 1; } n * fact(n - 1)
+        }
+        fn main() -> u64 { let a = 5; fact(a) + fact(a + 1) }''')
+        self.assertEqual(program[-3:], [Label('main'), Instr('push', 840), Instr('ret')])
+        self.assertEqual(evaluated['partial-evaluation'], 2)
+
+    def test_budget(self):
+        program = '''fn sum(n: u64) -> u64 {
+            let mut s = 0; let mut i = 0; while i < n { i += 1; s += i; } s
+        }
+        fn main() -> u64 { sum(100) }'''
+        items, evaluated = self.evaluate(program, budget=100)
+        self.assertIn(Instr('call', 'sum'), items)
+        self.assertEqual(evaluated['partial-evaluation'], 0)
+        items, _ = self.evaluate(program)
+        self.assertEqual(items[-3:], [Label('main'), Instr('push', 5050),
+                                      Instr('ret')])
+
+    def test_trap_and_float(self):
+        program, evaluated = self.evaluate('''fn rem(x: u64) -> u64 { 10 % x }
+        fn half(x: u64) -> u64 { x / 2 }
+        fn g(c: u64) -> u64 { if c > 1 { rem(0) } else { half(3) } }
+        fn main() -> u64 { g(1) }''')
+        self.assertIn(Instr('call', 'rem'), program)
+        self.assertIn(Instr('call', 'half'), program)
+        self.assertIn(Instr('call', 'g'), program)
+        self.assertEqual(evaluated['partial-evaluation'], 0)
+
+
+class RustycProfileCases(unittest.TestCase):
+    SOURCE = '''fn weight(x: u64) -> u64 { if x % 8 != 0 { x + 1 } else { x * 3 } }
+    fn rare(x: u64) -> u64 { x * 7 }
+    fn sum(n: u64) -> u64 {
+        let mut s = 0; let mut i = 0;
+        while i < n { s += weight(i); i += 1; }
+        if s > 100000 { s = rare(s) + rare(1); }
+        s
+    }
+    fn main() -> u64 { sum(COUNT) + sum(1) }'''
+
+    def translate(self, program: str):
+        lexer = RustyLexer(antlr4.InputStream(program))
+        parser = RustyParser(antlr4.CommonTokenStream(lexer))
+        listener = FERListener()
+        return translate_items(parser, listener), listener.functions
+
+    def record(self, source: str) -> dict:
+        program, functions = self.translate(source)
+        code, labels = assemble(program)
+        vm = VM(profile=True)
+        vm.load_program(code)
+        with np.errstate(all='ignore'):
+            vm.run()
+        entries = [ container.FunctionEntry(name, labels[name]) for name in functions ]
+        return vm.profile.to_dict(code, entries)
+
+    def bind(self, measured: dict, source: str):
+        program, functions = self.translate(source)
+        program = list(program)
+        return pgo.Profile(measured).bind(program, program, functions), \
+            program, functions
+
+    def test_unchanged_functions(self):
+        measured = self.record(self.SOURCE.replace('COUNT', '40'))
+        changed = 'fn extra(x: u64) -> u64 { if x > 1 { 1 } else { 2 } }\n' \
+            + self.SOURCE.replace('COUNT', '40') + ' fn other() { }'
+        profile, program, _ = self.bind(measured, changed.replace('sum(1)', 'extra(1)'))
+        labels = [ item.name for item in program if isinstance(item, Label) ]
+        self.assertEqual(profile.count('weight'), 41)
+        self.assertEqual(profile.count('sum'), 2)
+        self.assertEqual(profile.count(next(label for label in labels
+                                            if 'predlo_enter' in label)), 41)
+        self.assertEqual([ profile.count(label) for label in labels
+                           if label.endswith('then_utlbl') ], [None, 35, 0])
+        self.assertIsNone(profile.count('extra'))
+        self.assertIsNone(profile.count('other'))
+
+    def test_guided_optimizations(self):
+        profile, program, functions = self.bind(self.record(self.SOURCE.replace('COUNT', '40')),
+                                                self.SOURCE.replace('COUNT', '40'))
+        items, inlined = inline.inline(program, functions, profile=profile)
+        self.assertEqual(inlined['calls'], 1)
+        self.assertIn(Instr('call', 'rare'), items)
+        _, inlined = inline.inline(program, functions)
+        self.assertEqual(inlined['calls'], 3)
+
+        weight = program[program.index(Label('weight')):program.index(Label('rare'))]
+        items, _ = layout.arrange(weight, ['weight'])
+        self.assertNotIn('jiff', [ item.op for item in items
+                                   if isinstance(item, Instr) ])
+        items, _ = layout.arrange(weight, ['weight'], profile)
+        self.assertIn('jiff', [ item.op for item in items
+                                if isinstance(item, Instr) ])
+        self.assertEqual(execute([Instr('push', 3), Instr('call', 'weight'),
+                                  Instr('stop'), *items]), [4])
+
+        _, unrolled = unroll.unroll(program, functions, profile=profile)
+        self.assertEqual(unrolled['unrolled'], 1)
+        profile, program, functions = self.bind(self.record(self.SOURCE.replace('COUNT', '2')),
+                                                self.SOURCE.replace('COUNT', '2'))
+        _, unrolled = unroll.unroll(program, functions, profile=profile)
+        self.assertEqual(unrolled['unrolled'], 0)
+
+
+class RustycCacheCases(unittest.TestCase):
+    SOURCE = '''fn abs(x: u64, y: u64) -> u64 { if x > y { x - y } else { y - x } }
+    fn dist(n: u64) -> u64 {
+        let mut i = 0; let mut s = 0;
+        while i < n { s += abs(i, 3); i += 1; }
+        s
+    }
+    fn main() -> u64 { dist(5) }'''
+
+    def translate(self, program: str, directory: str, **options):
+        lexer = RustyLexer(antlr4.InputStream(program))
+        parser = RustyParser(antlr4.CommonTokenStream(lexer))
+        listener = FERListener(**options)
+        functions = cache.FunctionCache(directory, **options)
+        items = cache.translate(parser, listener, functions)
+        return serialize(items), listener.functions, functions
+
+    def test_unchanged_functions(self):
+        with tempfile.TemporaryDirectory() as directory:
+            text, _, functions = self.translate(self.SOURCE, directory)
+            self.assertEqual((functions.hits, functions.misses), (0, 3))
+            self.assertEqual(text, translate(self.SOURCE))
+
+            text, metas, functions = self.translate(self.SOURCE, directory)
+            self.assertEqual((functions.hits, functions.misses), (3, 0))
+            self.assertEqual(text, translate(self.SOURCE))
+            self.assertEqual(metas['dist'].locals,
+                             {'i': VariableMeta(1, True), 's': VariableMeta(2, True)})
+            self.assertEqual(metas['dist'].line, 2)
+
+            # labels of cached functions are renumbered after the new one
+            changed = 'fn sign(x: u64) -> u64 { if x > 0 { 1 } else { 0 } }\n' \
+                + self.SOURCE.replace('dist(5)', 'dist(6) + sign(2)')
+            text, metas, functions = self.translate(changed, directory)
+            self.assertEqual((functions.hits, functions.misses), (2, 2))
+            self.assertEqual(text, translate(changed))
+            self.assertEqual(metas['dist'].line, 3)
+
+    def test_callee_signature_and_mode(self):
+        with tempfile.TemporaryDirectory() as directory:
+            self.translate(self.SOURCE, directory)
+            changed = self.SOURCE.replace('fn abs(x: u64, y: u64) -> u64',
+                                          'fn abs(x: u64, y: u32) -> u64')
+            _, _, functions = self.translate(changed, directory)
+            self.assertEqual((functions.hits, functions.misses), (1, 2))
+            _, _, functions = self.translate(changed, directory, fold_constants=True)
+            self.assertEqual((functions.hits, functions.misses), (0, 3))
+
+    def test_translation_modules(self):
+        self.assertIn(consteval, cache.TRANSLATION_MODULES)
+        with tempfile.TemporaryDirectory() as directory:
+            salt = cache.FunctionCache(directory).salt
+            with tempfile.NamedTemporaryFile('w', suffix='.py') as fp:
+                fp.write('# changed constant evaluation\n')
+                fp.flush()
+                module = type(consteval)('consteval')
+                module.__file__ = fp.name
+                modules = tuple(module if m is consteval else m
+                                for m in cache.TRANSLATION_MODULES)
+                with unittest.mock.patch.object(cache, 'TRANSLATION_MODULES', modules):
+                    self.assertNotEqual(cache.FunctionCache(directory).salt, salt)
+
+
+class RustycLinkerCases(unittest.TestCase):
+    LIBRARY = '''fn gcd(a: u64, b: u64) -> u64 { if b == 0 { a } else { gcd(b, a % b) } }
+    fn twice(n: u64) -> u64 { scale(n, 2) }'''
+    UTILS = 'fn scale(n: u64, k: u64) -> u64 { n * k }'
+    APP = 'fn main() -> u64 { gcd(84, 36) + twice(5) * 100 }'
+
+    def compile(self, program: str) -> linker.ObjectFile:
+        lexer = RustyLexer(antlr4.InputStream(program))
+        parser = RustyParser(antlr4.CommonTokenStream(lexer))
+        listener = FERListener(entry=None)
+        items = translate_items(parser, listener)
+        relocations = []
+        code, labels = assemble(items, relocations)
+        functions = [ container.FunctionEntry(name, labels[name], len(fn.parameters),
+                                              len(fn.locals))
+                      for name, fn in listener.functions.items() ]
+        obj = linker.ObjectFile(container.Container(code, 0, functions), relocations)
+        return linker.unpack(linker.pack(obj))
+
+    def run_program(self, program: container.Container) -> list:
+        vm = VM(False)
+        vm.load_program(program.code, program.entry)
+        vm.run()
+        return [ int(value) for value in vm.ctx.operands_stack ]
+
+    def test_link(self):
+        library, utils, app = map(self.compile, (self.LIBRARY, self.UTILS, self.APP))
+        self.assertEqual(library.exports, ['gcd', 'twice'])
+        self.assertEqual(library.imports, {'scale'})
+        self.assertEqual(app.imports, {'gcd', 'twice'})
+        self.assertEqual(utils.relocations, [])
+        for objects in ([app, library, utils], [utils, library, app]):
+            program = linker.link(objects)
+            self.assertEqual(self.run_program(program), [1012])
+            self.assertEqual(sorted(fn.name for fn in program.functions),
+                             ['gcd', 'main', 'scale', 'twice'])
+            twice = next(fn for fn in program.functions if fn.name == 'twice')
+            self.assertEqual(twice.max_stack, 2)
+
+    def test_errors(self):
+        library, utils, app = map(self.compile, (self.LIBRARY, self.UTILS, self.APP))
+        with self.assertRaisesRegex(linker.LinkError, 'undefined function scale'):
+            linker.link([app, library])
+        with self.assertRaisesRegex(linker.LinkError, 'scale is defined more than once'):
+            linker.link([app, library, utils, utils])
+        with self.assertRaisesRegex(linker.LinkError, 'entry function main'):
+            linker.link([library, utils])
+        with self.assertRaises(linker.LinkError):
+            linker.unpack(b'{"format": "rustyc-object"}')
+        broken = linker.ObjectFile(utils.program, [(0, 'gcd')])
+        with self.assertRaisesRegex(linker.LinkError, 'is not a call'):
+            linker.unpack(linker.pack(broken))
+
+    def test_imported_function_is_not_evaluated(self):
+        lexer = RustyLexer(antlr4.InputStream(self.APP))
+        parser = RustyParser(antlr4.CommonTokenStream(lexer))
+        listener = FERListener(entry=None)
+        items = translate_items(parser, listener)
+        program, evaluated = partial.evaluate(items, listener.functions)
+        self.assertIn(Instr('call', 'gcd'), program)
+        self.assertEqual(evaluated['partial-evaluation'], 0)
+
+
+class RustycPassManagerCases(unittest.TestCase):
+    def test_levels_and_disabled_passes(self):
+        def frontend_pass(compilation):
+            compilation.program = [Label('main'), Instr('push', 1), Instr('nop'),
+                                   Instr('nop'), Instr('ret')]
+
+        def drop_nop(compilation):
+            program = compilation.program
+            compilation.program = [ item for item in program if item != Instr('nop') ]
+            return Counter({'nop': len(program) - len(compilation.program)})
+
+        passes = [Pass('frontend', frontend_pass, optimization=False),
+                  Pass('nop', drop_nop, 1), Pass('late', drop_nop, 3)]
+        manager = PassManager(passes, 2)
+        compilation = manager.run(Compilation(None))
+        self.assertEqual([ timing.name for timing in manager.timings ],
+                         ['frontend', 'nop'])
+        self.assertEqual([ (timing.before, timing.after)
+                           for timing in manager.timings ], [(0, 4), (4, 2)])
+        self.assertEqual(compilation.removed, {'nop': Counter({'nop': 2})})
+        self.assertEqual(manager.report()[-1][:7], 'total: ')
+
+        manager = PassManager(passes, 3, disabled=['nop', 'frontend'])
+        compilation = manager.run(Compilation(None))
+        self.assertEqual([ timing.name for timing in manager.timings ],
+                         ['frontend', 'late'])
+
+
+class RustycPeepholeCases(unittest.TestCase):
+    def test_inverted_branch(self):
+        program = frontend('fn main() { let mut a = 1; if a < 2 { a = 3; } }')
+        items, removed = peephole.optimize(program, keep=['main'])
+        self.assertEqual(items[7:10], [Instr('ge'), Instr('jift', '.0_fi_utlbl'),
+                                      Instr('push', 3)])
+        self.assertEqual(removed['inverted-branch'], 1)
+        self.assertNotIn(Label('.1_then_utlbl'), items)
+
+    def test_unreachable_after_return(self):
+        items, removed = peephole.optimize([Label('main'), Instr('push', 1),
+            Instr('ret'), Instr('push', 2), Instr('ret')], keep=['main'])
+        self.assertEqual(items, [Label('main'), Instr('push', 1), Instr('ret')])
+        self.assertEqual(removed['unreachable'], 2)
+
+    def test_trailing_return_after_branches(self):
+        program = frontend('''fn f(x: u64) -> u64 {
+            if x > 1 { return 1; } else { return 2; }
+        }
+        fn main() { f(1) }''')
+        items, _ = peephole.optimize(program, keep=['main', 'f'])
+        self.assertEqual(items[:10], [Instr('call', 'main'), Instr('stop'),
+            Label('f'), Instr('dup'), Instr('store', 0), Instr('push', 1),
+            Instr('gt'), Instr('jift', '.1_then_utlbl'), Instr('push', 2),
+            Instr('ret')])
+        self.assertEqual(items[10:13], [Label('.1_then_utlbl'),
+                                        Instr('push', 1), Instr('ret')])
+
+    def test_store_load(self):
+        items, removed = peephole.optimize([Instr('store', 1), Instr('load', 1),
+            Instr('load', 2), Instr('store', 2), Instr('nop')])
+        self.assertEqual(items, [Instr('dup'), Instr('store', 1)])
+        self.assertEqual(removed['store-load'], 0)
+        self.assertEqual(removed['self-assignment'], 2)
+        self.assertEqual(removed['nop'], 1)
+
+    def test_constant_branch(self):
+        items, _ = peephole.optimize([Label('a'), Instr('push', 1),
+            Instr('jift', 'b'), Instr('push', 0), Instr('jift', 'a'),
+            Label('b'), Instr('ret')])
+        self.assertEqual(items, [Instr('ret')])
+        items, _ = peephole.optimize([Label('a'), Instr('push', 0),
+            Instr('jiff', 'b'), Instr('push', 1), Instr('jiff', 'a'),
+            Label('b'), Instr('ret')])
+        self.assertEqual(items, [Instr('ret')])
+
+    def test_zero_test(self):
+        items, removed = peephole.optimize([Label('a'), Instr('load', 0),
+            Instr('push', 0), Instr('eq'), Instr('jift', 'a'), Instr('load', 1),
+            Instr('push', 0), Instr('neq'), Instr('jiff', 'a'), Instr('ret')])
+        self.assertEqual(items, [Label('a'), Instr('load', 0),
+            Instr('jiff', 'a'), Instr('load', 1), Instr('jiff', 'a'),
+            Instr('ret')])
+        self.assertEqual(removed['redundant-test'], 4)
+
+    def test_tail_call(self):
+        program = frontend('''fn gcd(a: u64, b: u64) -> u64 {
+            if b == 0 { return a; }
+            return gcd(b, a % b);
+        }
+        fn main() { gcd(4, 6) }''')
+        items, removed = peephole.optimize(program, keep=['main', 'gcd'])
+        self.assertNotIn(Instr('call', 'gcd'), items)
+        self.assertEqual(items[-4:], [Label('main'), Instr('push', 4),
+                                      Instr('push', 6), Instr('tcall', 'gcd')])
+        self.assertEqual(removed['tail-call'], 2)
+
+    def test_strength_reduction(self):
+        items, removed = peephole.optimize([Instr('load', 0), Instr('push', 8),
+            Instr('mul'), Instr('push', 16), Instr('load', 1), Instr('mul'),
+            Instr('push', 4), Instr('mod'), Instr('push', 1), Instr('mul'),
+            Instr('push', 6), Instr('mul')])
+        self.assertEqual(items, [Instr('load', 0), Instr('push', 3),
+            Instr('shl'), Instr('load', 1), Instr('push', 4), Instr('shl'),
+            Instr('push', 3), Instr('and'), Instr('push', 6), Instr('mul')])
+        self.assertEqual(removed['strength-reduction'], 2)
+
+    def test_strength_reduction_with_division(self):
+        # div gives floating point values, shl and and do not accept them
+        program = [Instr('load', 0), Instr('push', 8), Instr('mul'),
+                   Instr('load', 1), Instr('push', 3), Instr('div'),
+                   Instr('push', 4), Instr('mod'), Instr('load', 2),
+                   Instr('push', 1), Instr('and'), Instr('push', 2), Instr('mul')]
+        items, removed = peephole.optimize(program)
+        self.assertEqual(items, program[:-2] + [Instr('push', 1), Instr('shl')])
+        self.assertEqual(removed['strength-reduction'], 0)
+        items, _ = peephole.optimize([Label('f'), Instr('call', 'g'),
+                                      Instr('push', 2), Instr('mul')], keep=['f'])
+        self.assertIn(Instr('mul'), items)
+
+    def test_division_at_every_level(self):
+        source = '''fn f(a: u64, b: u64) -> u64 { (a / b) * 2 }
+        fn g(a: u64, b: u64) -> u64 { (a / b) % 4 }
+        fn h(a: u64, b: u64) -> u64 { let q = a / b; q * 8 + q % 2 }
+        fn main() { f(7, 2) + g(15, 2) + h(9, 4) }'''
+        results = []
+        with tempfile.TemporaryDirectory() as directory:
+            path = os.path.join(directory, 'div.rs')
+            with open(path, 'w', encoding='utf-8') as fp:
+                fp.write(source)
+            for level in range(4):
+                args = rustyc_main.args_parser().parse_args(
+                    [f'-O{level}', '--emit', 'bin', path])
+                compilation = PassManager(rustyc_main.pipeline(), level).run(
+                    Compilation(args))
+                program = container.unpack(compilation.output)
+                vm = VM(False)
+                vm.load_program(program.code, program.entry)
+                vm.run()
+                results.append(list(vm.ctx.operands_stack))
+        self.assertEqual(results[0], [7.0 + 3.5 + 2.25 * 8 + 0.25])
+        self.assertEqual(results, results[:1] * 4)
+
+    def test_increment(self):
+        program = frontend('fn main() { let mut a = 1; a += 1; a -= 1; }')
+        items, removed = peephole.optimize(program, keep=['main'])
+        self.assertIn(Instr('inc'), items)
+        self.assertIn(Instr('dec'), items)
+        self.assertEqual(removed['increment'], 2)
+
+
 if __name__ == '__main__':
     unittest.main()
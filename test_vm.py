@@ -1,9 +1,15 @@
 #!/usr/bin/env python3
+import io
+import os
+import tempfile
 import unittest
 import numpy as np
 
-from rusty.decenc import encode_program, decode_program
-from rusty import isa, traps
+from rusty.decenc import encode_program, decode_program, iter_decode, \
+    collect_targets, disassemble, encode_compact, decode_compact, \
+    iter_decode_compact, zigzag, unzigzag
+from rusty import isa, traps, container
+from rusty.asm import AssemblyError, assemble
 from rusty.vm import VM
 
 
@@ -11,7 +17,9 @@ TEST_PROGRAMS = [
     [isa.Stop()],
     [isa.Push(24), isa.Stop()],
     [isa.Call(1), isa.Return(), isa.Stop()],
-    [isa.Push(6), isa.Push(8), isa.Add(), isa.Stop()]
+    [isa.Push(6), isa.Push(8), isa.Add(), isa.Stop()],
+    [isa.Call(2), isa.Stop(), isa.TailCall(1), isa.Return()],
+    [isa.Push(0), isa.JumpIfFalse(2), isa.Push(1), isa.Stop()]
 ]
 
 
@@ -35,6 +43,180 @@ class RustyEncodingDecodingCases(unittest.TestCase):
             self.assertEqual(program, decoded_program)
 
 
+class RustyCompactEncodingCases(unittest.TestCase):
+    def test_zigzag(self):
+        for number, code in ((0, 0), (-1, 1), (1, 2), (-2, 3), (2, 4),
+                             (2**63 - 1, 2**64 - 2), (-(2**63), 2**64 - 1)):
+            self.assertEqual(zigzag(number), code)
+            self.assertEqual(unzigzag(code), number)
+
+    def test_encode_decode(self):
+        programs = TEST_PROGRAMS + [
+            [isa.Push(arg) for arg in (0, 1, -1, 63, 64, -64, -65, 2**32,
+                                       2**63 - 1, -(2**63), 2**64 - 1)],
+            [isa.Jump(-3), isa.JumpIfTrue(3), isa.JumpIfFalse(-2),
+             isa.Call(-300), isa.Load(0)]
+        ]
+        for program in programs:
+            encoded_program = encode_compact(program)
+            self.assertEqual(decode_compact(encoded_program), program)
+            for chunk_size in (1, 2, 3, 4096):
+                decoded_program = list(iter_decode_compact(
+                    io.BytesIO(encoded_program), chunk_size))
+                self.assertEqual(decoded_program, program)
+
+    def test_size(self):
+        program = [isa.Load(0), isa.Push(1), isa.Add(), isa.Store(0),
+                   isa.Jump(-4), isa.Return()]
+        self.assertEqual(len(encode_compact(program)), 10)
+
+    def test_truncated(self):
+        encoded_program = encode_compact([isa.Push(2**40)])
+        with self.assertRaises(traps.IllegalInstructionTrap):
+            decode_compact(encoded_program[:-1])
+
+    def test_container(self):
+        program = [isa.Call(2), isa.Stop(), isa.Push(-5), isa.Return()]
+        packed = container.pack(container.Container(program), compact=True)
+        header = container.parse_header(packed)
+        self.assertTrue(header.flags & container.FLAG_COMPACT)
+        self.assertEqual(container.unpack(packed).code, program)
+
+
+class RustyDisassemblerCases(unittest.TestCase):
+    def test_iter_decode(self):
+        for program in TEST_PROGRAMS:
+            encoded_program = encode_program(program)
+            for chunk_size in (1, 8, 12, 16, 4096):
+                decoded_program = list(iter_decode(io.BytesIO(encoded_program),
+                                                   chunk_size))
+                self.assertEqual(program, decoded_program)
+
+    def test_iter_decode_truncated(self):
+        encoded_program = encode_program([isa.Push(1), isa.Stop()])
+        with self.assertRaises(traps.IllegalInstructionTrap):
+            list(iter_decode(io.BytesIO(encoded_program[:-3]), 8))
+
+    def test_disassemble_labels(self):
+        program = [isa.Call(3), isa.Stop(), isa.Return(), isa.Push(0),
+                   isa.JumpIfTrue(2), isa.Jump(-3), isa.Call(-4), isa.Return()]
+        calls, jumps, count = collect_targets(program)
+        self.assertEqual(calls, {3, 2})
+        self.assertEqual(jumps, {6, 2})
+        self.assertEqual(count, len(program))
+        self.assertEqual(list(disassemble(program, calls, jumps, count)), [
+            '\tcall fn_3', '\tstop', 'fn_2:', '.2_lbl:', '\tret', 'fn_3:',
+            '\tpush 0', '\tjift .6_lbl', '\tjmp .2_lbl', '.6_lbl:',
+            '\tcall fn_2', '\tret'])
+
+    def test_disassemble_out_of_range(self):
+        program = [isa.Jump(5), isa.Jump(-2)]
+        calls, jumps, count = collect_targets(program)
+        self.assertEqual(list(disassemble(program, calls, jumps, count)),
+                         ['\tjmp 5', '\tjmp -2'])
+
+
+class RustyContainerCases(unittest.TestCase):
+    def test_pack_unpack(self):
+        for program in TEST_PROGRAMS:
+            functions = [container.FunctionEntry('main', 0, 1, 2, 3)]
+            lines = [(0, 1), (len(program) - 1, 2)]
+            packed = container.pack(container.Container(program, 0, functions, lines))
+            self.assertTrue(container.is_container(packed))
+            header = container.parse_header(packed)
+            self.assertEqual(header.code_offset % container.CODE_ALIGNMENT, 0)
+            unpacked = container.unpack(packed)
+            self.assertEqual(unpacked.code, program)
+            self.assertEqual(unpacked.functions, functions)
+            self.assertEqual(unpacked.lines, lines)
+
+    def test_checksum_mismatch(self):
+        packed = bytearray(container.pack(container.Container([isa.Stop()])))
+        packed[-1] ^= 0xff
+        with self.assertRaises(traps.InvalidContainerTrap):
+            container.unpack(packed)
+
+    def test_load_corrupted_file(self):
+        packed = container.pack(container.Container([isa.Push(1), isa.Stop()],
+                                                    lines=[(0, 1)]))
+        checksum, flags = bytearray(packed), bytearray(packed)
+        checksum[-1] ^= 0xff
+        flags[6] = 0x80
+        with tempfile.TemporaryDirectory() as directory:
+            path = os.path.join(directory, 'program.bin')
+            for corrupted in (checksum, flags):
+                with open(path, 'wb') as fp:
+                    fp.write(corrupted)
+                with self.assertRaises(traps.InvalidContainerTrap):
+                    container.load(path)
+            with open(path, 'wb') as fp:
+                fp.write(packed)
+            self.assertEqual(container.load(path).code, [isa.Push(1), isa.Stop()])
+
+    def test_bare_program_is_not_container(self):
+        for program in TEST_PROGRAMS:
+            self.assertFalse(container.is_container(encode_program(program)))
+
+    def test_entry(self):
+        program = [isa.Push(1), isa.Stop()]
+        loaded = container.unpack(container.pack(container.Container(program, 1)))
+        vm = VM()
+        vm.load_program(loaded.code, loaded.entry)
+        vm.run()
+        self.assertEqual(vm.ctx.operands_stack, [])
+
+
+class RustyAssemblerCases(unittest.TestCase):
+    def test_labels_and_comments(self):
+        source = '''\tcall main # entry
+\tstop
+fact: ; factorial
+\tstore 0
+\tload 0
+\tjift .1_then
+\tpush 1
+\tret
+.1_then: load 0
+\tpush 0x1
+\tsub
+\tcall fact
+\tret
+main:
+\tpush 11
+\tcall fact
+\tret'''
+        self.assertEqual(list(assemble(source.split('\n'))), [
+            isa.Call(12), isa.Stop(), isa.Store(0), isa.Load(0),
+            isa.JumpIfTrue(3), isa.Push(1), isa.Return(), isa.Load(0),
+            isa.Push(1), isa.Substract(), isa.Call(-8), isa.Return(),
+            isa.Push(11), isa.Call(-11), isa.Return()])
+
+    def test_numeric_offsets(self):
+        self.assertEqual(list(assemble(['0: jmp 2', '1: jift -1', 'stop'])),
+                         [isa.Jump(2), isa.JumpIfTrue(-1), isa.Stop()])
+
+    def test_disassemble_roundtrip(self):
+        program = [isa.Call(3), isa.Stop(), isa.Return(), isa.Push(-7),
+                   isa.JumpIfTrue(2), isa.Jump(-3), isa.Call(-4), isa.Return()]
+        calls, jumps, count = collect_targets(program)
+        lines = disassemble(program, calls, jumps, count)
+        self.assertEqual(list(assemble(lines)), program)
+
+    def test_errors(self):
+        sources = {
+            'stop\nfrob': 2,
+            'push': 1,
+            'stop 1': 1,
+            'push x': 1,
+            'a:\na:': 2,
+            'stop\n\njmp nowhere': 3,
+        }
+        for source, line_no in sources.items():
+            with self.assertRaises(AssemblyError) as cm:
+                list(assemble(source.split('\n')))
+            self.assertEqual(cm.exception.line_no, line_no)
+
+
 class RustyVMCases(unittest.TestCase):
     def test_simplest_program(self):
         program = [isa.Stop()]
@@ -64,6 +246,21 @@ class RustyVMCases(unittest.TestCase):
             vm.load_program(program)
             self.assertEqual(vm.size(), len(program))
 
+    def test_profile(self):
+        program = [isa.Push(3), isa.Duplicate(), isa.JumpIfFalse(4),
+                   isa.Decrement(), isa.Jump(-3), isa.Stop(), isa.Stop()]
+        vm = VM(profile=True)
+        vm.load_program(program)
+        with np.errstate(all='ignore'):
+            vm.run()
+        self.assertEqual(vm.profile.hits, {0: 1, 1: 4, 2: 4, 3: 3, 4: 3, 6: 1})
+        profile = vm.profile.to_dict(program, [container.FunctionEntry('main', 0)])
+        self.assertEqual(profile['functions'],
+                         [{'name': 'main', 'address': 0, 'size': 7}])
+        self.assertEqual(profile['hits']['1'], 4)
+        self.assertEqual(profile['branches'], {'2': {'taken': 1, 'count': 4}})
+        self.assertIsNone(VM().profile)
+
 
 class VMInstructionsCases(unittest.TestCase):
     def test_push(self):
@@ -110,6 +307,52 @@ class VMInstructionsCases(unittest.TestCase):
         with self.assertRaises(traps.StackUnderflowTrap):
             vm.next()
 
+    def test_tcall(self):
+        vm = VM()
+        vm.load_program([isa.Push(5), isa.TailCall(2), isa.Stop(),
+                         isa.Store(0), isa.Return()])
+        vm.ctx.frames.append(isa.Frame(2))
+        vm.ctx.frames[0].variables[1] = 7
+        vm.next()
+        vm.next()
+        self.assertEqual(vm.ctx.ip, 3)
+        self.assertEqual(len(vm.ctx.frames), 1)
+        self.assertEqual(vm.ctx.frames[0].variables, {})
+        vm.run()
+        self.assertEqual(vm.ctx.frames, [])
+
+        vm.load_program([isa.TailCall(0)])
+        with self.assertRaises(traps.StackUnderflowTrap):
+            vm.next()
+
+    def test_tail_recursion_frames(self):
+        # countdown from 1000 by tail recursion
+        program = [isa.Push(1000), isa.Call(2), isa.Stop(), isa.Store(0),
+                   isa.Load(0), isa.JumpIfTrue(3), isa.Load(0), isa.Return(),
+                   isa.Load(0), isa.Decrement(), isa.TailCall(-7)]
+        vm = VM()
+        vm.load_program(program)
+        depth = 0
+        while not vm.is_halted:
+            vm.next()
+            depth = max(depth, len(vm.ctx.frames))
+        self.assertEqual(depth, 1)
+        self.assertEqual(vm.ctx.operands_stack, [0])
+
+    def test_jiff(self):
+        vm = VM()
+        for cond, ip in ((0, 4), (1, 2), (7, 2)):
+            vm.load_program([isa.Push(cond), isa.JumpIfFalse(3), isa.Stop(),
+                             isa.Stop(), isa.Stop()])
+            vm.next()
+            vm.next()
+            self.assertEqual(vm.ctx.ip, ip)
+            self.assertEqual(vm.ctx.operands_stack, [])
+
+        vm.load_program([isa.JumpIfFalse(0)])
+        with self.assertRaises(traps.StackUnderflowTrap):
+            vm.next()
+
     def _subtest_binop(self, ins_type, f):
         vm = VM()
         program = [ins_type()]